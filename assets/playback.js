@@ -0,0 +1,49 @@
+// Lap playback on the lap page: frames are sent once per lap through store-playback (see playback.PlaybackFrames),
+// then scrubbing and replay only read them in the browser
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    playback: {
+        render_frame: function (lap_time, store) {
+            if (!store || !store.frame_count) {
+                return window.dash_clientside.no_update;
+            }
+            const channel_count = store.channels.length;
+            const position = Math.min(Math.max(Math.floor(lap_time * store.sample_rate + 1e-6), 0),
+                                      store.frame_count - 1);
+            const frame = {};
+            store.channels.forEach(function (channel, j) {
+                frame[channel] = store.frames[position * channel_count + j];
+            });
+            const range = store.acceleration_range;
+            const figure = {
+                data: [{
+                    x: [frame.cg_accel_lateral],
+                    y: [frame.cg_accel_longitudinal],
+                    mode: 'markers',
+                    marker: {size: 12, color: 'orange'},
+                    hoverinfo: 'skip',
+                }],
+                layout: {
+                    height: 175,
+                    width: 175,
+                    margin: {l: 10, r: 10, t: 10, b: 10},
+                    showlegend: false,
+                    xaxis: {range: [-range, range], zeroline: true, showticklabels: false},
+                    yaxis: {range: [-range, range], zeroline: true, showticklabels: false},
+                    paper_bgcolor: 'rgba(0,0,0,0)',
+                    plot_bgcolor: 'rgba(0,0,0,0)',
+                },
+            };
+            return [frame.throttle_pos, frame.brake_pos, frame.clutch_pos, String(frame.gear), figure];
+        },
+        toggle_replay: function (n_clicks, disabled) {
+            return !disabled;
+        },
+        step_replay: function (n_intervals, lap_time, interval, store) {
+            if (!store || !store.frame_count) {
+                return window.dash_clientside.no_update;
+            }
+            const duration = store.frame_count / store.sample_rate;
+            return ((lap_time || 0) + interval / 1000) % duration;
+        },
+    },
+});
@@ -0,0 +1,299 @@
+import argparse
+import json
+import numpy
+import os
+import platform
+import plotly
+import plotly.graph_objects
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from itertools import groupby
+
+from data_container import (DEFAULT_SAMPLE_RATE, DataContainer, general_time_plot, general_xy_plot, read_columns,
+                            read_preamble)
+from spatial_index import LapSpatialIndex
+
+
+# Channels the pipeline relies on, always part of the generated sessions
+REQUIRED_CHANNELS = ['time', 'Lap Number', 'Car Pos Norm', 'Lap Distance', 'Car Coord X', 'Car Coord Y',
+                     'Car Coord Z', 'Ground Speed', 'Throttle Pos', 'Brake Pos', 'Gear', 'Last Sector Time']
+LAP_DURATION = 90.
+SECTOR_COUNT = 3
+TRACK_LENGTH = 3602.
+TRACK_RADIUS = 300.
+
+
+def get_channels(channel_count: int, sample_rates_file: str = 'config/sample_rates.txt') -> list[tuple[str, int]]:
+    # Channels of sample_rates_file, required ones first, completed with numbered extra channels at the default rate
+    if channel_count < len(REQUIRED_CHANNELS):
+        raise ValueError(f'A session needs at least {len(REQUIRED_CHANNELS)} channels')
+    with open(sample_rates_file, 'r') as file:
+        file.readline()
+        sample_rates = dict((title.rstrip(), int(sample_rate))
+                            for title, sample_rate in (line.split('|') for line in file if line.strip()))
+    titles = REQUIRED_CHANNELS + [title for title in sample_rates if title not in REQUIRED_CHANNELS]
+    channels = [(title, sample_rates[title]) for title in titles[:channel_count]]
+    channels += [(f'Extra Channel {i}', DEFAULT_SAMPLE_RATE) for i in range(channel_count - len(channels))]
+    return channels
+
+
+def get_channel_values(title: str, sample_rate: int, duration: float, rng: numpy.random.Generator) -> numpy.ndarray:
+    times = numpy.arange(int(duration * sample_rate)) / sample_rate
+    lap_progress = times / LAP_DURATION
+    match title:
+        case 'time':
+            return numpy.char.mod('%.3f', times)
+        case 'Lap Number':
+            return numpy.char.mod('%d', lap_progress.astype(int))
+        case 'Car Pos Norm':
+            return numpy.char.mod('%.4f', lap_progress % 1)
+        case 'Lap Distance':
+            return numpy.char.mod('%.2f', (lap_progress % 1) * TRACK_LENGTH)
+        case 'Car Coord X':
+            return numpy.char.mod('%.2f', -TRACK_RADIUS * numpy.cos(2 * numpy.pi * lap_progress))
+        case 'Car Coord Y':
+            return numpy.char.mod('%.2f', -TRACK_RADIUS * numpy.sin(2 * numpy.pi * lap_progress))
+        case 'Gear':
+            return numpy.char.mod('%d', (3 + 2 * numpy.sin(times / 5)).astype(int))
+        case 'Last Sector Time':
+            # Duration of the last sector completed, about a third of a lap, held from the end of each sector
+            sector_duration = LAP_DURATION / SECTOR_COUNT
+            sector_durations = numpy.append(0., sector_duration + rng.normal(scale=0.2,
+                                                                             size=int(duration / sector_duration)))
+            return numpy.char.mod('%.3f', sector_durations[(times // sector_duration).astype(int)])
+        case _:
+            # Random walk rounded like the logger does, so that runs of repeated values occur
+            return numpy.char.mod('%.1f', numpy.round(rng.normal(size=len(times)).cumsum(), 1))
+
+
+def generate_session(file_name: str, sample_rates_file: str, channels: list[tuple[str, int]], duration: float,
+                     seed: int = 0):
+    # Writes a telemetry CSV in the layout read by data_container.main: header block, info block, then titles,
+    # units and data rows, each channel filling the top of its column at its own sample rate. The matching sample
+    # rates file is written to sample_rates_file.
+    rng = numpy.random.default_rng(seed)
+    row_count = int(duration * max(sample_rate for _, sample_rate in channels))
+    cells = numpy.full((row_count, len(channels)), '', dtype=object)
+    for j, (title, sample_rate) in enumerate(channels):
+        values = get_channel_values(title, sample_rate, duration, rng)
+        cells[:len(values), j] = values
+    with open(file_name, 'w') as file:
+        file.write('Format,AC telemetry\nVersion,1\n\nTrack,Car,Driver\n,,\nbenchmark,Benchmark car,Benchmark\n\n')
+        file.write(','.join(title for title, _ in channels) + '\n')
+        file.write(','.join('-' for _ in channels) + '\n')
+        file.write('\n'.join(','.join(row) for row in cells) + '\n')
+    with open(sample_rates_file, 'w') as file:
+        file.write(f'Channel |   Sample rate (Hz), Default: {DEFAULT_SAMPLE_RATE}\n')
+        file.writelines(f'{title} | {sample_rate}\n' for title, sample_rate in channels)
+
+
+class Stage:
+    def __init__(self, name: str, seconds: float, peak_memory: int, items: int, item_name: str):
+        self.name: str = name
+        self.seconds: float = seconds
+        self.peak_memory: int = peak_memory
+        self.items: int = items
+        self.item_name: str = item_name
+
+    def to_dict(self) -> dict:
+        return dict(name=self.name,
+                    seconds=self.seconds,
+                    peak_memory=self.peak_memory,
+                    throughput=self.items / self.seconds if self.seconds else None,
+                    throughput_unit=f'{self.item_name}/s')
+
+    def __str__(self):
+        return (f"{self.name:<20} {self.seconds * 1000:10.2f} ms {self.peak_memory / 2**20:9.1f} MiB "
+                f"{self.items / self.seconds if self.seconds else float('inf'):14.0f} {self.item_name}/s")
+
+
+def measure(name: str, function, items: int, item_name: str, repeat: int = 3):
+    # Best time over repeat runs, and peak memory allocated by one extra run traced with tracemalloc
+    tracemalloc.start()
+    result = function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    seconds = numpy.inf
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        seconds = min(seconds, time.perf_counter() - start_time)
+    return Stage(name, seconds, peak_memory, items, item_name), result
+
+
+def get_groupby_indices(values_str: list[str] | numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+    # Reference run-length encoding, decoding each cell with the JSON decoder then grouping equal values, against
+    # which DataField.get_indices is checked and timed
+    decoder = json.decoder.JSONDecoder()
+    values_list = []
+    for value_str in values_str:
+        try:
+            values_list.append(decoder.decode(str(value_str)))
+        except json.decoder.JSONDecodeError:
+            pass
+    values = []
+    indices = []
+    counter = 0
+    for value, group in groupby(values_list):
+        values.append(value)
+        indices.append(counter)
+        counter += len(list(group))
+    return numpy.array(values), numpy.array(indices)
+
+
+def scan_nearest(spatial_index: LapSpatialIndex, x: numpy.ndarray, y: numpy.ndarray) -> list[int]:
+    # Reference nearest sample lookups, scanning every point of the trajectory, against which the grid index of
+    # LapSpatialIndex.query is checked and timed
+    trajectory = spatial_index.index
+    return [int(spatial_index.indices[numpy.nanargmin(numpy.hypot(trajectory.x - x_query, trajectory.y - y_query))])
+            for x_query, y_query in zip(x, y)]
+
+
+def read_csv(data_file: str):
+    with open(data_file, 'r') as csv_file:
+        _, _, titles, units = read_preamble(csv_file)
+        columns = read_columns(csv_file)
+    return titles, units, columns
+
+
+def build_figures(data: DataContainer, time_scales: dict, channel_names: list[str]) -> list:
+    time_figure = plotly.graph_objects.Figure()
+    for channel_name in channel_names:
+        general_time_plot(time_figure, data, time_scales, channel_name)
+    xy_figure = plotly.graph_objects.Figure()
+    general_xy_plot(xy_figure, data, 'car_coord_x', 'car_coord_y')
+    return [time_figure, xy_figure]
+
+
+def run(channel_count: int,
+        duration: float,
+        repeat: int = 3,
+        lookup_count: int = 100_000,
+        plotted_channel_count: int = 5,
+        query_count: int = 3000,
+        channel_sample_rates_file: str = 'config/sample_rates.txt') -> tuple[dict, list[Stage]]:
+    # The channels of the session and their sample rates are taken from channel_sample_rates_file, see get_channels
+    with tempfile.TemporaryDirectory() as directory:
+        data_file = os.path.join(directory, 'benchmark.csv')
+        sample_rates_file = os.path.join(directory, 'sample_rates.txt')
+        channels = get_channels(channel_count, channel_sample_rates_file)
+        generate_session(data_file, sample_rates_file, channels, duration)
+        file_size = os.path.getsize(data_file)
+        stages = []
+
+        stage, (titles, units, columns) = measure('read_csv', lambda: read_csv(data_file), file_size, 'B', repeat)
+        stages.append(stage)
+        cell_count = sum(len(column) for column in columns)
+        stage, _ = measure('get_indices_groupby', lambda: [get_groupby_indices(column) for column in columns],
+                           cell_count, 'cells', 1)
+        stages.append(stage)
+        stage, data = measure('get_indices', lambda: DataContainer(list(titles), list(units), list(columns)),
+                              cell_count, 'cells', repeat)
+        stages.append(stage)
+        stage, _ = measure('set_sample_rates', lambda: data.set_sample_rates(sample_rates_file),
+                           len(channels), 'channels', repeat)
+        stages.append(stage)
+        stage, time_scales = measure('get_time_scales', data.get_time_scales, len(channels), 'channels', repeat)
+        stages.append(stage)
+
+        rng = numpy.random.default_rng(0)
+        time_indices = rng.integers(0, len(time_scales[DEFAULT_SAMPLE_RATE]), lookup_count)
+        fields = list(data.get_fields().values())
+        stage, _ = measure('__getitem__', lambda: [field[(time_indices, DEFAULT_SAMPLE_RATE)] for field in fields],
+                           lookup_count * len(fields), 'lookups', repeat)
+        stages.append(stage)
+
+        # Track map hovers, a few metres away from the samples of the first lap
+        spatial_index = LapSpatialIndex(data, time_scales, int(data.get_lap_index(time_scales).numbers[0]))
+        samples = rng.integers(0, len(spatial_index.indices), query_count)
+        query_x = spatial_index.index.x[samples] + rng.normal(scale=5., size=query_count)
+        query_y = spatial_index.index.y[samples] + rng.normal(scale=5., size=query_count)
+        stage, scanned_indices = measure('spatial_scan', lambda: scan_nearest(spatial_index, query_x, query_y),
+                                         query_count, 'queries', 1)
+        stages.append(stage)
+        stage, results = measure('spatial_query',
+                                 lambda: [spatial_index.query(x, y) for x, y in zip(query_x, query_y)],
+                                 query_count, 'queries', repeat)
+        stages.append(stage)
+        if [index for index, _, _ in results] != scanned_indices:
+            raise ValueError('The spatial index and the scan disagree on the nearest samples')
+
+        plotted_channels = data.get_channel_names()[-plotted_channel_count:]
+        run_count = sum(len(getattr(data, name).values) for name in plotted_channels)
+        stage, _ = measure('figures', lambda: build_figures(data, time_scales, plotted_channels),
+                           run_count + len(data.car_coord_x.values), 'points', repeat)
+        stages.append(stage)
+
+    run_results = dict(parameters=dict(channel_count=channel_count,
+                                       duration=duration,
+                                       repeat=repeat,
+                                       lookup_count=lookup_count,
+                                       plotted_channel_count=plotted_channel_count,
+                                       query_count=query_count,
+                                       sample_rates_file=channel_sample_rates_file,
+                                       file_size=file_size,
+                                       cell_count=cell_count),
+                       stages=[stage.to_dict() for stage in stages])
+    return run_results, stages
+
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_run_key(run_results: dict) -> str:
+    # Runs are comparable when they process the same synthetic session, whatever the number of repeats
+    parameters = {key: value for key, value in run_results['parameters'].items() if key != 'repeat'}
+    return json.dumps(parameters, sort_keys=True)
+
+
+def compare(results: dict, reference: dict):
+    # Time ratio of each stage against a previous run on the same session, above 1 when slower
+    reference_stages = {(get_run_key(run_results), stage['name']): stage
+                        for run_results in reference['runs'] for stage in run_results['stages']}
+    for run_results in results['runs']:
+        print(f"{run_results['parameters']['channel_count']} channels, "
+              f"{run_results['parameters']['duration']:.0f} s, vs {reference.get('commit')}:")
+        for stage in run_results['stages']:
+            reference_stage = reference_stages.get((get_run_key(run_results), stage['name']))
+            if reference_stage is not None:
+                print(f"\t{stage['name']:<20} x{stage['seconds'] / reference_stage['seconds']:.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times each stage of the ingest-to-plot pipeline on synthetic '
+                                                 'telemetry sessions')
+    parser.add_argument('--channels', type=int, nargs='+', default=[len(REQUIRED_CHANNELS), 167])
+    parser.add_argument('--durations', type=float, nargs='+', default=[300.])
+    parser.add_argument('--sample-rates', default='config/sample_rates.txt',
+                        help='Sample rates file giving the channels of the sessions and their rates')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    arguments = parser.parse_args()
+
+    benchmark_results = dict(commit=get_commit(),
+                             python=platform.python_version(),
+                             numpy=numpy.__version__,
+                             plotly=plotly.__version__,
+                             runs=[])
+    for benchmark_channel_count in arguments.channels:
+        for benchmark_duration in arguments.durations:
+            print(f"{benchmark_channel_count} channels, {benchmark_duration:.0f} s:")
+            run_results, benchmark_stages = run(benchmark_channel_count, benchmark_duration, arguments.repeat,
+                                                channel_sample_rates_file=arguments.sample_rates)
+            for benchmark_stage in benchmark_stages:
+                print(f"\t{benchmark_stage}")
+            benchmark_results['runs'].append(run_results)
+    with open(arguments.output, 'w') as output_file:
+        json.dump(benchmark_results, output_file, indent=1)
+    if arguments.compare:
+        with open(arguments.compare, 'r') as reference_file:
+            compare(benchmark_results, json.load(reference_file))
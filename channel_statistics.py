@@ -0,0 +1,159 @@
+import numpy
+
+from data_container import DataField, LapIndex
+from section_timing import SectionTimes
+
+
+STATISTICS_DTYPE = numpy.dtype([('duration', numpy.float64),
+                                ('min', numpy.float64),
+                                ('max', numpy.float64),
+                                ('mean', numpy.float64),
+                                ('std', numpy.float64),
+                                ('p5', numpy.float64),
+                                ('p50', numpy.float64),
+                                ('p95', numpy.float64)])
+# Percentile fields of STATISTICS_DTYPE and their fraction of the time
+PERCENTILES = {'p5': 0.05, 'p50': 0.5, 'p95': 0.95}
+
+DEFAULT_BIN_COUNT = 32
+
+
+def get_statistics(intervals: numpy.ndarray,
+                   values: numpy.ndarray,
+                   durations: numpy.ndarray,
+                   interval_count: int) -> numpy.ndarray:
+    # Time-weighted statistics of the values held during each interval, NaN for the intervals without any
+    kept = numpy.isfinite(values) & (durations > 0)
+    intervals, values, durations = intervals[kept], values[kept], durations[kept]
+    statistics = numpy.full(interval_count, numpy.nan, dtype=STATISTICS_DTYPE)
+    total_durations = numpy.bincount(intervals, durations, minlength=interval_count)
+    statistics['duration'] = total_durations
+    timed = total_durations > 0
+    if not timed.any():
+        return statistics
+    means = numpy.bincount(intervals, values * durations, minlength=interval_count)[timed] / total_durations[timed]
+    statistics['mean'][timed] = means
+    deviations = values - statistics['mean'][intervals]
+    variances = numpy.bincount(intervals, deviations ** 2 * durations, minlength=interval_count)[timed]
+    statistics['std'][timed] = numpy.sqrt(variances / total_durations[timed])
+
+    # Values sorted within each interval, the cumulated durations giving the time spent below each value
+    order = numpy.lexsort((values, intervals))
+    sorted_values = values[order]
+    cumulated_durations = numpy.cumsum(durations[order])
+    counts = numpy.bincount(intervals, minlength=interval_count)
+    group_ends = numpy.cumsum(counts)
+    group_starts = group_ends - counts
+    statistics['min'][timed] = sorted_values[group_starts[timed]]
+    statistics['max'][timed] = sorted_values[group_ends[timed] - 1]
+    offsets = numpy.append(0., cumulated_durations)[group_starts[timed]]
+    for name, fraction in PERCENTILES.items():
+        positions = numpy.searchsorted(cumulated_durations, offsets + fraction * total_durations[timed])
+        statistics[name][timed] = sorted_values[numpy.minimum(positions, group_ends[timed] - 1)]
+    return statistics
+
+
+def get_histograms(intervals: numpy.ndarray,
+                   values: numpy.ndarray,
+                   durations: numpy.ndarray,
+                   interval_count: int,
+                   bin_edges: numpy.ndarray) -> numpy.ndarray:
+    # Time spent in each bin during each interval, as an (intervals, bins) array
+    bin_count = len(bin_edges) - 1
+    kept = numpy.isfinite(values) & (durations > 0)
+    bins = numpy.clip(numpy.searchsorted(bin_edges, values[kept], side='right') - 1, 0, bin_count - 1)
+    histograms = numpy.bincount(intervals[kept] * bin_count + bins, durations[kept],
+                                minlength=interval_count * bin_count)
+    return histograms.reshape(interval_count, bin_count)
+
+
+def get_bin_edges(field: DataField, bin_count: int = DEFAULT_BIN_COUNT) -> numpy.ndarray:
+    # Bins spread over the range of the whole session, shared by every lap and section so that they compare
+    values = field.values.astype(float)
+    values = values[numpy.isfinite(values)]
+    low, high = (values.min(), values.max()) if len(values) else (0., 1.)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    return numpy.linspace(low, high, bin_count + 1)
+
+
+class ChannelStatistics:
+    def __init__(self,
+                 lap_numbers: numpy.ndarray,
+                 bin_edges: numpy.ndarray,
+                 laps: numpy.ndarray,
+                 lap_histograms: numpy.ndarray,
+                 sections: numpy.ndarray,
+                 section_histograms: numpy.ndarray):
+        # Time-weighted statistics and histograms (in seconds per bin) of a channel, per lap and per lap x section
+        self.lap_numbers: numpy.ndarray = lap_numbers
+        self.bin_edges: numpy.ndarray = bin_edges
+        self.laps: numpy.ndarray = laps
+        self.lap_histograms: numpy.ndarray = lap_histograms
+        self.sections: numpy.ndarray = sections
+        self.section_histograms: numpy.ndarray = section_histograms
+
+    @classmethod
+    def from_field(cls,
+                   field: DataField,
+                   time_scales: dict,
+                   lap_index: LapIndex,
+                   section_times: SectionTimes | None = None,
+                   bin_count: int = DEFAULT_BIN_COUNT) -> 'ChannelStatistics':
+        # Computed from the runs of field only, at a cost proportional to its number of changes
+        if field.values.dtype.kind not in 'biuf':
+            raise ValueError(f'{field.title} is not a numeric channel')
+        sample_rate = field.sample_rate['current']
+        time_scale = time_scales[sample_rate]
+        bin_edges = get_bin_edges(field, bin_count)
+        start_indices = lap_index.start_indices[sample_rate]
+        end_indices = lap_index.end_indices[sample_rate]
+        section_count = len(section_times.section_titles) if section_times is not None else 0
+        if section_count:
+            # Sections not driven through have empty intervals
+            entry_times = numpy.nan_to_num(section_times.table['entry_time'].ravel(), nan=0.)
+            exit_times = numpy.nan_to_num(section_times.table['exit_time'].ravel(), nan=0.)
+            start_indices = numpy.append(start_indices, numpy.searchsorted(time_scale, entry_times))
+            end_indices = numpy.append(end_indices, numpy.searchsorted(time_scale, exit_times))
+        interval_count = len(start_indices)
+        intervals, values, sample_counts = field.get_interval_runs(start_indices, end_indices, len(time_scale))
+        durations = sample_counts / sample_rate
+        statistics = get_statistics(intervals, values, durations, interval_count)
+        histograms = get_histograms(intervals, values, durations, interval_count, bin_edges)
+        lap_count = len(lap_index)
+        return cls(lap_index.numbers,
+                   bin_edges,
+                   statistics[:lap_count],
+                   histograms[:lap_count],
+                   statistics[lap_count:].reshape(lap_count, section_count),
+                   histograms[lap_count:].reshape(lap_count, section_count, bin_count))
+
+    def get_arrays(self) -> dict[str, numpy.ndarray]:
+        return dict(lap_numbers=self.lap_numbers,
+                    bin_edges=self.bin_edges,
+                    laps=self.laps,
+                    lap_histograms=self.lap_histograms,
+                    sections=self.sections,
+                    section_histograms=self.section_histograms)
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, numpy.ndarray]) -> 'ChannelStatistics':
+        return cls(arrays['lap_numbers'],
+                   arrays['bin_edges'],
+                   arrays['laps'],
+                   arrays['lap_histograms'],
+                   arrays['sections'],
+                   arrays['section_histograms'])
+
+    def get_memory_size(self) -> int:
+        return sum(array.nbytes for array in self.get_arrays().values())
+
+    def get_bin_centres(self) -> numpy.ndarray:
+        return (self.bin_edges[1:] + self.bin_edges[:-1]) / 2
+
+    def __str__(self):
+        output_str = 'ChannelStatistics:'
+        for lap_number, lap in zip(self.lap_numbers, self.laps):
+            output_str += (f"\n\tLap {lap_number}: {lap['duration']:.1f}s, min {lap['min']:.2f}, "
+                           f"mean {lap['mean']:.2f}, max {lap['max']:.2f}")
+        return output_str
@@ -3,13 +3,24 @@ from PIL import Image
 from typing import Literal, Type
 
 import configparser
+import json
 import lat_lon_parser
+import numpy
+import os
 import plotly
+import xml.etree.ElementTree
 
 
 ALTITUDE = 254
 EARTH_RADIUS = 6_371_000 + ALTITUDE
 
+# Section images are resized and compressed once into the Dash assets folder, and figures link to them by URL
+TRACK_IMAGES_DIRECTORY = 'assets/track_images'
+TRACK_IMAGES_URL = '/assets/track_images/'
+TRACK_IMAGES_MANIFEST = 'index.json'
+MAX_TRACK_IMAGE_SIZE = 640
+TRACK_IMAGE_QUALITY = 80
+
 
 class Origin:
     x = 0
@@ -54,12 +65,10 @@ class Coordinates:
         self.longitude = longitude
 
     def get_xy_from_lat_lon(self):
-        self.x = EARTH_RADIUS * deg2rad(self.longitude - Origin.longitude) * cos(deg2rad(Origin.latitude))
-        self.y = EARTH_RADIUS * deg2rad(self.latitude - Origin.latitude)
+        self.x, self.y = xy_from_lat_lon(self.latitude, self.longitude)
 
     def get_lat_lon_from_xy(self):
-        self.latitude = Origin.latitude + rad2deg(self.y / EARTH_RADIUS)
-        self.longitude = Origin.longitude + rad2deg(self.x / EARTH_RADIUS) / cos(deg2rad(Origin.latitude))
+        self.latitude, self.longitude = lat_lon_from_xy(self.x, self.y)
 
 
 class Section:
@@ -74,33 +83,18 @@ class Section:
         self.stop = stop
         self.top_left = top_left
         self.bottom_right = bottom_right
-        self.image = None
+        self.image = None  # URL of the pre-rendered image
 
     def setup(self):
+        # Only links the image, which is rendered into the assets by prepare_track_images
         if self.top_left is not None and self.bottom_right is not None:
-            image_file_name = 'config/sections/' + self.title + '.png'
-            self.image = Image.open(image_file_name)
+            self.image = TRACK_IMAGES_URL + get_track_image_file_name(self.title)
         else:
             self.image = None
 
     def plot(self, figure: plotly.graph_objects.Figure):
         if self.image is not None:
-            width = abs(dx(self.top_left, self.bottom_right, method='cartesian'))
-            height = abs(dy(self.top_left, self.bottom_right, method='cartesian'))
-            figure.add_layout_image(
-                x=self.top_left.x,
-                y=self.bottom_right.y,
-                sizex=width,
-                sizey=height,
-                xref="x",
-                yref="y",
-                opacity=1.0,
-                layer="below",
-                source=self.image,
-                sizing='stretch',
-                xanchor="left",
-                yanchor="bottom",
-            )
+            add_image(figure, self.image, self.top_left, self.bottom_right)
         figure.update_yaxes(scaleanchor="x", scaleratio=1)
         figure.update_layout(template="plotly_dark")
 
@@ -110,15 +104,72 @@ def cartesian_distance(p1: Coordinates, p2: Coordinates):
 
 
 def gps_distance(p1: Coordinates | Type[Origin], p2: Coordinates | Type[Origin]):
-    latitude_difference = deg2rad(p1.latitude - p2.latitude)
-    longitude_difference = deg2rad(p1.longitude - p2.longitude)
+    return haversine_distance(p1.latitude, p1.longitude, p2.latitude, p2.longitude)
+
+
+# The functions below work on scalars as well as on whole trajectories given as numpy arrays
+
+def xy_from_lat_lon(latitude: float | numpy.ndarray, longitude: float | numpy.ndarray) -> tuple:
+    x = EARTH_RADIUS * deg2rad(longitude - Origin.longitude) * cos(deg2rad(Origin.latitude))
+    y = EARTH_RADIUS * deg2rad(latitude - Origin.latitude)
+    return x, y
+
+
+def lat_lon_from_xy(x: float | numpy.ndarray, y: float | numpy.ndarray) -> tuple:
+    latitude = Origin.latitude + rad2deg(y / EARTH_RADIUS)
+    longitude = Origin.longitude + rad2deg(x / EARTH_RADIUS) / cos(deg2rad(Origin.latitude))
+    return latitude, longitude
+
+
+def haversine_distance(latitude_1: float | numpy.ndarray,
+                       longitude_1: float | numpy.ndarray,
+                       latitude_2: float | numpy.ndarray,
+                       longitude_2: float | numpy.ndarray) -> float | numpy.ndarray:
+    latitude_difference = deg2rad(latitude_1 - latitude_2)
+    longitude_difference = deg2rad(longitude_1 - longitude_2)
     a = ((sin(latitude_difference/2))**2 +
-         cos(deg2rad(p1.latitude)) * cos(deg2rad(p2.latitude)) *
+         cos(deg2rad(latitude_1)) * cos(deg2rad(latitude_2)) *
          (sin(longitude_difference/2))**2)
     c = 2 * atan2(sqrt(a), sqrt(1-a))
     return EARTH_RADIUS * c
 
 
+def get_path_distances(latitudes: numpy.ndarray, longitudes: numpy.ndarray) -> numpy.ndarray:
+    # Distance between each pair of consecutive points of a path, one less than the number of points
+    return haversine_distance(latitudes[1:], longitudes[1:], latitudes[:-1], longitudes[:-1])
+
+
+def get_path_length(latitudes: numpy.ndarray, longitudes: numpy.ndarray) -> numpy.ndarray:
+    # Distance covered from the first point of the path to each of its points
+    path_length = numpy.zeros(len(latitudes))
+    numpy.cumsum(get_path_distances(latitudes, longitudes), out=path_length[1:])
+    return path_length
+
+
+def get_geojson(latitudes: numpy.ndarray, longitudes: numpy.ndarray, properties: dict | None = None) -> dict:
+    # GeoJSON Feature holding the path as a LineString, coordinates being ordered as longitude, latitude
+    return dict(type='Feature',
+                geometry=dict(type='LineString',
+                              coordinates=numpy.column_stack([longitudes, latitudes]).round(7).tolist()),
+                properties=properties or {})
+
+
+def write_geojson(file_name: str, latitudes: numpy.ndarray, longitudes: numpy.ndarray, properties: dict | None = None):
+    with open(file_name, 'w') as file:
+        json.dump(dict(type='FeatureCollection', features=[get_geojson(latitudes, longitudes, properties)]), file)
+
+
+def write_gpx(file_name: str, latitudes: numpy.ndarray, longitudes: numpy.ndarray, name: str = ''):
+    gpx = xml.etree.ElementTree.Element('gpx', version='1.1', creator='AC_lap_comparison',
+                                        xmlns='http://www.topografix.com/GPX/1/1')
+    track = xml.etree.ElementTree.SubElement(gpx, 'trk')
+    xml.etree.ElementTree.SubElement(track, 'name').text = name
+    segment = xml.etree.ElementTree.SubElement(track, 'trkseg')
+    for latitude, longitude in zip(numpy.round(latitudes, 7).astype(str), numpy.round(longitudes, 7).astype(str)):
+        xml.etree.ElementTree.SubElement(segment, 'trkpt', lat=latitude, lon=longitude)
+    xml.etree.ElementTree.ElementTree(gpx).write(file_name, encoding='utf-8', xml_declaration=True)
+
+
 def dx(p1: Coordinates, p2: Coordinates, method: Literal['cartesian', 'gps'] = 'cartesian') -> float:
     p1x = Coordinates(x=p1.x, longitude=p1.longitude)
     p2x = Coordinates(x=p2.x, longitude=p2.longitude)
@@ -188,8 +239,123 @@ def get_images_position(index_file_name: str = 'config/sections/index.txt') -> t
         return name, tl_lat, tl_lon, br_lat, br_lon, x_offset, y_offset
 
 
+def get_image_extent(tl_lat: str,
+                     tl_lon: str,
+                     br_lat: str,
+                     br_lon: str,
+                     x_offset: str,
+                     y_offset: str) -> tuple[Coordinates, Coordinates]:
+    # Top left and bottom right corners of an image in the cartesian frame of Origin, from a row of the index file
+    top_left = Coordinates(latitude=lat_lon_parser.parse(tl_lat), longitude=lat_lon_parser.parse(tl_lon))
+    top_left.get_xy_from_lat_lon()
+    top_left.x += float(x_offset)
+    top_left.y += float(y_offset)
+    bottom_right = Coordinates(latitude=lat_lon_parser.parse(br_lat), longitude=lat_lon_parser.parse(br_lon))
+    bottom_right.get_xy_from_lat_lon()
+    bottom_right.x += float(x_offset)
+    bottom_right.y += float(y_offset)
+    return top_left, bottom_right
+
+
+def get_images_extents(index_file_name: str = 'config/sections/index.txt') -> dict[str, tuple[Coordinates, Coordinates]]:
+    # Top left and bottom right corners of each section image in the cartesian frame of Origin
+    return {name: get_image_extent(*position) for name, *position in zip(*get_images_position(index_file_name))}
+
+
+def add_image(figure: plotly.graph_objects.Figure, source: str, top_left: Coordinates, bottom_right: Coordinates):
+    # Image stretched between its corners, below the traces
+    figure.add_layout_image(
+        x=top_left.x,
+        y=bottom_right.y,
+        sizex=abs(dx(top_left, bottom_right, method='cartesian')),
+        sizey=abs(dy(top_left, bottom_right, method='cartesian')),
+        xref="x",
+        yref="y",
+        opacity=1.0,
+        layer="below",
+        source=source,
+        sizing='stretch',
+        xanchor="left",
+        yanchor="bottom",
+    )
+
+
+class TrackImage:
+    def __init__(self, title: str, url: str, top_left: Coordinates, bottom_right: Coordinates):
+        self.title = title
+        self.url = url
+        self.top_left = top_left
+        self.bottom_right = bottom_right
+
+    def plot(self, figure: plotly.graph_objects.Figure):
+        add_image(figure, self.url, self.top_left, self.bottom_right)
+
+
+def get_track_image_file_name(title: str) -> str:
+    return title.replace(' ', '_') + '.webp'
+
+
+def prepare_track_images(index_file_name: str = 'config/sections/index.txt',
+                         source_directory: str = 'config/sections',
+                         output_directory: str = TRACK_IMAGES_DIRECTORY) -> dict[str, TrackImage]:
+    # Resizes and compresses the images listed in the index file, unless the manifest of output_directory shows
+    # that they were already converted from the same source files. Their extents are only computed again when
+    # their row of the index file or Origin changed.
+    manifest_file_name = os.path.join(output_directory, TRACK_IMAGES_MANIFEST)
+    try:
+        with open(manifest_file_name, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        manifest = {}
+    os.makedirs(output_directory, exist_ok=True)
+    origin = [Origin.latitude, Origin.longitude]
+    track_images = {}
+    new_manifest = {}
+    for title, *position in zip(*get_images_position(index_file_name)):
+        source_file_name = os.path.join(source_directory, title + '.png')
+        source_stat = os.stat(source_file_name)
+        output_name = get_track_image_file_name(title)
+        entry = dict(source_size=source_stat.st_size,
+                     source_mtime=source_stat.st_mtime_ns,
+                     max_size=MAX_TRACK_IMAGE_SIZE,
+                     quality=TRACK_IMAGE_QUALITY)
+        cached_entry = manifest.get(title, {})
+        if ({key: cached_entry.get(key) for key in entry} != entry or
+                not os.path.exists(os.path.join(output_directory, output_name))):
+            with Image.open(source_file_name) as image:
+                image.thumbnail((MAX_TRACK_IMAGE_SIZE, MAX_TRACK_IMAGE_SIZE))
+                image.save(os.path.join(output_directory, output_name), quality=TRACK_IMAGE_QUALITY)
+        if cached_entry.get('position') == position and cached_entry.get('origin') == origin:
+            top_left = Coordinates(x=cached_entry['top_left'][0], y=cached_entry['top_left'][1])
+            bottom_right = Coordinates(x=cached_entry['bottom_right'][0], y=cached_entry['bottom_right'][1])
+        else:
+            top_left, bottom_right = get_image_extent(*position)
+        new_manifest[title] = dict(entry,
+                                   file=output_name,
+                                   position=position,
+                                   origin=origin,
+                                   top_left=[top_left.x, top_left.y],
+                                   bottom_right=[bottom_right.x, bottom_right.y])
+        track_images[title] = TrackImage(title, TRACK_IMAGES_URL + output_name, top_left, bottom_right)
+    if new_manifest != manifest:
+        with open(manifest_file_name, 'w') as manifest_file:
+            json.dump(new_manifest, manifest_file, indent=1)
+    return track_images
+
+
+_track_images: dict[tuple, dict[str, TrackImage]] = {}
+
+
+def get_track_images(index_file_name: str = 'config/sections/index.txt') -> dict[str, TrackImage]:
+    # Prepared once per index file and Origin for the lifetime of the process
+    key = (index_file_name, Origin.latitude, Origin.longitude)
+    if key not in _track_images:
+        _track_images[key] = prepare_track_images(index_file_name)
+    return _track_images[key]
+
+
 def get_sections_from_ini_file(ini_file_name: str = "config/sections/sections.ini") -> list[Section]:
-    name, tl_lat, tl_lon, br_lat, br_lon, x_offset, y_offset = get_images_position()
+    extents = get_images_extents()
     config_parser = configparser.ConfigParser()
     config_parser.read(ini_file_name)
     sections_str = config_parser.sections()
@@ -199,20 +365,8 @@ def get_sections_from_ini_file(ini_file_name: str = "config/sections/sections.in
                             start=float(config_parser[section_str]['IN']),
                             stop=float(config_parser[section_str]['OUT']),
                             )
-        if section.title in name:
-            index = name.index(section.title)
-            top_left = Coordinates(latitude=lat_lon_parser.parse(tl_lat[index]),
-                                   longitude=lat_lon_parser.parse(tl_lon[index]))
-            top_left.get_xy_from_lat_lon()
-            top_left.x += float(x_offset[index])
-            top_left.y += float(y_offset[index])
-            bottom_right = Coordinates(latitude=lat_lon_parser.parse(br_lat[index]),
-                                       longitude=lat_lon_parser.parse(br_lon[index]))
-            bottom_right.get_xy_from_lat_lon()
-            bottom_right.x += float(x_offset[index])
-            bottom_right.y += float(y_offset[index])
-            section.top_left = top_left
-            section.bottom_right = bottom_right
+        if section.title in extents:
+            section.top_left, section.bottom_right = extents[section.title]
         section.setup()
         sections.append(section)
     return sections
@@ -227,41 +381,11 @@ def validation(file_name: str):
 
 
 def plot_track_map(figure: plotly.graph_objects.Figure):
-    name, tl_lat, tl_lon, br_lat, br_lon, x_offset, y_offset = get_images_position()
-    for i in range(len(name)):
-        top_left = Coordinates(latitude=lat_lon_parser.parse(tl_lat[i]),
-                                longitude=lat_lon_parser.parse(tl_lon[i]))
-        top_left.get_xy_from_lat_lon()
-        top_left.x += float(x_offset[i])
-        top_left.y += float(y_offset[i])
-
-        bottom_right = Coordinates(latitude=lat_lon_parser.parse(br_lat[i]),
-                                   longitude=lat_lon_parser.parse(br_lon[i]))
-        bottom_right.get_xy_from_lat_lon()
-        bottom_right.x += float(x_offset[i])
-        bottom_right.y += float(y_offset[i])
-
-        image_file_name = 'config/sections/' + name[i] + '.png'
-        with Image.open(image_file_name) as image:
-            width = abs(dx(top_left, bottom_right, method='cartesian'))
-            height = abs(dy(top_left, bottom_right, method='cartesian'))
-            figure.add_layout_image(
-                x=top_left.x,
-                y=bottom_right.y,
-                sizex=width,
-                sizey=height,
-                xref="x",
-                yref="y",
-                opacity=1.0,
-                layer="below",
-                source=image,
-                sizing='stretch',
-                xanchor="left",
-                yanchor="bottom",
-            )
-        figure.add_trace(plotly.graph_objects.Scatter(x=[top_left.x, bottom_right.x],
-                                                      y=[top_left.y, bottom_right.y],
-                                                      name=name[i]))
+    for track_image in get_track_images().values():
+        track_image.plot(figure)
+        figure.add_trace(plotly.graph_objects.Scatter(x=[track_image.top_left.x, track_image.bottom_right.x],
+                                                      y=[track_image.top_left.y, track_image.bottom_right.y],
+                                                      name=track_image.title))
     figure.update_yaxes(scaleanchor="x", scaleratio=1)
     figure.update_layout(template="plotly_dark")
 
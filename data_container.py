@@ -1,5 +1,6 @@
 import csv
 import json
+import operator
 import plotly
 import plotly.graph_objects
 import plotly.io
@@ -7,19 +8,34 @@ import plotly.subplots
 import re
 import numpy
 
+from functools import partial
 from itertools import groupby
+from typing import Callable, Literal
 
-from coordinates_handler import Origin, plot_track_map
+from coordinates_handler import Origin, get_path_length, lat_lon_from_xy, plot_track_map, write_geojson, write_gpx
 
 
 DEFAULT_SAMPLE_RATE = 30
 
+# Cells spelled as JSON numbers, which numpy parses to the values the JSON decoder returns. numpy also accepts
+# spellings such as '+1', '.5', '007' or '1_000' that the JSON decoder rejects. Cells are joined by CELL_SEPARATOR
+# so that a whole column is checked in a single match.
+JSON_INTEGER = '-?(?:0|[1-9][0-9]*)'
+JSON_NUMBER = f'(?:{JSON_INTEGER}(?:\\.[0-9]+)?(?:[eE][-+]?[0-9]+)?|NaN|-?Infinity)'
+CELL_SEPARATOR = '\x00'
+INTEGER_COLUMN_PATTERN = re.compile(f'{JSON_INTEGER}(?:{CELL_SEPARATOR}{JSON_INTEGER})*')
+NUMBER_COLUMN_PATTERN = re.compile(f'{JSON_NUMBER}(?:{CELL_SEPARATOR}{JSON_NUMBER})*')
+# Characters of the finite JSON numbers that do not decode to an integer
+NON_INTEGER_CHARACTERS = numpy.array([ord(character) for character in '.eE'], dtype=numpy.uint32)
+
 
 plotly.io.renderers.default = 'browser'
 plotly.io.templates.default = 'plotly_dark'
 
 
 class InfoField:
+    __slots__ = ('title', 'unit', 'value')
+
     def __init__(self, title: str, unit: str, value: float | int | bool | str | None):
         self.title: str = title
         self.unit: str = unit
@@ -30,7 +46,12 @@ class InfoField:
 
 
 class InfoContainer:
+    # Fields are stored in a table indexed by name and read as attributes (info.car_model) through __getattr__
+    __slots__ = ('_fields', '_field_ids')
+
     def __init__(self, titles, units, values):
+        self._fields: list[InfoField] = []
+        self._field_ids: dict[str, int] = {}
         attributes_names, indices_to_delete = self._get_attributes_names(titles)
         field_values = self._get_values(values)
         indices_to_delete.sort(reverse=True)
@@ -45,11 +66,37 @@ class InfoContainer:
                               str(len(units)) + " units, " +
                               str(len(field_values)) + " values")
         for attribute_name, title, unit, value in zip(attributes_names, titles, units, field_values):
-            setattr(self, attribute_name, InfoField(title, unit, value))
+            self.add_field(attribute_name, InfoField(title, unit, value))
+
+    def add_field(self, name: str, field: InfoField):
+        # A field added under an existing name replaces it at the same position
+        if name in self._field_ids:
+            self._fields[self._field_ids[name]] = field
+        else:
+            self._field_ids[name] = len(self._fields)
+            self._fields.append(field)
+
+    def get_fields(self) -> dict[str, InfoField]:
+        return dict(zip(self._field_ids, self._fields))
+
+    def __getattr__(self, name: str) -> InfoField:
+        # Only called when name is not a slot or a method
+        if name.startswith('_') or name not in self._field_ids:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        return self._fields[self._field_ids[name]]
+
+    def __setattr__(self, name: str, value):
+        if isinstance(value, InfoField):
+            self.add_field(name, value)
+        else:
+            super().__setattr__(name, value)
+
+    def __dir__(self):
+        return list(super().__dir__()) + list(self._field_ids)
 
     def __str__(self):
         output_str = 'InfoContainer:'
-        for attribute_name, attribute_value in vars(self).items():
+        for attribute_name, attribute_value in self.get_fields().items():
             output_str += f"\n\t{attribute_value}"
         return output_str
 
@@ -88,36 +135,188 @@ class InfoContainer:
 
 
 class DataField:
-    def __init__(self, title: str, unit: str, values_str: list[str], sample_rate: dict | None = None):
+    __slots__ = ('title', 'unit', '_indices', '_values', '_loader', '_values_buffer', '_indices_buffer', 'sample_rate')
+
+    def __init__(self,
+                 title: str,
+                 unit: str,
+                 values_str: list[str] | numpy.ndarray | bytes,
+                 sample_rate: dict | None = None,
+                 lazy: bool = False):
         self.title: str = title
         self.unit: str = unit
-        self.indices: numpy.ndarray = numpy.ndarray(())  # Indexing based on current (local) sample rate
-        self.values: numpy.ndarray = numpy.ndarray(())
+        self._indices: numpy.ndarray = numpy.ndarray(())  # Indexing based on current (local) sample rate
+        self._values: numpy.ndarray = numpy.ndarray(())
+        self._loader: Callable[[], None] | None = None
+        self._values_buffer: numpy.ndarray | None = None  # Spare capacity for the runs appended by extend
+        self._indices_buffer: numpy.ndarray | None = None
         self.sample_rate: dict | None = sample_rate
-        self.get_indices(values_str)
+        if lazy:
+            # Only the packed cells are kept until the channel is first read, see pack_column
+            packed_column = values_str if isinstance(values_str, bytes) else pack_column(values_str)
+            self.set_loader(partial(self.get_indices, packed_column))
+        else:
+            self.get_indices(values_str)
+
+    @property
+    def values(self) -> numpy.ndarray:
+        self.load()
+        return self._values
+
+    @values.setter
+    def values(self, values: numpy.ndarray):
+        self.load()
+        self._values = values
+
+    @property
+    def indices(self) -> numpy.ndarray:
+        self.load()
+        return self._indices
+
+    @indices.setter
+    def indices(self, indices: numpy.ndarray):
+        self.load()
+        self._indices = indices
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loader is None
+
+    def set_loader(self, loader: Callable[[], None]):
+        # The loader fills values and indices the first time either of them is read
+        self._loader = loader
+
+    def load(self):
+        if self._loader is not None:
+            loader, self._loader = self._loader, None
+            loader()
+
+    def get_slice(self, start: int, end: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+        # Values and indices of the runs between the indices start and end, keeping the run in progress at start,
+        # so that the slice can be sampled from its first index
+        first = max(numpy.searchsorted(self.indices, start, side='right') - 1, 0)
+        last = numpy.searchsorted(self.indices, end, side='left')
+        return self.values[first:last], self.indices[first:last]
+
+    def set_slice(self, field: 'DataField', start: int, end: int):
+        self.values, self.indices = field.get_slice(start, end)
+
+    def get_indices(self, values_str: list[str] | numpy.ndarray | bytes):
+        if isinstance(values_str, bytes):
+            values_str = unpack_column(values_str)
+        values = self._decode_values(values_str)
+        if isinstance(values, numpy.ndarray):
+            self.values, self.indices = self._run_length_encode(values)
+        else:
+            self.values, self.indices = self._run_length_encode_list(values)
+
+    def extend(self,
+               values_str: list[str] | numpy.ndarray,
+               start_index: int,
+               transform: Callable[[numpy.ndarray], numpy.ndarray] | None = None) -> int:
+        # Appends the samples decoded from new cells, start_index being the number of samples decoded so far, and
+        # returns the number of new samples. A first value equal to the last one extends the run in progress.
+        values = self._decode_values(values_str)
+        if not len(values):
+            return 0
+        if isinstance(values, numpy.ndarray):
+            new_values, new_indices = self._run_length_encode(values)
+        else:
+            new_values, new_indices = self._run_length_encode_list(values)
+        if transform is not None:
+            new_values = transform(new_values)
+        new_indices = new_indices + start_index
+        self.load()
+        if len(self._values):
+            last_value, first_value = self._values[-1], new_values[0]
+            if last_value == first_value or (self._values.dtype.kind == 'f' and new_values.dtype.kind == 'f' and
+                                             numpy.isnan(last_value) and numpy.isnan(first_value)):
+                new_values, new_indices = new_values[1:], new_indices[1:]
+        self._values_buffer = self._append_to_buffer(self._values_buffer, self._values, new_values)
+        self._indices_buffer = self._append_to_buffer(self._indices_buffer, self._indices, new_indices)
+        self._values = self._values_buffer[:len(self._values) + len(new_values)]
+        self._indices = self._indices_buffer[:len(self._indices) + len(new_indices)]
+        return len(values)
 
-    def get_indices(self, values_str: list[str]):
-        values_list = []
-        indices_list = []
-        counter = 0
-        for i in range(len(values_str)):
-            try:
-                value = json.decoder.JSONDecoder().decode(values_str[i])
-                indices_list.append(counter)
-                values_list.append(value)
-                counter += 1
-            except json.decoder.JSONDecodeError:
-                pass
+    @staticmethod
+    def _append_to_buffer(buffer: numpy.ndarray | None, array: numpy.ndarray, new_array: numpy.ndarray) -> numpy.ndarray:
+        # Writes new_array after array, array being either a view on the start of buffer or a standalone array.
+        # The buffer is reallocated with twice the needed capacity when it is full, so appends are amortized O(1).
+        length = len(array) + len(new_array)
+        dtype = numpy.result_type(array, new_array) if len(array) else new_array.dtype
+        if buffer is None or array.base is not buffer or len(buffer) < length or buffer.dtype != dtype:
+            new_buffer = numpy.empty(max(2 * length, 1024), dtype=dtype)
+            new_buffer[:len(array)] = array
+            buffer = new_buffer
+        buffer[len(array):length] = new_array
+        return buffer
+
+    @staticmethod
+    def _run_length_encode(values: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+        change_points = numpy.ones(len(values), dtype=bool)
+        change_points[1:] = values[1:] != values[:-1]
+        if values.dtype.kind == 'f':
+            # Consecutive NaN form a single run, as the JSON decoder returns the same NaN object for each of them
+            nan_values = numpy.isnan(values)
+            change_points[1:] &= ~(nan_values[1:] & nan_values[:-1])
+        indices = numpy.flatnonzero(change_points)
+        return values[indices], indices
+
+    @staticmethod
+    def _run_length_encode_list(values: list) -> tuple[numpy.ndarray, numpy.ndarray]:
         filtered_values_list = []
         filtered_indices_list = []
         counter = 0
-        for value, group in groupby(values_list):
+        for value, group in groupby(values):
             filtered_values_list.append(value)
-            filtered_indices_list.append(indices_list[counter])
+            filtered_indices_list.append(counter)
             number_of_repetitions = len(list(group))
             counter += number_of_repetitions
-        self.values = numpy.array(filtered_values_list)
-        self.indices = numpy.array(filtered_indices_list)
+        return numpy.array(filtered_values_list), numpy.array(filtered_indices_list)
+
+    @staticmethod
+    def _get_column_dtype(column: numpy.ndarray) -> type | None:
+        # numpy dtype of a column of which every cell is a JSON number, None otherwise, including when a cell
+        # has surrounding whitespace, which the cells decoded one by one then accept
+        joined = CELL_SEPARATOR.join(column.tolist())
+        if joined.count(CELL_SEPARATOR) != len(column) - 1:
+            return None
+        if INTEGER_COLUMN_PATTERN.fullmatch(joined):
+            return numpy.int64
+        if NUMBER_COLUMN_PATTERN.fullmatch(joined):
+            return numpy.float64
+        return None
+
+    @staticmethod
+    def _decode_values(values_str: list[str] | numpy.ndarray) -> numpy.ndarray | list:
+        # Cells that are not valid JSON are skipped, as if they had not been recorded
+        decoder = json.decoder.JSONDecoder()
+        column = numpy.asarray(values_str, dtype=str)
+        column = column[column != '']
+        dtype = DataField._get_column_dtype(column) if column.size else None
+        if dtype is not None:
+            try:
+                values = column.astype(dtype)
+            except OverflowError:
+                # Integers beyond int64 are decoded one by one, as Python integers
+                pass
+            else:
+                if dtype is numpy.float64:
+                    # Integer cells decode to int, so a column of which every run starts with one holds int, as
+                    # with the decoder
+                    _, indices = DataField._run_length_encode(values)
+                    run_starts = column[indices]
+                    codes = run_starts.view(numpy.uint32).reshape(len(run_starts), -1)
+                    if not numpy.isin(codes, NON_INTEGER_CHARACTERS).any() and numpy.isfinite(values[indices]).all():
+                        values = values.astype(numpy.int64)
+                return values
+        values_list = []
+        for value_str in column:
+            try:
+                values_list.append(decoder.decode(str(value_str)))
+            except json.decoder.JSONDecodeError:
+                pass
+        return values_list
 
     def __getitem__(self, requested_index: tuple[int | slice, int]):
         if self.sample_rate is None:
@@ -127,19 +326,194 @@ class DataField:
         closest_available_indices = numpy.searchsorted(self.indices, corrected_indices, side="right")
         return self.values[closest_available_indices-1]
 
+    def get_interval_runs(self,
+                          start_indices: numpy.ndarray,
+                          end_indices: numpy.ndarray,
+                          length: int) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        # Runs overlapping each interval [start, end) of indices at the current sample rate, as the interval of each
+        # run, its value and the number of samples it lasts within the interval. length is the number of samples.
+        indices = self.indices
+        run_ends = numpy.append(indices[1:], length)
+        first_runs = numpy.maximum(numpy.searchsorted(indices, start_indices, side='right') - 1, 0)
+        last_runs = numpy.searchsorted(indices, end_indices)
+        counts = numpy.where(end_indices > start_indices, numpy.maximum(last_runs - first_runs, 0), 0)
+        intervals = numpy.repeat(numpy.arange(len(counts)), counts)
+        runs = (numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+                + numpy.repeat(first_runs, counts))
+        sample_counts = (numpy.minimum(run_ends[runs], end_indices[intervals])
+                         - numpy.maximum(indices[runs], start_indices[intervals]))
+        return intervals, self.values[runs].astype(float), sample_counts
+
+    def _get_timed_runs(self,
+                        time_scales: dict,
+                        start_times: float | numpy.ndarray | None,
+                        end_times: float | numpy.ndarray | None) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, int]:
+        # Runs overlapping each interval [start_time, end_time), the whole session by default, with their duration
+        # in seconds. NaN values are left out.
+        if self.sample_rate is None:
+            raise ValueError('Sample rate has not been set')
+        sample_rate = self.sample_rate['current']
+        time_scale = time_scales[sample_rate]
+        start_indices = numpy.searchsorted(time_scale, numpy.atleast_1d(0. if start_times is None else start_times))
+        if end_times is None:
+            end_indices = numpy.full(len(start_indices), len(time_scale))
+        else:
+            end_indices = numpy.searchsorted(time_scale, numpy.atleast_1d(end_times))
+        intervals, values, sample_counts = self.get_interval_runs(start_indices, end_indices, len(time_scale))
+        kept = ~numpy.isnan(values)
+        return intervals[kept], values[kept], sample_counts[kept] / sample_rate, len(start_indices)
+
+    @staticmethod
+    def _get_interval_results(results: numpy.ndarray, start_times: float | numpy.ndarray | None) -> float | numpy.ndarray:
+        return float(results[0]) if numpy.ndim(start_times) == 0 else results
+
+    def integrate(self,
+                  time_scales: dict,
+                  start_times: float | numpy.ndarray | None = None,
+                  end_times: float | numpy.ndarray | None = None) -> float | numpy.ndarray:
+        # Integral over time, in unit.s, of each interval from the runs only, e.g. laps with their start and end
+        # times. A float for a single interval.
+        intervals, values, durations, interval_count = self._get_timed_runs(time_scales, start_times, end_times)
+        integrals = numpy.bincount(intervals, values * durations, minlength=interval_count)
+        return self._get_interval_results(integrals, start_times)
+
+    def get_mean(self,
+                 time_scales: dict,
+                 start_times: float | numpy.ndarray | None = None,
+                 end_times: float | numpy.ndarray | None = None) -> float | numpy.ndarray:
+        # Time-weighted mean of each interval, NaN when no value was recorded
+        intervals, values, durations, interval_count = self._get_timed_runs(time_scales, start_times, end_times)
+        total_durations = numpy.bincount(intervals, durations, minlength=interval_count)
+        integrals = numpy.bincount(intervals, values * durations, minlength=interval_count)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            means = numpy.where(total_durations > 0, integrals / total_durations, numpy.nan)
+        return self._get_interval_results(means, start_times)
+
+    def get_time_above(self,
+                       threshold: float,
+                       time_scales: dict,
+                       start_times: float | numpy.ndarray | None = None,
+                       end_times: float | numpy.ndarray | None = None,
+                       inclusive: bool = True) -> float | numpy.ndarray:
+        # Seconds spent at or above threshold (strictly above without inclusive) in each interval, e.g. the time at
+        # full throttle of each lap
+        intervals, values, durations, interval_count = self._get_timed_runs(time_scales, start_times, end_times)
+        above = values >= threshold if inclusive else values > threshold
+        times = numpy.bincount(intervals, durations * above, minlength=interval_count)
+        return self._get_interval_results(times, start_times)
+
+    def combine(self,
+                other: 'DataField | float',
+                operation: Callable[[numpy.ndarray, numpy.ndarray | float], numpy.ndarray],
+                title: str,
+                unit: str = '') -> 'DataField':
+        # Channel computed from the values held at each change point of either field, at the higher of both
+        # sample rates, without going through the samples. The result is run-length encoded again.
+        if self.sample_rate is None:
+            raise ValueError('Sample rate has not been set')
+        if not isinstance(other, DataField):
+            values, indices = operation(self._get_operand_values(), other), self.indices
+            sample_rate = dict(self.sample_rate)
+        else:
+            if other.sample_rate is None:
+                raise ValueError('Sample rate has not been set')
+            current_sample_rate = max(self.sample_rate['current'], other.sample_rate['current'])
+            self_indices = self.convert_indices(self.indices, self.sample_rate['current'], current_sample_rate)
+            other_indices = self.convert_indices(other.indices, other.sample_rate['current'], current_sample_rate)
+            indices = numpy.union1d(self_indices, other_indices)
+            self_runs = numpy.maximum(numpy.searchsorted(self_indices, indices, side='right') - 1, 0)
+            other_runs = numpy.maximum(numpy.searchsorted(other_indices, indices, side='right') - 1, 0)
+            values = operation(self._get_operand_values()[self_runs], other._get_operand_values()[other_runs])
+            sample_rate = dict(self.sample_rate, current=current_sample_rate)
+        field = DataField(title, unit, [], sample_rate)
+        field.values, runs = self._run_length_encode(numpy.asarray(values))
+        field.indices = indices[runs]
+        return field
+
+    def _get_operand_values(self) -> numpy.ndarray:
+        # Integers read from a session cache may be stored in a narrow dtype, which arithmetic could overflow
+        return self.values.astype(numpy.int64) if self.values.dtype.kind in 'iu' else self.values
+
+    def _combine_operand(self, other: 'DataField | float', operation: Callable, symbol: str) -> 'DataField':
+        # The unit is kept when scaling by a number, or when adding or subtracting channels of the same unit
+        if not isinstance(other, DataField):
+            return self.combine(other, operation, f'{self.title} {symbol} {other}', self.unit)
+        unit = self.unit if symbol in '+-' and other.unit == self.unit else ''
+        return self.combine(other, operation, f'{self.title} {symbol} {other.title}', unit)
+
+    def __add__(self, other: 'DataField | float') -> 'DataField':
+        return self._combine_operand(other, operator.add, '+')
+
+    def __sub__(self, other: 'DataField | float') -> 'DataField':
+        return self._combine_operand(other, operator.sub, '-')
+
+    def __mul__(self, other: 'DataField | float') -> 'DataField':
+        return self._combine_operand(other, operator.mul, '*')
+
+    def __truediv__(self, other: 'DataField | float') -> 'DataField':
+        return self._combine_operand(other, operator.truediv, '/')
+
     def __str__(self):
+        values_count = f"{len(self._values)} values" if self.is_loaded else "not loaded"
         if self.sample_rate is None:
-            return f"{self.title}: [{len(self.values)} values @ undefined sample rate], {self.unit}"
-        return f"{self.title}: [{len(self.values)} values @ {self.sample_rate['current']}Hz], {self.unit}"
+            return f"{self.title}: [{values_count} @ undefined sample rate], {self.unit}"
+        return f"{self.title}: [{values_count} @ {self.sample_rate['current']}Hz], {self.unit}"
 
     @staticmethod
     def convert_indices(indices: int | numpy.ndarray, current_sample_rate: int, new_sample_rate: int):
-        new_indices = numpy.floor(indices * new_sample_rate / current_sample_rate).astype(int)
+        # Computed in int64, as indices read from a session cache may be stored as int32
+        new_indices = numpy.floor(numpy.multiply(indices, new_sample_rate, dtype=numpy.int64) /
+                                  current_sample_rate).astype(int)
         return new_indices
 
 
+class LapIndex:
+    def __init__(self, lap_number: DataField, time_scales: dict):
+        # One entry per lap, start indices included and end indices excluded, at every sample rate of time_scales
+        lap_sample_rate = lap_number.sample_rate['current']
+        lap_start_indices = lap_number.indices
+        self.numbers: numpy.ndarray = lap_number.values.astype(int)
+        self.start_indices: dict[int, numpy.ndarray] = {}
+        self.end_indices: dict[int, numpy.ndarray] = {}
+        for sample_rate, time_scale in time_scales.items():
+            start_indices = lap_number.convert_indices(lap_start_indices, lap_sample_rate, sample_rate)
+            self.start_indices[sample_rate] = start_indices
+            self.end_indices[sample_rate] = numpy.append(start_indices[1:], len(time_scale))
+        lap_time_scale = time_scales[lap_sample_rate]
+        self.start_times: numpy.ndarray = lap_time_scale[lap_start_indices]
+        self.end_times: numpy.ndarray = numpy.append(self.start_times[1:], lap_time_scale[-1])
+
+    def get_position(self, lap_number: int) -> int:
+        positions = numpy.flatnonzero(self.numbers == lap_number)
+        if not len(positions):
+            raise ValueError(f'Lap {lap_number} is not in the session')
+        return int(positions[0])
+
+    def get_durations(self) -> numpy.ndarray:
+        return self.end_times - self.start_times
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __str__(self):
+        output_str = 'LapIndex:'
+        for number, start_time, end_time in zip(self.numbers, self.start_times, self.end_times):
+            output_str += f"\n\tLap {number}: {start_time:.3f}s - {end_time:.3f}s"
+        return output_str
+
+
 class DataContainer:
-    def __init__(self, titles, units, values):
+    # Channel table: fields and their metadata are stored by channel id, with name and title indices for O(1)
+    # lookups. Channels are read as attributes (data.car_coord_x) through __getattr__.
+    __slots__ = ('_fields', '_channel_ids', '_title_ids', '_titles', '_units', '_sample_rates', '_lap_index')
+
+    def __init__(self, titles, units, values, lazy: bool = False):
+        self._fields: list[DataField] = []
+        self._channel_ids: dict[str, int] = {}
+        self._title_ids: dict[str, int] = {}
+        self._titles: list[str] = []
+        self._units: list[str] = []
+        self._sample_rates: numpy.ndarray = numpy.zeros(0, dtype=int)  # Current sample rates, 0 when not set
         attributes_names, indices_to_delete = self._get_attributes_names(titles)
         indices_to_delete.sort(reverse=True)
         for index in indices_to_delete:
@@ -156,16 +530,78 @@ class DataContainer:
                               str(len(units)) + " units, " +
                               str(len(values)) + " values columns")
         for attribute_name, title, unit, value_column in zip(attributes_names, titles, units, values):
-            setattr(self, attribute_name, DataField(title, unit, value_column))
+            self.add_field(attribute_name, DataField(title, unit, value_column, lazy=lazy))
+        self._lap_index: LapIndex | None = None
+
+    def add_field(self, name: str, field: DataField):
+        # A field added under an existing name replaces it with the same channel id
+        sample_rate = 0 if field.sample_rate is None else field.sample_rate['current']
+        if name in self._channel_ids:
+            channel_id = self._channel_ids[name]
+            self._fields[channel_id] = field
+            self._titles[channel_id] = field.title
+            self._units[channel_id] = field.unit
+            self._sample_rates[channel_id] = sample_rate
+            self._title_ids = {}
+            for title_id, title in enumerate(self._titles):
+                self._title_ids.setdefault(title, title_id)
+        else:
+            channel_id = len(self._fields)
+            self._channel_ids[name] = channel_id
+            self._title_ids.setdefault(field.title, channel_id)
+            self._fields.append(field)
+            self._titles.append(field.title)
+            self._units.append(field.unit)
+            self._sample_rates = numpy.append(self._sample_rates, sample_rate)
+
+    def get_channel_id(self, name: str) -> int:
+        if name not in self._channel_ids:
+            raise ValueError(f'Channel {name} is not in the session')
+        return self._channel_ids[name]
+
+    def __getattr__(self, name: str) -> DataField:
+        # Only called when name is not a slot or a method
+        if name.startswith('_') or name not in self._channel_ids:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        return self._fields[self._channel_ids[name]]
+
+    def __setattr__(self, name: str, value):
+        if isinstance(value, DataField):
+            self.add_field(name, value)
+        else:
+            super().__setattr__(name, value)
+
+    def __dir__(self):
+        return list(super().__dir__()) + list(self._channel_ids)
+
+    def extend(self,
+               columns: dict[str, list[str] | numpy.ndarray],
+               sample_counts: dict[str, int],
+               transforms: dict[str, Callable[[numpy.ndarray], numpy.ndarray]] | None = None) -> dict[str, int]:
+        # Appends new cells to the channels named in columns and returns the updated sample counts
+        transforms = transforms or {}
+        new_sample_counts = dict(sample_counts)
+        for name, column in columns.items():
+            new_sample_counts[name] = sample_counts.get(name, 0) + getattr(self, name).extend(column,
+                                                                                            sample_counts.get(name, 0),
+                                                                                            transforms.get(name))
+        self._lap_index = None
+        return new_sample_counts
+
+    def get_fields(self) -> dict[str, DataField]:
+        return dict(zip(self._channel_ids, self._fields))
 
     def get_channel_names(self):
-        return [key for key in vars(self).keys()]
+        return list(self._channel_ids)
 
     def get_channel_titles(self):
-        return [channel.title for _, channel in vars(self).items()]
+        return list(self._titles)
+
+    def get_channel_units(self):
+        return list(self._units)
 
     def get_title_name_pairs(self):
-        return [dict(label=channel.title, value=name) for name, channel in vars(self).items()]
+        return [dict(label=title, value=name) for name, title in zip(self._channel_ids, self._titles)]
 
     def set_sample_rates(self, config_file_name: str = 'config/sample_rates.txt'):
         decoder = json.decoder.JSONDecoder()
@@ -178,21 +614,84 @@ class DataContainer:
                 title, sample_rate_str = line.split('|')
                 title = title.rstrip()
                 sample_rate_str = sample_rate_str.rstrip()
-                attribute_list = [(name, field) for name, field in vars(self).items() if field.title == title]
-                attribute_name = attribute_list[0][0]
-                attribute = attribute_list[0][1]
-                attribute.sample_rate = dict(default=default_sample_rate,
-                                             current=decoder.decode(sample_rate_str))
-                setattr(self, attribute_name, attribute)
+                channel_id = self._title_ids[title]
+                self._fields[channel_id].sample_rate = dict(default=default_sample_rate,
+                                                            current=decoder.decode(sample_rate_str))
+                self._sample_rates[channel_id] = self._fields[channel_id].sample_rate['current']
+
+    def get_sample_rates(self) -> numpy.ndarray:
+        # Current sample rate of each channel, by channel id
+        return self._sample_rates.copy()
 
     def get_time_scales(self) -> dict:
         time_scales = {}
-        sample_rates = numpy.unique([field.sample_rate['current'] for _, field in vars(self).items()])
-        max_time = self.time.values[-1]
+        if not numpy.all(self._sample_rates):
+            raise ValueError('Sample rate has not been set')
+        sample_rates = numpy.unique(self._sample_rates)
         for sample_rate in sample_rates:
-            time_scales[sample_rate] = numpy.arange(start=0, stop=max_time+0.1, step=1/sample_rate)
+            time_scales[sample_rate] = self.get_time_scale(sample_rate)
         return time_scales
 
+    def get_time_scale(self, sample_rate: int) -> numpy.ndarray:
+        max_time = self.time.values[-1] if len(self.time.values) else 0.
+        return numpy.arange(start=0, stop=max_time+0.1, step=1/sample_rate)
+
+    def sample(self,
+               channels: list[str],
+               time_grid: Literal['changes', 'fixed'] | numpy.ndarray | None = None,
+               sample_rate: int | None = None) -> numpy.ndarray:
+        # Samples every channel on a shared time base, returned as a structured array with one field per channel
+        # and an 'index' field holding the time indices at sample_rate:
+        #   'changes' (or None): union of the change points of all channels
+        #   'fixed': every time index at sample_rate
+        #   array: the given time indices at sample_rate
+        channels = list(dict.fromkeys(channels))
+        fields = [getattr(self, channel) for channel in channels]
+        if sample_rate is None:
+            sample_rate = fields[0].sample_rate['default']
+        sample_count = len(self.get_time_scale(sample_rate))
+        if time_grid is None or isinstance(time_grid, str) and time_grid == 'changes':
+            time_indices = numpy.unique(numpy.concatenate([field.convert_indices(field.indices,
+                                                                                 field.sample_rate['current'],
+                                                                                 sample_rate)
+                                                           for field in fields]))
+            time_indices = time_indices[time_indices < sample_count]
+        elif isinstance(time_grid, str) and time_grid == 'fixed':
+            time_indices = numpy.arange(sample_count)
+        elif isinstance(time_grid, numpy.ndarray):
+            time_indices = time_grid
+        else:
+            raise ValueError('Time grid must be either changes, fixed or an array of time indices')
+        samples = numpy.empty(len(time_indices),
+                              dtype=[('index', time_indices.dtype)] + [(channel, field.values.dtype)
+                                                                       for channel, field in zip(channels, fields)])
+        samples['index'] = time_indices
+        for channel, field in zip(channels, fields):
+            samples[channel] = field[(time_indices, sample_rate)]
+        return samples
+
+    def get_lap_index(self, time_scales: dict | None = None) -> 'LapIndex':
+        if self._lap_index is None:
+            if time_scales is None:
+                time_scales = self.get_time_scales()
+            self._lap_index = LapIndex(self.lap_number, time_scales)
+        return self._lap_index
+
+    def lap(self, lap_number: int) -> 'DataContainer':
+        # View of a single lap: each channel holds slices of the session arrays, indexed on the session time base
+        lap_index = self.get_lap_index()
+        position = lap_index.get_position(lap_number)
+        lap_data = DataContainer([], [], [])
+        for name, field in self.get_fields().items():
+            sample_rate = field.sample_rate['current']
+            lap_field = DataField(field.title, field.unit, [], field.sample_rate)
+            lap_field.set_loader(partial(lap_field.set_slice,
+                                         field,
+                                         lap_index.start_indices[sample_rate][position],
+                                         lap_index.end_indices[sample_rate][position]))
+            lap_data.add_field(name, lap_field)
+        return lap_data
+
     @staticmethod
     def _get_attributes_names(titles: list[str]):
         attributes_names = []
@@ -211,37 +710,70 @@ class DataContainer:
 
     def __str__(self):
         output_str = 'DataContainer:'
-        for attribute_name, attribute_value in vars(self).items():
+        for attribute_name, attribute_value in self.get_fields().items():
             output_str += f"\n\t{attribute_value}"
         return output_str
 
 
-def main(data_file: str):
-    with open(data_file, 'r') as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=',')
-        row = next(csv_reader)
-        header = dict()
-        while row:
-            key, value = row
-            header[key] = value
-            row = next(csv_reader)
-        while not row:
-            row = next(csv_reader)
-        titles = row
-        units = next(csv_reader)
-        values = next(csv_reader)
-        info = InfoContainer(titles, units, values)
-        row = next(csv_reader)
-        while not row:
-            row = next(csv_reader)
-        titles = row
-        units = next(csv_reader)
-        for i, row in enumerate(csv_reader):
+def pack_column(cells: list[str] | numpy.ndarray) -> bytes:
+    # Cells of a column as UTF-8 bytes, about the size they take in the CSV, instead of an array of 4 bytes per
+    # character padded to the longest cell
+    cells = cells.tolist() if isinstance(cells, numpy.ndarray) else cells
+    return CELL_SEPARATOR.join(cells).encode()
+
+
+def unpack_column(packed_column: bytes) -> list[str]:
+    return packed_column.decode().split(CELL_SEPARATOR) if packed_column else []
+
+
+def read_columns(csv_file, packed: bool = False) -> list[numpy.ndarray] | list[bytes]:
+    # Bulk read of the data block: one string array per column, or one packed column (see pack_column), decoded
+    # later by DataField
+    get_column = pack_column if packed else partial(numpy.array, dtype=str)
+    rows = [row for row in csv_file.read().splitlines() if row]
+    if not rows:
+        return []
+    column_count = rows[0].count(',') + 1
+    cells = ','.join(rows).split(',')
+    if len(cells) != len(rows) * column_count or any('"' in row for row in rows):
+        # Quoted cells or ragged rows, let the csv module split them
+        columns = []
+        for i, row in enumerate(csv.reader(rows, delimiter=',')):
             if i == 0:
-                data = [[] for _ in range(len(row))]
+                columns = [[] for _ in range(len(row))]
             for j, col in enumerate(row):
-                data[j].append(col)
-        data = DataContainer(titles, units, data)
+                columns[j].append(col)
+        return [get_column(column) for column in columns]
+    return [get_column(cells[j::column_count]) for j in range(column_count)]
+
+
+def read_preamble(csv_file) -> tuple[dict, InfoContainer, list[str], list[str]]:
+    csv_reader = csv.reader(csv_file, delimiter=',')
+    row = next(csv_reader)
+    header = dict()
+    while row:
+        key, value = row
+        header[key] = value
+        row = next(csv_reader)
+    while not row:
+        row = next(csv_reader)
+    titles = row
+    units = next(csv_reader)
+    values = next(csv_reader)
+    info = InfoContainer(titles, units, values)
+    row = next(csv_reader)
+    while not row:
+        row = next(csv_reader)
+    titles = row
+    units = next(csv_reader)
+    return header, info, titles, units
+
+
+def main(data_file: str, lazy: bool = False):
+    # With lazy, each channel is kept packed until it is first read, so that memory follows the channels used
+    with open(data_file, 'r') as csv_file:
+        header, info, titles, units = read_preamble(csv_file)
+        data = DataContainer(titles, units, read_columns(csv_file, packed=lazy), lazy=lazy)
 
         # Invert x and y coordinates so x+ points towards east and y+ points towards north
         data.car_coord_x.values = - data.car_coord_x.values
@@ -268,56 +800,40 @@ def plot_trajectory(data: DataContainer, figure):
     figure.update_yaxes(scaleanchor="x", scaleratio=1)
 
 
-def get_sector_times(data: DataContainer, time_scales: dict) -> numpy.ndarray:
-    current_time_indices = data.last_sector_time.indices
-    local_time_values = time_scales[data.last_sector_time.sample_rate['current']][current_time_indices]
-    default_time_indices = data.last_sector_time.convert_indices(current_time_indices, data.last_sector_time.sample_rate['current'], data.last_sector_time.sample_rate['default'])
-    default_time_values = time_scales[data.last_sector_time.sample_rate['default']][default_time_indices]
-    sectors = data.last_sector_time.values
-    output_array = numpy.array([current_time_indices, local_time_values, default_time_values, sectors])
-    return output_array
-
-
-def plot_sector_times(sector_times_array: numpy.ndarray, figure: plotly.graph_objects.Figure):
-    figure.add_trace(plotly.graph_objects.Scatter(x=sector_times_array[1, [i for i in range(sector_times_array.shape[1]) if i % 3 == 0]],
-                                                  y=sector_times_array[3, [i for i in range(sector_times_array.shape[1]) if i % 3 == 0]],
-                                                  name='Sector times 1, local indexing',
-                                                  showlegend=True,
-                                                  line=dict(shape='hv')
-                                                  ),
-                     )
-    figure.add_trace(plotly.graph_objects.Scatter(x=sector_times_array[1, [i for i in range(sector_times_array.shape[1]) if i % 3 == 1]],
-                                                  y=sector_times_array[3, [i for i in range(sector_times_array.shape[1]) if i % 3 == 1]],
-                                                  name='Sector times 2, local indexing',
-                                                  showlegend=True,
-                                                  line=dict(shape='hv')
-                                                  ),
-                     )
-    figure.add_trace(plotly.graph_objects.Scatter(x=sector_times_array[1, [i for i in range(sector_times_array.shape[1]) if i % 3 == 2]],
-                                                  y=sector_times_array[3, [i for i in range(sector_times_array.shape[1]) if i % 3 == 2]],
-                                                  name='Sector times 3, local indexing',
-                                                  showlegend=True,
-                                                  line=dict(shape='hv')
-                                                  ),
-                     )
+def get_gps_trajectory(data: DataContainer, time_scales: dict) -> numpy.ndarray:
+    # Trajectory at the change points of car_coord_x/y, converted to GPS coordinates relative to Origin in one pass
+    samples = data.sample(['car_coord_x', 'car_coord_y'])
+    trajectory = numpy.empty(len(samples), dtype=[('time', numpy.float64),
+                                                  ('latitude', numpy.float64),
+                                                  ('longitude', numpy.float64),
+                                                  ('distance', numpy.float64)])
+    trajectory['time'] = time_scales[data.car_coord_x.sample_rate['default']][samples['index']]
+    trajectory['latitude'], trajectory['longitude'] = lat_lon_from_xy(samples['car_coord_x'].astype(float),
+                                                                      samples['car_coord_y'].astype(float))
+    trajectory['distance'] = get_path_length(trajectory['latitude'], trajectory['longitude'])
+    return trajectory
+
+
+def export_trajectory(data: DataContainer, time_scales: dict, file_name: str, name: str = ''):
+    # The format is chosen from the extension of file_name, either .gpx or .geojson
+    trajectory = get_gps_trajectory(data, time_scales)
+    if file_name.endswith('.gpx'):
+        write_gpx(file_name, trajectory['latitude'], trajectory['longitude'], name)
+    elif file_name.endswith('.geojson'):
+        write_geojson(file_name, trajectory['latitude'], trajectory['longitude'],
+                      dict(name=name, length=float(trajectory['distance'][-1]) if len(trajectory) else 0.))
+    else:
+        raise ValueError('Trajectory file must be either a .gpx or a .geojson file')
 
 
 def plot_car_pos_norm_vs_lap_distance(data: DataContainer, time_scales):
     figure = plotly.subplots.make_subplots(rows=3, cols=1)
 
-    ld_default_time_indices = data.lap_distance.convert_indices(data.lap_distance.indices,
-                                                                data.lap_distance.sample_rate['current'],
-                                                                data.lap_distance.sample_rate['default'])
-    cpn_default_time_indices = data.car_pos_norm.convert_indices(data.car_pos_norm.indices,
-                                                                 data.car_pos_norm.sample_rate['current'],
-                                                                 data.car_pos_norm.sample_rate['default'])
-
-    default_time_indices = numpy.union1d(ld_default_time_indices, cpn_default_time_indices)
-    time_indices = default_time_indices[default_time_indices < len(time_scales[data.lap_distance.sample_rate['default']])]
-    time_values = time_scales[data.lap_distance.sample_rate['default']][time_indices]
-    ld_values = data.lap_distance[(time_indices, data.lap_distance.sample_rate['default'])]
-    cpn_values = data.car_pos_norm[(time_indices, data.car_pos_norm.sample_rate['default'])]
-    lap_number_values = data.lap_number[(time_indices, data.lap_number.sample_rate['default'])]
+    samples = data.sample(['lap_distance', 'car_pos_norm', 'lap_number'])
+    time_values = time_scales[data.lap_distance.sample_rate['default']][samples['index']]
+    ld_values = samples['lap_distance']
+    cpn_values = samples['car_pos_norm']
+    lap_number_values = samples['lap_number']
 
     figure.add_trace(plotly.graph_objects.Scatter(x=time_values,
                                                   y=ld_values,
@@ -364,46 +880,49 @@ def plot_car_pos_norm_vs_lap_distance(data: DataContainer, time_scales):
     figure.show()
 
 
+def get_xy_trace(data: DataContainer, x_channel_name: str, y_channel_name: str) -> plotly.graph_objects.Scatter:
+    x_axis_data = getattr(data, x_channel_name)
+    y_axis_data = getattr(data, y_channel_name)
+    samples = data.sample([x_channel_name, y_channel_name])
+    x_values = samples[x_channel_name]
+    y_values = samples[y_channel_name]
+    return plotly.graph_objects.Scatter(x=x_values,
+                                        y=y_values,
+                                        name=f'{y_axis_data.title} vs {x_axis_data.title}',
+                                        showlegend=True,
+                                        line=dict(shape='hv')
+                                        )
+
+
 def general_xy_plot(figure: plotly.graph_objects.Figure,
                     data: DataContainer,
                     x_channel_name: str,
                     y_channel_name: str):
     x_axis_data = getattr(data, x_channel_name)
     y_axis_data = getattr(data, y_channel_name)
-    x_axis_time_indices = x_axis_data.convert_indices(x_axis_data.indices,
-                                                      x_axis_data.sample_rate['current'],
-                                                      x_axis_data.sample_rate['default'])
-    y_axis_time_indices = y_axis_data.convert_indices(y_axis_data.indices,
-                                                      y_axis_data.sample_rate['current'],
-                                                      y_axis_data.sample_rate['default'])
-    indices = numpy.union1d(x_axis_time_indices, y_axis_time_indices)
-    x_values = x_axis_data[(indices, x_axis_data.sample_rate['default'])]
-    y_values = y_axis_data[(indices, y_axis_data.sample_rate['default'])]
-    figure.add_trace(plotly.graph_objects.Scatter(x=x_values,
-                                                  y=y_values,
-                                                  name=f'{y_axis_data.title} vs {x_axis_data.title}',
-                                                  showlegend=True,
-                                                  line=dict(shape='hv')
-                                                  ),
-                     )
+    figure.add_trace(get_xy_trace(data, x_channel_name, y_channel_name))
     figure.update_layout(xaxis=dict(title=f'{x_axis_data.title} ({x_axis_data.unit})'),
                          yaxis=dict(title=f'{y_axis_data.title} ({y_axis_data.unit})',),)
 
 
+def get_time_trace(data: DataContainer, time_scales: dict, y_channel_name: str) -> plotly.graph_objects.Scatter:
+    y_axis_data = getattr(data, y_channel_name)
+    x_values = time_scales[y_axis_data.sample_rate['current']][y_axis_data.indices]
+    y_values = y_axis_data.values
+    return plotly.graph_objects.Scatter(x=x_values,
+                                        y=y_values,
+                                        name=f'{y_axis_data.title} vs time',
+                                        showlegend=True,
+                                        line=dict(shape='hv')
+                                        )
+
+
 def general_time_plot(figure: plotly.graph_objects.Figure,
                       data: DataContainer,
                       time_scales: dict,
                       y_channel_name: str):
     y_axis_data = getattr(data, y_channel_name)
-    x_values = time_scales[y_axis_data.sample_rate['current']][y_axis_data.indices]
-    y_values = y_axis_data.values
-    figure.add_trace(plotly.graph_objects.Scatter(x=x_values,
-                                                  y=y_values,
-                                                  name=f'{y_axis_data.title} vs time',
-                                                  showlegend=True,
-                                                  line=dict(shape='hv')
-                                                  ),
-                     )
+    figure.add_trace(get_time_trace(data, time_scales, y_channel_name))
     figure.update_layout(xaxis=dict(title='Time (s)',),
                          yaxis=dict(title=f'{y_axis_data.title} ({y_axis_data.unit})',),)
 
@@ -451,8 +970,7 @@ if __name__ == '__main__':
 
     # # plot_track_map(fig)
     # # plot_trajectory(data_container, fig)
-    # sector_times = get_sector_times(data_container, time_scales=data_time_scales)
-    # plot_sector_times(sector_times, fig)
+    # plot_sector_times(SectorTimes(data_container, data_time_scales), fig)  # from section_timing
     # # plot_lap_times(data_container, fig)
     #
     fig.show()
@@ -0,0 +1,191 @@
+import numpy
+import plotly
+import plotly.graph_objects
+
+from typing import Literal
+
+from data_container import DataContainer
+
+
+class DistanceResampler:
+    def __init__(self,
+                 data: DataContainer,
+                 time_scales: dict,
+                 distance_channel_name: Literal['car_pos_norm', 'lap_distance'] = 'car_pos_norm'):
+        self.data: DataContainer = data
+        self.time_scales: dict = time_scales
+        self.lap_index = data.get_lap_index(time_scales)
+        self.distance_channel_name: str = distance_channel_name
+        distance_channel = getattr(data, distance_channel_name)
+        if distance_channel_name == 'car_pos_norm':
+            self.lap_length: float = 1.0
+        else:
+            self.lap_length: float = float(numpy.nanmax(distance_channel.values))
+        self.sample_rate: int = distance_channel.sample_rate['default']
+        self._mappings: dict[int, tuple[numpy.ndarray, numpy.ndarray]] = {}
+        self._grid_times: dict[tuple[int, int], numpy.ndarray] = {}
+        self._resampled_channels: dict[tuple[int, str, int], numpy.ndarray] = {}
+
+    def get_grid(self, resolution: int) -> numpy.ndarray:
+        return numpy.linspace(0, self.lap_length, resolution, endpoint=False)
+
+    def get_mapping(self, lap_number: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+        # Strictly increasing distances along the lap, and the session time at which each of them is reached
+        if lap_number not in self._mappings:
+            position = self.lap_index.get_position(lap_number)
+            distance_channel = getattr(self.data, self.distance_channel_name)
+            sample_rate = distance_channel.sample_rate['current']
+            start_index = self.lap_index.start_indices[sample_rate][position]
+            values, indices = distance_channel.get_slice(start_index, self.lap_index.end_indices[sample_rate][position])
+            indices = numpy.maximum(indices, start_index)
+            distances = self._unwrap(values.astype(float))
+            times = self.time_scales[sample_rate][indices]
+            # The distance may decrease slightly when the car goes backwards or stands still
+            distances = numpy.maximum.accumulate(distances)
+            distances, first_indices = numpy.unique(distances, return_index=True)
+            times = times[first_indices]
+            # The distance may reset a few samples before the lap counter, so that the first distance of the lap is
+            # already past the line: the line is then taken as crossed at the start of the lap
+            if len(distances) and distances[0] > 0:
+                distances = numpy.append(0., distances)
+                times = numpy.append(self.lap_index.start_times[position], times)
+            self._mappings[lap_number] = (distances, times)
+        return self._mappings[lap_number]
+
+    def _unwrap(self, distances: numpy.ndarray) -> numpy.ndarray:
+        # The lap counter and the distance do not reset on exactly the same sample, so a lap can start slightly
+        # before the start/finish line (e.g. at 0.99) or end slightly after it (e.g. at 0.01)
+        if not len(distances):
+            return distances
+        distances = numpy.unwrap(distances, period=self.lap_length)
+        return distances - numpy.floor(numpy.median(distances) / self.lap_length) * self.lap_length
+
+    def get_times(self, lap_number: int, resolution: int) -> numpy.ndarray:
+        # Session time at each point of the distance grid, NaN where the lap does not cover the grid
+        key = (lap_number, resolution)
+        if key not in self._grid_times:
+            distances, times = self.get_mapping(lap_number)
+            self._grid_times[key] = numpy.interp(self.get_grid(resolution), distances, times,
+                                                 left=numpy.nan, right=numpy.nan)
+        return self._grid_times[key]
+
+    def resample(self, lap_number: int, channel_name: str, resolution: int = 1000) -> numpy.ndarray:
+        # Value of the channel at each point of the distance grid, interpolated between its two surrounding samples
+        # for float channels, and held from the previous sample for the others, such as gear or flags
+        key = (lap_number, channel_name, resolution)
+        if key not in self._resampled_channels:
+            times = self.get_times(lap_number, resolution)
+            covered = ~numpy.isnan(times)
+            channel = getattr(self.data, channel_name)
+            sample_rate = channel.sample_rate['current']
+            positions = times[covered] * sample_rate
+            time_indices = numpy.floor(positions + 1e-6).astype(int)
+            values = numpy.full(resolution, numpy.nan)
+            values[covered] = channel[(time_indices, sample_rate)]
+            if channel.values.dtype.kind == 'f':
+                next_values = channel[(time_indices + 1, sample_rate)]
+                # The last sample of the session and the samples before a gap are held
+                next_values = numpy.where(numpy.isnan(next_values), values[covered], next_values)
+                fractions = numpy.clip(positions - time_indices, 0., 1.)
+                values[covered] += (next_values - values[covered]) * fractions
+            self._resampled_channels[key] = values
+        return self._resampled_channels[key]
+
+    def get_elapsed_times(self, lap_number: int, resolution: int) -> numpy.ndarray:
+        # Time since the start of the lap
+        times = self.get_times(lap_number, resolution)
+        return times - self.lap_index.start_times[self.lap_index.get_position(lap_number)]
+
+    def delta_time(self, lap_number: int, reference_lap_number: int, resolution: int = 1000) -> numpy.ndarray:
+        # Positive where lap_number is behind the reference lap
+        return self.delta_times(reference_lap_number, [lap_number], resolution)[0]
+
+    def delta_times(self,
+                    reference_lap_number: int,
+                    lap_numbers: list[int] | None = None,
+                    resolution: int = 1000) -> numpy.ndarray:
+        # One row per lap of lap_numbers (every lap of the session by default)
+        if lap_numbers is None:
+            lap_numbers = [int(lap_number) for lap_number in self.lap_index.numbers]
+        return self.get_elapsed_times_matrix(lap_numbers, resolution) - \
+            self.get_elapsed_times(reference_lap_number, resolution)
+
+    def get_elapsed_times_matrix(self, lap_numbers: list[int], resolution: int) -> numpy.ndarray:
+        # Elapsed times of every lap of lap_numbers on the distance grid, as a (laps, grid) array computed with a
+        # single interpolation: the mappings of the laps are concatenated, each one offset far enough along the
+        # distance axis not to overlap with the previous one
+        mappings = [self.get_mapping(lap_number) for lap_number in lap_numbers]
+        lengths = numpy.array([len(distances) for distances, _ in mappings], dtype=int)
+        elapsed_times = numpy.full((len(lap_numbers), resolution), numpy.nan)
+        if not lengths.sum():
+            return elapsed_times
+        distances = numpy.concatenate([distances for distances, _ in mappings])
+        times = numpy.concatenate([times for _, times in mappings])
+        lap_offsets = numpy.arange(len(lap_numbers)) * (numpy.ptp(distances) + 2 * self.lap_length)
+        grid = self.get_grid(resolution)
+        grid_times = numpy.interp((grid + lap_offsets[:, numpy.newaxis]).ravel(),
+                                  distances + numpy.repeat(lap_offsets, lengths),
+                                  times).reshape(len(lap_numbers), resolution)
+        # Grid points outside the mapping of their lap would be interpolated from the neighbouring laps
+        mapped = lengths > 0
+        ends = numpy.cumsum(lengths)[mapped]
+        first_distances = distances[ends - lengths[mapped]]
+        last_distances = distances[ends - 1]
+        covered = (grid >= first_distances[:, numpy.newaxis]) & (grid <= last_distances[:, numpy.newaxis])
+        positions = numpy.array([self.lap_index.get_position(lap_number) for lap_number in lap_numbers], dtype=int)
+        elapsed_times[mapped] = numpy.where(covered,
+                                            grid_times[mapped] -
+                                            self.lap_index.start_times[positions[mapped]][:, numpy.newaxis],
+                                            numpy.nan)
+        return elapsed_times
+
+    def resample_laps(self, lap_numbers: list[int], channel_name: str, resolution: int = 1000) -> numpy.ndarray:
+        return numpy.array([self.resample(lap_number, channel_name, resolution) for lap_number in lap_numbers])
+
+    def get_memory_size(self) -> int:
+        # Bytes held by the mappings and resampled arrays cached so far
+        size = sum(distances.nbytes + times.nbytes for distances, times in self._mappings.values())
+        size += sum(times.nbytes for times in self._grid_times.values())
+        return size + sum(values.nbytes for values in self._resampled_channels.values())
+
+
+def plot_lap_overlay(figure: plotly.graph_objects.Figure,
+                     resampler: DistanceResampler,
+                     lap_numbers: list[int],
+                     channel_name: str,
+                     resolution: int = 1000):
+    channel = getattr(resampler.data, channel_name)
+    distance_channel = getattr(resampler.data, resampler.distance_channel_name)
+    grid = resampler.get_grid(resolution)
+    for lap_number in lap_numbers:
+        figure.add_trace(plotly.graph_objects.Scatter(x=grid,
+                                                      y=resampler.resample(lap_number, channel_name, resolution),
+                                                      name=f'{channel.title}, lap {lap_number}',
+                                                      showlegend=True,
+                                                      line=dict(shape='hv')
+                                                      ),
+                         )
+    figure.update_layout(xaxis=dict(title=f'{distance_channel.title} ({distance_channel.unit})'),
+                         yaxis=dict(title=f'{channel.title} ({channel.unit})',),)
+
+
+def plot_delta_time(figure: plotly.graph_objects.Figure,
+                    resampler: DistanceResampler,
+                    reference_lap_number: int,
+                    lap_numbers: list[int] | None = None,
+                    resolution: int = 1000):
+    if lap_numbers is None:
+        lap_numbers = [int(lap_number) for lap_number in resampler.lap_index.numbers
+                       if lap_number != reference_lap_number]
+    distance_channel = getattr(resampler.data, resampler.distance_channel_name)
+    grid = resampler.get_grid(resolution)
+    delta_times = resampler.delta_times(reference_lap_number, lap_numbers, resolution)
+    for lap_number, delta_time in zip(lap_numbers, delta_times):
+        figure.add_trace(plotly.graph_objects.Scatter(x=grid,
+                                                      y=delta_time,
+                                                      name=f'Lap {lap_number} vs lap {reference_lap_number}',
+                                                      showlegend=True,
+                                                      ),
+                         )
+    figure.update_layout(xaxis=dict(title=f'{distance_channel.title} ({distance_channel.unit})'),
+                         yaxis=dict(title='Delta time (s)',),)
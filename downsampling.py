@@ -0,0 +1,50 @@
+import numpy
+
+
+DEFAULT_MAX_POINTS = 4000
+
+
+def downsample_step(x_values: numpy.ndarray,
+                    y_values: numpy.ndarray,
+                    max_points: int = DEFAULT_MAX_POINTS,
+                    x_range: tuple[float, float] | None = None) -> tuple[numpy.ndarray, numpy.ndarray]:
+    # Min-max decimation of a step ('hv') trace sorted along x: each bucket keeps its first and last change points
+    # and the change points holding its minimum and maximum values, so the drawn envelope is preserved
+    if x_range is not None:
+        # Keep the step in progress at both edges of the range
+        first = max(numpy.searchsorted(x_values, x_range[0], side='right') - 1, 0)
+        last = numpy.searchsorted(x_values, x_range[1], side='right') + 1
+        x_values = x_values[first:last]
+        y_values = y_values[first:last]
+    if len(x_values) <= max_points:
+        return x_values, y_values
+    bucket_count = max(max_points // 4, 1)
+    x_span = x_values[-1] - x_values[0]
+    if x_span <= 0:
+        return x_values[[0, -1]], y_values[[0, -1]]
+    buckets = numpy.minimum(((x_values - x_values[0]) * bucket_count / x_span).astype(int), bucket_count - 1)
+    bucket_starts = numpy.flatnonzero(numpy.r_[True, buckets[1:] != buckets[:-1]])
+    bucket_ends = numpy.r_[bucket_starts[1:], len(x_values)] - 1
+    # Within each bucket, sorting by value puts the minimum at the bucket start and the maximum at its end
+    order = numpy.lexsort((y_values, buckets))
+    kept_indices = numpy.unique(numpy.concatenate([bucket_starts, bucket_ends, order[bucket_starts], order[bucket_ends]]))
+    return x_values[kept_indices], y_values[kept_indices]
+
+
+def downsample_trace(trace: dict,
+                     max_points: int = DEFAULT_MAX_POINTS,
+                     x_range: tuple[float, float] | None = None) -> dict:
+    x_values, y_values = downsample_step(numpy.asarray(trace['x']), numpy.asarray(trace['y']), max_points, x_range)
+    return dict(trace, x=x_values, y=y_values)
+
+
+def get_x_range(relayout_data: dict | None) -> tuple[float, float] | None:
+    # x-axis range selected by zooming or panning, None when the axis is reset to its full range
+    if not relayout_data:
+        return None
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return float(relayout_data['xaxis.range[0]']), float(relayout_data['xaxis.range[1]'])
+    if 'xaxis.range' in relayout_data:
+        x_min, x_max = relayout_data['xaxis.range']
+        return float(x_min), float(x_max)
+    return None
@@ -0,0 +1,54 @@
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable
+
+from session_cache import get_cache_file_name, load_session
+
+
+def ingest_file(data_file: str, sample_rates_file: str = 'config/sample_rates.txt') -> str:
+    # Runs in a worker process: only the name of the cache file goes back to the parent, or the error raised when
+    # the cache could not be written
+    load_session(data_file, sample_rates_file)
+    return get_cache_file_name(data_file)
+
+
+def print_progress(done_count: int, total_count: int, data_file: str, error: Exception | None):
+    status = 'OK' if error is None else f'{type(error).__name__}: {error}'
+    print(f"[{done_count}/{total_count}] {data_file}: {status}")
+
+
+def ingest_files(data_files: list[str],
+                 sample_rates_file: str = 'config/sample_rates.txt',
+                 max_workers: int | None = None,
+                 progress: Callable[[int, int, str, Exception | None], None] | None = print_progress) -> dict[str, Exception]:
+    # Parses the files in parallel into their session caches and returns the errors by file, a failing file
+    # (e.g. the ImportError raised on a column count mismatch) does not stop the others
+    errors = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(ingest_file, data_file, sample_rates_file): data_file for data_file in data_files}
+        for done_count, future in enumerate(as_completed(futures), start=1):
+            data_file = futures[future]
+            error = future.exception()
+            if error is not None:
+                errors[data_file] = error
+            if progress is not None:
+                progress(done_count, len(data_files), data_file, error)
+    return errors
+
+
+def get_data_files(paths: list[str]) -> list[str]:
+    data_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            data_files += sorted(os.path.join(path, file_name) for file_name in os.listdir(path)
+                                 if file_name.endswith('.csv'))
+        else:
+            data_files.append(path)
+    return data_files
+
+
+if __name__ == '__main__':
+    ingest_errors = ingest_files(get_data_files(sys.argv[1:] or ['data']))
+    print(len(ingest_errors), "file(s) could not be ingested")
@@ -5,22 +5,33 @@ import plotly
 import plotly.graph_objects
 from dash_bootstrap_templates import load_figure_template
 
-from coordinates_handler import Origin, get_sections_from_ini_file
-from data_container import main, general_time_plot, general_xy_plot
+from coordinates_handler import Origin, get_sections_from_ini_file, get_track_images
+from distance_resampling import plot_delta_time
+from downsampling import get_x_range
+from pages.rankings_page import get_rankings_page, get_rankings_tables
+from rankings import Rankings
+from session_registry import Session, SessionRegistry
+from session_tail import get_time_delta
+from spatial_index import query_laps
+from trace_cache import TraceCache
+from track_outline import get_track_outline
 # from selection import Selection
 
 
 load_figure_template('SUPERHERO')
 
-source_file = 'data/corvette_c7_laguna_seca_example.csv'
-h, info_container, data = main(source_file)
+data_directory = 'data'
+default_session_name = 'corvette_c7_laguna_seca_example.csv'
+trace_cache = TraceCache()
+registry = SessionRegistry(data_directory, on_evict=trace_cache.clear)
 Origin.setup("config/reference_points.txt")
-data.set_sample_rates()
-time_scales = data.get_time_scales()
 sections = get_sections_from_ini_file()
+rankings = Rankings(sections)
 
 
 def setup_main_application() -> dash.Dash:
+    # Section images are rendered into the assets of the app before its pages link them
+    get_track_images()
     dbc_css = "https://cdn.jsdelivr.net/gh/AnnMarieW/dash-bootstrap-templates@V1.0.2/dbc.min.css"
     app = dash.Dash(__name__,
                     external_stylesheets=[dbc.themes.SUPERHERO, dbc_css],
@@ -29,6 +40,14 @@ def setup_main_application() -> dash.Dash:
     app.layout = dash.html.Div(
         [
             dash.html.H1('Télémétrie'),
+            dash.dcc.Dropdown(
+                options=registry.get_options(),
+                value=default_session_name,
+                id='dropdown-session',
+                clearable=False,
+                maxHeight=400,
+                placeholder="Sélectionner une session",
+            ),
             dbc.Tabs(
                 id="analysis_tabs",
                 active_tab='tab-rankings',
@@ -50,7 +69,7 @@ def setup_main_application() -> dash.Dash:
     return app
 
 
-def get_lap_analysis_page() -> dash.html.Div:
+def get_lap_analysis_page(session: Session) -> dash.html.Div:
     section_names = ["s1", "s2", "s3"]
     figure_track_map = plotly.graph_objects.Figure()
     figure_throttle_brake = plotly.graph_objects.Figure()
@@ -64,9 +83,23 @@ def get_lap_analysis_page() -> dash.html.Div:
     sections = get_sections_from_ini_file()
     for section in sections:
         options.append(dict(label=section.title, value=section.title))
+    lap_options = [dict(label=f"Tour {number} ({duration:.3f} s)", value=int(number))
+                   for number, duration in zip(session.lap_index.numbers, session.lap_index.get_durations())]
     output = dash.html.Div(
         [
             dash.html.H3('Analyse tour-par-tour'),
+            dash.dcc.Dropdown(
+                options=lap_options,
+                id='dropdown-lap_selection',
+                maxHeight=400,
+                placeholder="Sélectionner un tour",
+            ),
+            dash.dcc.Dropdown(
+                options=lap_options,
+                id='dropdown-reference_lap_selection',
+                maxHeight=400,
+                placeholder="Sélectionner le tour de référence",
+            ),
             dash.dcc.Dropdown(
                 options=options,
                 id='dropdown-sector_selection',
@@ -78,6 +111,22 @@ def get_lap_analysis_page() -> dash.html.Div:
                 min=0,
                 max=1,
                 value=0,
+                marks=None,
+                updatemode='drag',
+                tooltip=dict(placement='bottom'),
+                ),
+            dbc.Button(
+                'Lecture / Pause',
+                id='button-playback',
+                size='sm',
+                ),
+            dash.dcc.Interval(
+                id='interval-playback',
+                interval=100,
+                disabled=True,
+                ),
+            dash.dcc.Store(
+                id='store-playback',
                 ),
             dbc.Row(
                 [
@@ -191,20 +240,35 @@ def get_lap_analysis_page() -> dash.html.Div:
                 figure=figure_throttle_brake,
                 id='graph-throttle-brake-display',
                 ),
+            dash.dcc.Graph(
+                figure=plotly.graph_objects.Figure(),
+                id='graph-delta-time',
+                ),
         ],
         className='dbc dbc-ag-grid',
     )
     return output
 
 
-def get_free_display_page() -> dash.html.Div:
+def get_free_display_page(session: Session) -> dash.html.Div:
     figure_time = plotly.graph_objects.Figure()
+    figure_time.update_layout(xaxis=dict(title='Time (s)',))
     figure_xy = plotly.graph_objects.Figure()
     output = dash.html.Div(
         [
             dash.html.H3('Affichage libre - Séries temporelles'),
+            dbc.Switch(
+                id='switch-live',
+                label='Suivre la session en direct',
+                value=registry.is_followed(session.name),
+            ),
+            dash.dcc.Interval(
+                id='interval-live',
+                interval=1000,
+                disabled=not registry.is_followed(session.name),
+            ),
             dash.dcc.Dropdown(
-                options=data.get_title_name_pairs(),
+                options=session.data.get_title_name_pairs(),
                 multi=True,
                 id='dropdown-y-axis-vs-time',
                 maxHeight=400,
@@ -214,15 +278,19 @@ def get_free_display_page() -> dash.html.Div:
                 figure=figure_time,
                 id='graph-free-time-display',
             ),
+            dash.dcc.Store(
+                id='store-free-time-channels',
+                data=[],
+            ),
             dash.html.H3('Affichage libre - xy'),
             dash.dcc.Dropdown(
-                options=data.get_title_name_pairs(),
+                options=session.data.get_title_name_pairs(),
                 id='dropdown-x-axis-xy',
                 maxHeight=400,
                 placeholder="Sélectionner l'axe x",
             ),
             dash.dcc.Dropdown(
-                options=data.get_title_name_pairs(),
+                options=session.data.get_title_name_pairs(),
                 id='dropdown-y-axis-xy',
                 maxHeight=400,
                 placeholder="Sélectionner l'axe y",
@@ -238,31 +306,241 @@ def get_free_display_page() -> dash.html.Div:
 
 
 @dash.callback(dash.Output('analysis_page', 'children'),
-                dash.Input('analysis_tabs', 'active_tab'))
-def render_analysis(selected_tab):
+                dash.Input('analysis_tabs', 'active_tab'),
+                dash.Input('dropdown-session', 'value'))
+def render_analysis(selected_tab, session_name):
+    if session_name is None:
+        return dash.html.Div([])
+    session = registry.get(session_name)
     match selected_tab:
         case 'tab-rankings':
-            sub_page = dash.html.Div([dash.html.H3('Rankings')])
+            # Only the sessions loaded since the last visit of the tab are read
+            rankings.update(registry.get_loaded_sessions())
+            sub_page = get_rankings_page(rankings, session.get_info('track', session.name))
         case 'tab-session':
             sub_page = dash.html.Div([dash.html.H3('Session')])
         case 'tab-lap':
-            sub_page = get_lap_analysis_page()
+            sub_page = get_lap_analysis_page(session)
         case 'tab-free':
-            sub_page = get_free_display_page()
+            sub_page = get_free_display_page(session)
         case _:
             sub_page = dash.html.Div([])
     return sub_page
 
 
+@dash.callback(
+    dash.Output('div-rankings-tables', 'children'),
+    dash.Input('dropdown-rankings-track', 'value'),
+    dash.Input('switch-rankings-valid', 'value'),
+    dash.Input('dropdown-rankings-section', 'value'),
+    prevent_initial_call=True,
+)
+def update_rankings(track, valid_only, section_title):
+    return get_rankings_tables(rankings, track, valid_only, section_title)
+
+
 @dash.callback(
     dash.Output('graph-free-time-display', 'figure'),
+    dash.Output('store-free-time-channels', 'data'),
     dash.Input('dropdown-y-axis-vs-time', 'value'),
+    dash.State('store-free-time-channels', 'data'),
+    dash.State('graph-free-time-display', 'relayoutData'),
+    dash.State('dropdown-session', 'value'),
     prevent_initial_call=True,
 )
-def update_free_time_graph(values):
-    figure = plotly.graph_objects.Figure()
+def update_free_time_graph(values, plotted_channels, relayout_data, session_name):
+    # Only the traces of the channels added to or removed from the selection are sent to the browser
+    session = registry.get(session_name)
+    values = values or []
+    x_range = get_x_range(relayout_data)
+    figure = dash.Patch()
+    for position in reversed(range(len(plotted_channels))):
+        if plotted_channels[position] not in values:
+            del figure['data'][position]
+    plotted_channels = [channel for channel in plotted_channels if channel in values]
     for value in values:
-        general_time_plot(figure, data, time_scales, value)
+        if value not in plotted_channels:
+            figure['data'].append(trace_cache.get_downsampled_trace(session_name, session.data, session.time_scales,
+                                                                    value, x_range=x_range))
+            plotted_channels.append(value)
+    if plotted_channels:
+        y_axis_data = getattr(session.data, plotted_channels[-1])
+        figure['layout']['yaxis']['title']['text'] = f'{y_axis_data.title} ({y_axis_data.unit})'
+    return figure, plotted_channels
+
+
+@dash.callback(
+    dash.Output('graph-free-time-display', 'figure', allow_duplicate=True),
+    dash.Input('graph-free-time-display', 'relayoutData'),
+    dash.State('store-free-time-channels', 'data'),
+    dash.State('dropdown-session', 'value'),
+    prevent_initial_call=True,
+)
+def zoom_free_time_graph(relayout_data, plotted_channels, session_name):
+    # Fetches finer detail for the zoomed range, or the coarse full session when the zoom is reset
+    x_range = get_x_range(relayout_data)
+    if x_range is None and not (relayout_data or {}).get('xaxis.autorange'):
+        raise dash.exceptions.PreventUpdate
+    session = registry.get(session_name)
+    figure = dash.Patch()
+    for position, channel in enumerate(plotted_channels):
+        trace = trace_cache.get_downsampled_trace(session_name, session.data, session.time_scales, channel,
+                                                  x_range=x_range)
+        figure['data'][position]['x'] = trace['x']
+        figure['data'][position]['y'] = trace['y']
+    return figure
+
+
+@dash.callback(
+    dash.Output('interval-live', 'disabled'),
+    dash.Input('switch-live', 'value'),
+    dash.State('dropdown-session', 'value'),
+    prevent_initial_call=True,
+)
+def follow_live_session(follow, session_name):
+    if follow:
+        registry.follow(session_name)
+    else:
+        registry.unfollow(session_name)
+    trace_cache.clear(session_name)
+    return not follow
+
+
+@dash.callback(
+    dash.Output('graph-free-time-display', 'extendData'),
+    dash.Input('interval-live', 'n_intervals'),
+    dash.State('store-free-time-channels', 'data'),
+    dash.State('dropdown-session', 'value'),
+    prevent_initial_call=True,
+)
+def extend_free_time_graph(n_intervals, plotted_channels, session_name):
+    # Only the runs appended to the plotted channels since the last poll are sent to the browser
+    if not registry.is_followed(session_name):
+        raise dash.exceptions.PreventUpdate
+    new_runs = registry.poll(session_name)
+    if not new_runs:
+        raise dash.exceptions.PreventUpdate
+    trace_cache.clear(session_name)
+    session = registry.get(session_name)
+    x_values, y_values, trace_positions = [], [], []
+    for position, channel in enumerate(plotted_channels):
+        if channel in new_runs:
+            x_delta, y_delta = get_time_delta(session.data, session.time_scales, channel, new_runs[channel])
+            x_values.append(x_delta)
+            y_values.append(y_delta)
+            trace_positions.append(position)
+    if not trace_positions:
+        raise dash.exceptions.PreventUpdate
+    return dict(x=x_values, y=y_values), trace_positions
+
+
+@dash.callback(
+    dash.Output('graph-track_map', 'figure'),
+    dash.Input('dropdown-lap_selection', 'value'),
+    dash.Input('dropdown-reference_lap_selection', 'value'),
+    dash.State('dropdown-session', 'value'),
+    prevent_initial_call=True,
+)
+def update_track_map(lap_number, reference_lap_number, session_name):
+    session = registry.get(session_name)
+    figure = plotly.graph_objects.Figure()
+    # Outline built from the loaded sessions of the same track, the section images being only drawn without it
+    track = session.get_info('track', session.name)
+    track_sessions = [loaded_session for loaded_session in registry.get_loaded_sessions()
+                      if loaded_session.get_info('track', loaded_session.name) == track]
+    try:
+        get_track_outline(data_directory, track, track_sessions).plot(figure, sections)
+    except ValueError:
+        for track_image in get_track_images().values():
+            track_image.plot(figure)
+    for number in dict.fromkeys(number for number in (lap_number, reference_lap_number) if number is not None):
+        samples = session.data.lap(number).sample(['car_coord_x', 'car_coord_y'])
+        figure.add_trace(plotly.graph_objects.Scatter(x=samples['car_coord_x'],
+                                                      y=samples['car_coord_y'],
+                                                      mode='lines',
+                                                      name=f'Tour {number}'))
+    figure.update_yaxes(scaleanchor="x", scaleratio=1)
+    return figure
+
+
+@dash.callback(
+    dash.Output('store-playback', 'data'),
+    dash.Output('slider-time-scale', 'max'),
+    dash.Output('slider-time-scale', 'step'),
+    dash.Output('slider-time-scale', 'value'),
+    dash.Input('dropdown-lap_selection', 'value'),
+    dash.State('dropdown-session', 'value'),
+    prevent_initial_call=True,
+)
+def update_playback(lap_number, session_name):
+    # The whole lap is sent once, scrubbing and replay are then handled in the browser (assets/playback.js)
+    if lap_number is None:
+        return None, 1, None, 0
+    frames = registry.get(session_name).get_playback_frames(lap_number)
+    return frames.to_store(), frames.get_duration(), 1 / frames.sample_rate, 0
+
+
+dash.clientside_callback(
+    dash.ClientsideFunction(namespace='playback', function_name='render_frame'),
+    dash.Output('bar-throttle', 'value'),
+    dash.Output('bar-brake', 'value'),
+    dash.Output('bar-clutch', 'value'),
+    dash.Output('LED-gear', 'value'),
+    dash.Output('graph-gg-display', 'figure'),
+    dash.Input('slider-time-scale', 'value'),
+    dash.Input('store-playback', 'data'),
+    prevent_initial_call=True,
+)
+
+dash.clientside_callback(
+    dash.ClientsideFunction(namespace='playback', function_name='toggle_replay'),
+    dash.Output('interval-playback', 'disabled'),
+    dash.Input('button-playback', 'n_clicks'),
+    dash.State('interval-playback', 'disabled'),
+    prevent_initial_call=True,
+)
+
+dash.clientside_callback(
+    dash.ClientsideFunction(namespace='playback', function_name='step_replay'),
+    dash.Output('slider-time-scale', 'value', allow_duplicate=True),
+    dash.Input('interval-playback', 'n_intervals'),
+    dash.State('slider-time-scale', 'value'),
+    dash.State('interval-playback', 'interval'),
+    dash.State('store-playback', 'data'),
+    prevent_initial_call=True,
+)
+
+
+@dash.callback(
+    dash.Output('slider-time-scale', 'value', allow_duplicate=True),
+    dash.Input('graph-track_map', 'hoverData'),
+    dash.State('dropdown-lap_selection', 'value'),
+    dash.State('dropdown-session', 'value'),
+    prevent_initial_call=True,
+)
+def show_track_map_hover_state(hover_data, lap_number, session_name):
+    # Moves playback to the sample of the selected lap nearest to the hovered point
+    if not hover_data or lap_number is None:
+        raise dash.exceptions.PreventUpdate
+    point = hover_data['points'][0]
+    session = registry.get(session_name)
+    nearest = query_laps([session.get_spatial_index(lap_number)], point['x'], point['y'])[0]
+    return session.get_playback_frames(lap_number).get_lap_time(float(nearest['time']))
+
+
+@dash.callback(
+    dash.Output('graph-delta-time', 'figure'),
+    dash.Input('dropdown-lap_selection', 'value'),
+    dash.Input('dropdown-reference_lap_selection', 'value'),
+    dash.State('dropdown-session', 'value'),
+    prevent_initial_call=True,
+)
+def update_delta_time_graph(lap_number, reference_lap_number, session_name):
+    figure = plotly.graph_objects.Figure()
+    if reference_lap_number is None:
+        return figure
+    lap_numbers = None if lap_number is None else [lap_number]
+    plot_delta_time(figure, registry.get(session_name).get_resampler(), reference_lap_number, lap_numbers)
     return figure
 
 
@@ -270,13 +548,19 @@ def update_free_time_graph(values):
     dash.Output('graph-free-xy-display', 'figure'),
     dash.Input('dropdown-x-axis-xy', 'value'),
     dash.Input('dropdown-y-axis-xy', 'value'),
+    dash.State('dropdown-session', 'value'),
     prevent_initial_call=True,
 )
-def update_free_xy_graph(x_axis, y_axis):
+def update_free_xy_graph(x_axis, y_axis, session_name):
     figure = plotly.graph_objects.Figure()
     if x_axis is None or y_axis is None:
         return figure
-    general_xy_plot(figure, data, x_axis, y_axis)
+    session = registry.get(session_name)
+    x_axis_data = getattr(session.data, x_axis)
+    y_axis_data = getattr(session.data, y_axis)
+    figure.add_trace(trace_cache.get_trace(session_name, session.data, session.time_scales, y_axis, x_axis))
+    figure.update_layout(xaxis=dict(title=f'{x_axis_data.title} ({x_axis_data.unit})'),
+                         yaxis=dict(title=f'{y_axis_data.title} ({y_axis_data.unit})',),)
     return figure
 
 
@@ -0,0 +1,88 @@
+import dash
+import dash_bootstrap_components as dbc
+import numpy
+
+from rankings import Rankings
+
+
+def format_time(seconds: float) -> str:
+    if numpy.isnan(seconds):
+        return '-'
+    minutes, seconds = divmod(seconds, 60)
+    return f'{int(minutes)}:{seconds:06.3f}'
+
+
+def format_gap(seconds: float) -> str:
+    return '-' if numpy.isnan(seconds) else f'{seconds:+.3f}'
+
+
+def get_table(header: list[str], rows: list[list[str]]) -> dbc.Table:
+    return dbc.Table([dash.html.Thead(dash.html.Tr([dash.html.Th(title) for title in header])),
+                      dash.html.Tbody([dash.html.Tr([dash.html.Td(cell) for cell in row]) for row in rows])],
+                     striped=True,
+                     hover=True,
+                     size='sm')
+
+
+def get_rankings_tables(rankings: Rankings, track: str, valid_only: bool, section_title: str | None) -> list:
+    best_laps = rankings.get_best_laps(track, valid_only)
+    best_laps_table = get_table(['#', 'Pilote', 'Session', 'Tour', 'Temps', 'Écart'],
+                                [[str(rank + 1), rankings.drivers[row['driver']], rankings.session_names[row['session']],
+                                  str(row['lap_number']), format_time(row['time']), format_gap(row['gap'])]
+                                 for rank, row in enumerate(best_laps)])
+    theoretical_bests = rankings.get_theoretical_bests(track, valid_only)
+    theoretical_bests_table = get_table(['#', 'Pilote', 'Meilleur théorique', 'Meilleur tour', 'Écart'],
+                                        [[str(rank + 1), rankings.drivers[row['driver']], format_time(row['time']),
+                                          format_time(row['best_lap_time']), format_gap(row['gap'])]
+                                         for rank, row in enumerate(theoretical_bests)])
+    tables = [dash.html.H4('Meilleurs tours'), best_laps_table,
+              dash.html.H4('Meilleurs tours théoriques'), theoretical_bests_table]
+    if section_title is not None:
+        section_ranking = rankings.get_section_ranking(track, section_title, valid_only)
+        tables += [dash.html.H4(section_title),
+                   get_table(['#', 'Pilote', 'Temps', 'Écart'],
+                             [[str(rank + 1), rankings.drivers[row['driver']], format_time(row['time']),
+                               format_gap(row['gap'])]
+                              for rank, row in enumerate(section_ranking)])]
+    return tables
+
+
+def get_rankings_page(rankings: Rankings, track: str) -> dash.html.Div:
+    section_title = rankings.section_titles[0] if rankings.section_titles else None
+    output = dash.html.Div(
+        [
+            dbc.Row(
+                [
+                    dbc.Col(
+                        dash.dcc.Dropdown(
+                            options=rankings.tracks,
+                            value=track,
+                            id='dropdown-rankings-track',
+                            clearable=False,
+                        ),
+                    ),
+                    dbc.Col(
+                        dash.dcc.Dropdown(
+                            options=rankings.section_titles,
+                            value=section_title,
+                            id='dropdown-rankings-section',
+                            placeholder='Virage',
+                        ),
+                    ),
+                    dbc.Col(
+                        dbc.Switch(
+                            id='switch-rankings-valid',
+                            label='Tours valides uniquement',
+                            value=True,
+                        ),
+                    ),
+                ],
+            ),
+            dash.html.Div(
+                get_rankings_tables(rankings, track, True, section_title),
+                id='div-rankings-tables',
+            ),
+        ],
+        className='dbc dbc-ag-grid',
+    )
+    return output
@@ -0,0 +1,69 @@
+import numpy
+
+from data_container import DEFAULT_SAMPLE_RATE, DataContainer
+
+
+# Channels shown by the instrument widgets of the lap page, in frame column order
+PLAYBACK_CHANNELS = ('throttle_pos', 'brake_pos', 'clutch_pos', 'gear', 'cg_accel_lateral', 'cg_accel_longitudinal',
+                     'ground_speed', 'car_coord_x', 'car_coord_y')
+# Decimals kept when frames are sent to the browser
+PLAYBACK_DECIMALS = 3
+
+
+class PlaybackFrames:
+    def __init__(self,
+                 data: DataContainer,
+                 time_scales: dict,
+                 lap_number: int,
+                 sample_rate: int = DEFAULT_SAMPLE_RATE,
+                 channel_names: tuple[str, ...] = PLAYBACK_CHANNELS):
+        # State of every playback channel at each time index of the lap, one frame per row of a contiguous array,
+        # so that the frame at a given lap time is found by arithmetic alone
+        lap_index = data.get_lap_index(time_scales)
+        if sample_rate not in lap_index.start_indices:
+            raise ValueError(f'No time scale at {sample_rate}Hz')
+        position = lap_index.get_position(lap_number)
+        start_index = lap_index.start_indices[sample_rate][position]
+        end_index = lap_index.end_indices[sample_rate][position]
+        self.lap_number: int = lap_number
+        self.sample_rate: int = sample_rate
+        self.channel_names: tuple[str, ...] = channel_names
+        self.channel_positions: dict[str, int] = {name: i for i, name in enumerate(channel_names)}
+        time_indices = numpy.arange(start_index, end_index)
+        self.start_time: float = float(time_scales[sample_rate][start_index])
+        self.frames: numpy.ndarray = numpy.empty((len(time_indices), len(channel_names)), dtype=numpy.float64)
+        for column, channel_name in enumerate(channel_names):
+            self.frames[:, column] = getattr(data, channel_name)[(time_indices, sample_rate)]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get_memory_size(self) -> int:
+        return self.frames.nbytes
+
+    def get_duration(self) -> float:
+        return len(self.frames) / self.sample_rate
+
+    def get_frame_position(self, lap_time: float) -> int:
+        # lap_time is the time elapsed since the start of the lap, clipped to the lap
+        return min(max(int(lap_time * self.sample_rate + 1e-6), 0), len(self.frames) - 1)
+
+    def get_frame(self, lap_time: float) -> dict[str, float]:
+        return dict(zip(self.channel_names, self.frames[self.get_frame_position(lap_time)].tolist()))
+
+    def get_lap_time(self, session_time: float) -> float:
+        return session_time - self.start_time
+
+    def to_store(self) -> dict:
+        # Whole lap for a dcc.Store, frames flattened row by row: channel j of frame i is at i * channel count + j
+        accelerations = self.frames[:, [self.channel_positions['cg_accel_lateral'],
+                                        self.channel_positions['cg_accel_longitudinal']]]
+        finite_accelerations = accelerations[numpy.isfinite(accelerations)]
+        return dict(lap_number=self.lap_number,
+                    sample_rate=self.sample_rate,
+                    start_time=self.start_time,
+                    channels=list(self.channel_names),
+                    frame_count=len(self.frames),
+                    acceleration_range=float(numpy.abs(finite_accelerations).max())
+                    if len(finite_accelerations) else 1.,
+                    frames=self.frames.round(PLAYBACK_DECIMALS).ravel().tolist())
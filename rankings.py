@@ -0,0 +1,318 @@
+import numpy
+
+from coordinates_handler import Section
+from section_timing import LAP_START_TOLERANCE, SECTOR_END_TOLERANCE
+from session_registry import Session
+
+
+LAP_DTYPE = numpy.dtype([('lap_id', numpy.int64),
+                         ('session', numpy.int32),
+                         ('track', numpy.int32),
+                         ('driver', numpy.int32),
+                         ('lap_number', numpy.int32),
+                         ('lap_time', numpy.float64),
+                         ('complete', numpy.bool_),
+                         ('valid', numpy.bool_)])
+
+# Sector or section time of a lap, split being the position of the sector in Rankings.sector_ends of its track, or
+# the position of the section in Rankings.section_titles
+SPLIT_DTYPE = numpy.dtype([('lap_id', numpy.int64),
+                           ('split', numpy.int32),
+                           ('time', numpy.float64)])
+
+LAP_RANKING_DTYPE = numpy.dtype([('driver', numpy.int32),
+                                 ('session', numpy.int32),
+                                 ('lap_number', numpy.int32),
+                                 ('time', numpy.float64),
+                                 ('gap', numpy.float64)])
+
+SECTION_RANKING_DTYPE = numpy.dtype([('driver', numpy.int32),
+                                     ('time', numpy.float64),
+                                     ('gap', numpy.float64)])
+
+BEST_SPLIT_DTYPE = numpy.dtype([('driver', numpy.int32),
+                                ('split', numpy.int32),
+                                ('time', numpy.float64)])
+
+THEORETICAL_BEST_DTYPE = numpy.dtype([('driver', numpy.int32),
+                                      ('time', numpy.float64),
+                                      ('best_lap_time', numpy.float64),
+                                      ('gap', numpy.float64)])
+
+MIN_CAPACITY = 1024
+
+
+def _append_rows(buffer: numpy.ndarray, count: int, rows: numpy.ndarray) -> numpy.ndarray:
+    # Amortized growth of a table of which only the first count rows are used
+    if count + len(rows) > len(buffer):
+        new_buffer = numpy.empty(max(2 * (count + len(rows)), MIN_CAPACITY), dtype=buffer.dtype)
+        new_buffer[:count] = buffer[:count]
+        buffer = new_buffer
+    buffer[count:count + len(rows)] = rows
+    return buffer
+
+
+def _get_group_starts(keys: numpy.ndarray) -> numpy.ndarray:
+    # Positions where a new group starts in an array sorted by keys
+    return numpy.flatnonzero(numpy.append(True, keys[1:] != keys[:-1])) if len(keys) else numpy.zeros(0, dtype=int)
+
+
+def get_lap_validity(session: Session) -> tuple[numpy.ndarray, numpy.ndarray]:
+    # Laps recorded from line to line, and laps during which lap_invalidated was never raised
+    data, lap_index = session.data, session.lap_index
+    complete = numpy.arange(len(lap_index)) < len(lap_index) - 1
+    valid = numpy.ones(len(lap_index), dtype=bool)
+    if not len(lap_index):
+        return complete, valid
+    # The first lap is only complete when the recording started on the start/finish line
+    complete[0] &= bool(data.car_pos_norm.values[0] < LAP_START_TOLERANCE)
+    if 'lap_invalidated' in data.get_channel_names():
+        flag = data.lap_invalidated
+        sample_rate = flag.sample_rate['current']
+        # Runs of the flag overlapping each lap, including the one in progress at the start of the lap
+        first_runs = numpy.maximum(numpy.searchsorted(flag.indices, lap_index.start_indices[sample_rate],
+                                                      side='right') - 1, 0)
+        last_runs = numpy.maximum(numpy.searchsorted(flag.indices, lap_index.end_indices[sample_rate]),
+                                  first_runs + 1)
+        raised = numpy.append(flag.values.astype(float) != 0, False)
+        boundaries = numpy.stack([first_runs, last_runs], axis=1).ravel()
+        valid = ~numpy.logical_or.reduceat(raised, boundaries)[::2]
+    return complete, valid
+
+
+class Rankings:
+    def __init__(self, sections: list[Section]):
+        # Columnar tables of the laps of every session added, of their sector times and of their section times,
+        # sessions, tracks and drivers being stored as positions in the lists below
+        self.section_titles: list[str] = [section.title for section in sections]
+        self.sections: list[Section] = sections
+        self.session_names: list[str] = []
+        self.tracks: list[str] = []
+        self.drivers: list[str] = []
+        self.sector_ends: dict[int, list[float]] = {}  # Fraction of the lap at the end of each sector, per track
+        self._laps: numpy.ndarray = numpy.empty(0, dtype=LAP_DTYPE)
+        self._sectors: numpy.ndarray = numpy.empty(0, dtype=SPLIT_DTYPE)
+        self._section_times: numpy.ndarray = numpy.empty(0, dtype=SPLIT_DTYPE)
+        self._lap_count: int = 0
+        self._sector_count: int = 0
+        self._section_time_count: int = 0
+        self._next_lap_id: int = 0
+        self._session_lap_counts: dict[str, int] = {}
+        self._lap_order: numpy.ndarray | None = None  # Lap positions sorted by track, driver and lap time
+
+    @property
+    def laps(self) -> numpy.ndarray:
+        return self._laps[:self._lap_count]
+
+    @property
+    def sectors(self) -> numpy.ndarray:
+        return self._sectors[:self._sector_count]
+
+    @property
+    def section_times(self) -> numpy.ndarray:
+        return self._section_times[:self._section_time_count]
+
+    @staticmethod
+    def _get_code(names: list[str], name: str) -> int:
+        if name not in names:
+            names.append(name)
+        return names.index(name)
+
+    @staticmethod
+    def _find_code(names: list[str], name: str) -> int:
+        return names.index(name) if name in names else -1
+
+    def _get_sector_ids(self, track: int, sector_ends: numpy.ndarray) -> numpy.ndarray:
+        # Sectors of track matching the sectors of a session by the fraction of the lap at which they end, as a
+        # session may not have recorded every sector, those ending away from all the known ones being added
+        track_sector_ends = self.sector_ends.setdefault(track, [])
+        sector_ids = numpy.empty(len(sector_ends), dtype=numpy.int32)
+        for position, sector_end in enumerate(sector_ends):
+            distances = numpy.abs(numpy.array(track_sector_ends) - sector_end)
+            if len(distances) and distances.min() <= SECTOR_END_TOLERANCE:
+                sector_ids[position] = distances.argmin()
+            else:
+                sector_ids[position] = len(track_sector_ends)
+                track_sector_ends.append(float(sector_end))
+        return sector_ids
+
+    def update(self, sessions: list[Session]):
+        # Adds the sessions that are new or have gained laps since the last update, see add_session
+        for session in sessions:
+            if self._session_lap_counts.get(session.name) != len(session.lap_index):
+                self.add_session(session)
+
+    def add_session(self, session: Session):
+        # Replaces the rows of a session already added, a live session having been extended
+        if session.name in self._session_lap_counts:
+            self.remove_session(session.name)
+        lap_index = session.lap_index
+        lap_ids = self._next_lap_id + numpy.arange(len(lap_index))
+        self._next_lap_id += len(lap_index)
+        self._session_lap_counts[session.name] = len(lap_index)
+
+        laps = numpy.empty(len(lap_index), dtype=LAP_DTYPE)
+        laps['lap_id'] = lap_ids
+        laps['session'] = self._get_code(self.session_names, session.name)
+        track = self._get_code(self.tracks, session.get_info('track', session.name))
+        laps['track'] = track
+        laps['driver'] = self._get_code(self.drivers, session.get_info('driver', ''))
+        laps['lap_number'] = lap_index.numbers
+        laps['lap_time'] = lap_index.get_durations()
+        laps['complete'], laps['valid'] = get_lap_validity(session)
+        self._laps = _append_rows(self._laps, self._lap_count, laps)
+        self._lap_count += len(laps)
+
+        if 'last_sector_time' in session.data.get_channel_names():
+            sector_times = session.get_sector_times()
+            sector_durations = sector_times.table['duration']
+            sector_ids = self._get_sector_ids(track, sector_times.sector_ends)
+        else:
+            sector_durations = numpy.zeros((len(lap_index), 0))
+            sector_ids = numpy.zeros(0, dtype=numpy.int32)
+        lap_positions, sector_positions = numpy.nonzero(~numpy.isnan(sector_durations))
+        sectors = numpy.empty(len(lap_positions), dtype=SPLIT_DTYPE)
+        sectors['lap_id'] = lap_ids[lap_positions]
+        sectors['split'] = sector_ids[sector_positions]
+        sectors['time'] = sector_durations[lap_positions, sector_positions]
+        self._sectors = _append_rows(self._sectors, self._sector_count, sectors)
+        self._sector_count += len(sectors)
+
+        section_durations = session.get_section_times(self.sections).table['duration']
+        lap_positions, section_positions = numpy.nonzero(~numpy.isnan(section_durations))
+        section_times = numpy.empty(len(lap_positions), dtype=SPLIT_DTYPE)
+        section_times['lap_id'] = lap_ids[lap_positions]
+        section_times['split'] = section_positions
+        section_times['time'] = section_durations[lap_positions, section_positions]
+        self._section_times = _append_rows(self._section_times, self._section_time_count, section_times)
+        self._section_time_count += len(section_times)
+        self._lap_order = None
+
+    def remove_session(self, name: str):
+        session = self.session_names.index(name)
+        removed_lap_ids = self.laps['lap_id'][self.laps['session'] == session]
+        kept_laps = self.laps[self.laps['session'] != session]
+        kept_sectors = self.sectors[~numpy.isin(self.sectors['lap_id'], removed_lap_ids)]
+        kept_section_times = self.section_times[~numpy.isin(self.section_times['lap_id'], removed_lap_ids)]
+        self._lap_count, self._sector_count, self._section_time_count = 0, 0, 0
+        self._laps = _append_rows(self._laps, 0, kept_laps)
+        self._lap_count = len(kept_laps)
+        self._sectors = _append_rows(self._sectors, 0, kept_sectors)
+        self._sector_count = len(kept_sectors)
+        self._section_times = _append_rows(self._section_times, 0, kept_section_times)
+        self._section_time_count = len(kept_section_times)
+        del self._session_lap_counts[name]
+        self._lap_order = None
+
+    def _get_lap_order(self) -> numpy.ndarray:
+        # Index of the laps, rebuilt on the first query after sessions have been added
+        if self._lap_order is None:
+            laps = self.laps
+            self._lap_order = numpy.lexsort((laps['lap_time'], laps['driver'], laps['track']))
+        return self._lap_order
+
+    def _get_track_laps(self, track: str) -> numpy.ndarray:
+        # Lap positions on track, sorted by driver and lap time
+        if track not in self.tracks:
+            return numpy.zeros(0, dtype=int)
+        order = self._get_lap_order()
+        track_codes = self.laps['track'][order]
+        code = self.tracks.index(track)
+        return order[numpy.searchsorted(track_codes, code):numpy.searchsorted(track_codes, code, side='right')]
+
+    def get_best_laps(self, track: str, valid_only: bool = True) -> numpy.ndarray:
+        # Best complete lap of each driver on track, fastest first
+        laps = self.laps
+        positions = self._get_track_laps(track)
+        kept = laps['complete'][positions] & ~numpy.isnan(laps['lap_time'][positions])
+        if valid_only:
+            kept &= laps['valid'][positions]
+        positions = positions[kept]
+        # Laps are sorted by lap time within each driver, so the first of each driver is the best
+        best_positions = positions[_get_group_starts(laps['driver'][positions])]
+        best_positions = best_positions[numpy.argsort(laps['lap_time'][best_positions], kind='stable')]
+        return self._get_lap_ranking(laps[best_positions])
+
+    def get_driver_laps(self, track: str, driver: str, valid_only: bool = True) -> numpy.ndarray:
+        # Every complete lap of a driver on track, fastest first
+        laps = self.laps
+        positions = self._get_track_laps(track)
+        kept = laps['complete'][positions] & ~numpy.isnan(laps['lap_time'][positions])
+        kept &= laps['driver'][positions] == self._find_code(self.drivers, driver)
+        if valid_only:
+            kept &= laps['valid'][positions]
+        return self._get_lap_ranking(laps[positions[kept]])
+
+    @staticmethod
+    def _get_lap_ranking(laps: numpy.ndarray) -> numpy.ndarray:
+        ranking = numpy.empty(len(laps), dtype=LAP_RANKING_DTYPE)
+        for name in ('driver', 'session', 'lap_number'):
+            ranking[name] = laps[name]
+        ranking['time'] = laps['lap_time']
+        ranking['gap'] = laps['lap_time'] - laps['lap_time'][0] if len(laps) else []
+        return ranking
+
+    def _get_best_splits(self, splits: numpy.ndarray, track: str, valid_only: bool) -> numpy.ndarray:
+        # Best time of each driver in each split on track, as rows of driver, split and time sorted by driver
+        if track not in self.tracks:
+            return numpy.zeros(0, dtype=BEST_SPLIT_DTYPE)
+        laps = self.laps
+        lap_positions = numpy.searchsorted(laps['lap_id'], splits['lap_id'])
+        kept = laps['track'][lap_positions] == self.tracks.index(track)
+        if valid_only:
+            kept &= laps['valid'][lap_positions]
+        drivers = laps['driver'][lap_positions[kept]]
+        split_positions = splits['split'][kept]
+        times = splits['time'][kept]
+        order = numpy.lexsort((times, split_positions, drivers))
+        keys = drivers[order].astype(numpy.int64) << 32 | split_positions[order]
+        best = order[_get_group_starts(keys)]
+        best_splits = numpy.empty(len(best), dtype=BEST_SPLIT_DTYPE)
+        best_splits['driver'] = drivers[best]
+        best_splits['split'] = split_positions[best]
+        best_splits['time'] = times[best]
+        return best_splits
+
+    def get_theoretical_bests(self, track: str, valid_only: bool = True) -> numpy.ndarray:
+        # Sum of the best sectors of each driver on track, for the drivers who completed every sector, fastest first
+        best_sectors = self._get_best_splits(self.sectors, track, valid_only)
+        sector_count = len(self.sector_ends[self.tracks.index(track)]) if len(best_sectors) else 0
+        group_starts = _get_group_starts(best_sectors['driver'])
+        drivers = best_sectors['driver'][group_starts]
+        times = numpy.add.reduceat(best_sectors['time'], group_starts) if len(group_starts) else numpy.zeros(0)
+        counts = numpy.diff(numpy.append(group_starts, len(best_sectors)))
+        drivers, times = drivers[counts == sector_count], times[counts == sector_count]
+        order = numpy.argsort(times, kind='stable')
+        best_laps = self.get_best_laps(track, valid_only)
+        best_lap_times = numpy.full(len(self.drivers), numpy.nan)
+        best_lap_times[best_laps['driver']] = best_laps['time']
+        theoretical_bests = numpy.empty(len(order), dtype=THEORETICAL_BEST_DTYPE)
+        theoretical_bests['driver'] = drivers[order]
+        theoretical_bests['time'] = times[order]
+        theoretical_bests['best_lap_time'] = best_lap_times[drivers[order]]
+        theoretical_bests['gap'] = theoretical_bests['best_lap_time'] - theoretical_bests['time']
+        return theoretical_bests
+
+    def get_section_ranking(self, track: str, section_title: str, valid_only: bool = True) -> numpy.ndarray:
+        # Best time of each driver through a section of track, fastest first
+        if section_title not in self.section_titles:
+            raise ValueError(f'Section {section_title} is not defined')
+        best_sections = self._get_best_splits(self.section_times, track, valid_only)
+        best_sections = best_sections[best_sections['split'] == self.section_titles.index(section_title)]
+        best_sections = best_sections[numpy.argsort(best_sections['time'], kind='stable')]
+        ranking = numpy.empty(len(best_sections), dtype=SECTION_RANKING_DTYPE)
+        ranking['driver'] = best_sections['driver']
+        ranking['time'] = best_sections['time']
+        ranking['gap'] = best_sections['time'] - best_sections['time'][0] if len(best_sections) else []
+        return ranking
+
+    def __len__(self):
+        return self._lap_count
+
+    def __str__(self):
+        output_str = 'Rankings:'
+        for track in self.tracks:
+            output_str += f"\n\t{track}:"
+            for row in self.get_best_laps(track, valid_only=False):
+                output_str += f"\n\t\t{self.drivers[row['driver']]} {row['time']:.3f}s (+{row['gap']:.3f}s)"
+        return output_str
@@ -0,0 +1,204 @@
+import numpy
+import plotly
+import plotly.graph_objects
+
+from coordinates_handler import Section
+from data_container import DataContainer, DataField
+
+
+SECTION_TIME_DTYPE = numpy.dtype([('entry_time', numpy.float64),
+                                  ('exit_time', numpy.float64),
+                                  ('duration', numpy.float64),
+                                  ('min_speed', numpy.float64),
+                                  ('max_speed', numpy.float64)])
+
+SECTOR_TIME_DTYPE = numpy.dtype([('end_time', numpy.float64),
+                                 ('duration', numpy.float64)])
+
+# Fraction of a lap by which car_pos_norm may lag behind the lap counter at the start/finish line
+LAP_START_TOLERANCE = 0.05
+# Fraction of a lap by which the positions logged at the end of a same sector may differ from lap to lap
+SECTOR_END_TOLERANCE = 0.02
+# Seconds by which the time between the ends of two sectors may differ from the duration logged for the second one
+SECTOR_DURATION_TOLERANCE = 0.5
+# Factor from the unit of the sector time channel to seconds, other units being taken as seconds
+SECTOR_TIME_FACTORS = {'ms': 1e-3}
+
+
+def get_progress(car_pos_norm: DataField, time_scales: dict) -> tuple[numpy.ndarray, numpy.ndarray]:
+    # Number of laps driven since the start of the session, strictly increasing, and the matching times
+    progress = numpy.unwrap(car_pos_norm.values.astype(float), period=1.0)
+    progress = numpy.maximum.accumulate(progress)
+    times = time_scales[car_pos_norm.sample_rate['current']][car_pos_norm.indices]
+    progress, first_indices = numpy.unique(progress, return_index=True)
+    return progress, times[first_indices]
+
+
+def get_lap_progress(lap_start_times: numpy.ndarray, progress: numpy.ndarray, times: numpy.ndarray) -> numpy.ndarray:
+    # Progress at which each lap starts, an integer even when car_pos_norm lags behind the lap counter
+    return numpy.floor(numpy.interp(lap_start_times, times, progress) + LAP_START_TOLERANCE)
+
+
+def get_best_durations(durations: numpy.ndarray) -> numpy.ndarray:
+    # Best duration of each column of a laps x splits table, NaN for the columns without any time
+    best_durations = numpy.full(durations.shape[1], numpy.nan)
+    timed_splits = ~numpy.isnan(durations).all(axis=0)
+    best_durations[timed_splits] = numpy.nanmin(durations[:, timed_splits], axis=0)
+    return best_durations
+
+
+class SectionTimes:
+    def __init__(self,
+                 data: DataContainer,
+                 time_scales: dict,
+                 sections: list[Section],
+                 speed_channel_name: str = 'ground_speed'):
+        # Table of laps x sections, NaN where the lap does not go through the whole section
+        lap_index = data.get_lap_index(time_scales)
+        self.lap_numbers: numpy.ndarray = lap_index.numbers
+        self.section_titles: list[str] = [section.title for section in sections]
+        self.table: numpy.ndarray = numpy.full((len(lap_index), len(sections)), numpy.nan, dtype=SECTION_TIME_DTYPE)
+        if not len(lap_index) or not sections:
+            return
+
+        progress, times = get_progress(data.car_pos_norm, time_scales)
+        lap_progress = get_lap_progress(lap_index.start_times, progress, times)
+        section_starts = numpy.array([section.start for section in sections])
+        section_stops = numpy.array([section.stop for section in sections])
+        # Sections crossing the start/finish line (stop < start) end on the next lap
+        entry_progress = lap_progress[:, None] + section_starts[None, :]
+        exit_progress = lap_progress[:, None] + section_stops[None, :] + (section_stops < section_starts)[None, :]
+        entry_times = numpy.interp(entry_progress, progress, times, left=numpy.nan, right=numpy.nan)
+        exit_times = numpy.interp(exit_progress, progress, times, left=numpy.nan, right=numpy.nan)
+        self.table['entry_time'] = entry_times
+        self.table['exit_time'] = exit_times
+        self.table['duration'] = exit_times - entry_times
+
+        speed = getattr(data, speed_channel_name)
+        complete = ~numpy.isnan(self.table['duration'])
+        min_speeds, max_speeds = self._get_speed_extrema(speed, time_scales, entry_times[complete], exit_times[complete])
+        self.table['min_speed'][complete] = min_speeds
+        self.table['max_speed'][complete] = max_speeds
+
+    @staticmethod
+    def _get_speed_extrema(speed: DataField,
+                           time_scales: dict,
+                           entry_times: numpy.ndarray,
+                           exit_times: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+        if not len(entry_times):
+            return numpy.array([]), numpy.array([])
+        sample_rate = speed.sample_rate['current']
+        entry_indices = numpy.floor(entry_times * sample_rate).astype(int)
+        exit_indices = numpy.floor(exit_times * sample_rate).astype(int)
+        # Runs of the speed channel overlapping [entry, exit], including the one in progress at the entry
+        first_runs = numpy.maximum(numpy.searchsorted(speed.indices, entry_indices, side='right') - 1, 0)
+        last_runs = numpy.maximum(numpy.searchsorted(speed.indices, exit_indices, side='right'), first_runs + 1)
+        values = numpy.append(speed.values.astype(float), numpy.nan)
+        boundaries = numpy.stack([first_runs, last_runs], axis=1).ravel()
+        min_speeds = numpy.minimum.reduceat(values, boundaries)[::2]
+        max_speeds = numpy.maximum.reduceat(values, boundaries)[::2]
+        return min_speeds, max_speeds
+
+    def get_section_position(self, section_title: str) -> int:
+        if section_title not in self.section_titles:
+            raise ValueError(f'Section {section_title} is not defined')
+        return self.section_titles.index(section_title)
+
+    def get_best_durations(self) -> numpy.ndarray:
+        return get_best_durations(self.table['duration'])
+
+    def __str__(self):
+        output_str = 'SectionTimes:'
+        for lap_number, lap_row in zip(self.lap_numbers, self.table):
+            output_str += f"\n\tLap {lap_number}:"
+            for section_title, section_time in zip(self.section_titles, lap_row):
+                output_str += f" {section_title} {section_time['duration']:.3f}s,"
+        return output_str
+
+
+class SectorTimes:
+    def __init__(self, data: DataContainer, time_scales: dict, channel_name: str = 'last_sector_time'):
+        # Table of laps x sectors built from the changes of channel_name, which holds the duration of the last
+        # sector completed. Each change is given to the lap in which the middle of its sector was driven, and to
+        # the sector ending at the position of the car when it was logged, so that recordings starting mid-lap
+        # and tracks with any number of sectors are handled. A sector as long as the one before it leaves the
+        # channel unchanged, it is recovered from the time between the changes around it. NaN where a sector was not
+        # recorded, such as repeated sectors after the last change.
+        lap_index = data.get_lap_index(time_scales)
+        self.lap_numbers: numpy.ndarray = lap_index.numbers
+        self.table: numpy.ndarray = numpy.full((len(lap_index), 0), numpy.nan, dtype=SECTOR_TIME_DTYPE)
+        self.sector_ends: numpy.ndarray = numpy.zeros(0)  # Fraction of the lap at the end of each sector
+        field = getattr(data, channel_name)
+        # The value held at the start of the recording belongs to a sector driven before it
+        end_times = time_scales[field.sample_rate['current']][field.indices[1:]]
+        durations = field.values[1:].astype(float) * SECTOR_TIME_FACTORS.get(field.unit, 1.)
+        timed = numpy.isfinite(durations) & (durations > 0)
+        end_times, durations = end_times[timed], durations[timed]
+        if not len(lap_index) or not len(durations):
+            return
+        end_times, durations = self._add_repeated_sectors(end_times, durations)
+
+        progress, times = get_progress(data.car_pos_norm, time_scales)
+        lap_progress = get_lap_progress(lap_index.start_times, progress, times)
+        lap_positions = numpy.searchsorted(lap_index.start_times, end_times - durations / 2, side='right') - 1
+        # Sectors started before the recording are left out
+        end_times, durations, lap_positions = (array[lap_positions >= 0] for array in (end_times, durations,
+                                                                                       lap_positions))
+        if not len(durations):
+            return
+        end_fractions = numpy.interp(end_times, times, progress) - lap_progress[lap_positions]
+        # Sector ends are the clusters of the positions at which a change was logged
+        order = numpy.argsort(end_fractions, kind='stable')
+        new_sectors = numpy.diff(end_fractions[order]) > SECTOR_END_TOLERANCE
+        sector_positions = numpy.empty(len(order), dtype=int)
+        sector_positions[order] = numpy.append(0, numpy.cumsum(new_sectors))
+        sector_count = int(sector_positions.max()) + 1
+        self.sector_ends = numpy.bincount(sector_positions, end_fractions) / numpy.bincount(sector_positions)
+        self.table = numpy.full((len(lap_index), sector_count), numpy.nan, dtype=SECTOR_TIME_DTYPE)
+        self.table['end_time'][lap_positions, sector_positions] = end_times
+        self.table['duration'][lap_positions, sector_positions] = durations
+
+    @staticmethod
+    def _add_repeated_sectors(end_times: numpy.ndarray,
+                              durations: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+        # Each change ends a sector started at end_time - duration, the time left since the previous change is taken
+        # by repetitions of the previous duration when it is a whole number of them
+        gaps = numpy.diff(end_times) - durations[1:]
+        repeat_counts = numpy.round(gaps / durations[:-1]).astype(int)
+        repeated = (repeat_counts > 0) & \
+                   (numpy.abs(gaps - repeat_counts * durations[:-1]) <= SECTOR_DURATION_TOLERANCE)
+        counts = numpy.append(numpy.where(repeated, repeat_counts, 0), 0) + 1
+        positions = numpy.repeat(numpy.arange(len(durations)), counts)
+        repeats = numpy.arange(len(positions)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        return end_times[positions] + repeats * durations[positions], durations[positions]
+
+    def get_sector_count(self) -> int:
+        return self.table.shape[1]
+
+    def get_best_durations(self) -> numpy.ndarray:
+        return get_best_durations(self.table['duration'])
+
+    def get_theoretical_best(self) -> float:
+        # Sum of the best sectors, NaN when a sector has never been recorded
+        return float(self.get_best_durations().sum()) if self.get_sector_count() else numpy.nan
+
+    def __str__(self):
+        output_str = 'SectorTimes:'
+        for lap_number, lap_row in zip(self.lap_numbers, self.table):
+            output_str += f"\n\tLap {lap_number}:"
+            for sector_position, sector_time in enumerate(lap_row):
+                output_str += f" S{sector_position + 1} {sector_time['duration']:.3f}s,"
+        return output_str
+
+
+def plot_sector_times(sector_times: SectorTimes, figure: plotly.graph_objects.Figure):
+    for sector_position in range(sector_times.get_sector_count()):
+        column = sector_times.table[:, sector_position]
+        recorded = ~numpy.isnan(column['duration'])
+        figure.add_trace(plotly.graph_objects.Scatter(x=column['end_time'][recorded],
+                                                      y=column['duration'][recorded],
+                                                      name=f'Sector {sector_position + 1} times',
+                                                      showlegend=True,
+                                                      line=dict(shape='hv')
+                                                      ),
+                         )
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import numpy
+import os
+import struct
+import zipfile
+
+from functools import partial
+
+from channel_statistics import ChannelStatistics
+from data_container import DataContainer, DataField, InfoContainer, InfoField, main
+
+
+# Increment when the parsing in data_container or the layout of the cache changes, so that stale cache files are
+# rebuilt
+LOADER_VERSION = 3
+
+# Increment when the computation in channel_statistics or the layout of the statistics files changes, so that stale
+# statistics are computed again
+STATISTICS_VERSION = 2
+
+METADATA_KEY = 'metadata'
+
+# Candidate dtypes of the arrays stored in the cache, narrowest first
+VALUE_INTEGER_DTYPES = (numpy.int8, numpy.int16, numpy.int32, numpy.int64)
+INDEX_DTYPES = (numpy.int32, numpy.int64)
+
+
+def get_cache_file_name(data_file: str) -> str:
+    return os.path.splitext(data_file)[0] + '.session.npz'
+
+
+def get_statistics_directory(data_file: str) -> str:
+    return os.path.splitext(data_file)[0] + '.statistics'
+
+
+def get_statistics_file_name(statistics_directory: str, channel_name: str, sections: list) -> str:
+    # One file per channel and set of sections, so that saving the statistics of a channel never rewrites the others
+    sections_hash = hashlib.sha256(json.dumps(sections).encode()).hexdigest()[:16]
+    return os.path.join(statistics_directory, f'{channel_name}.{sections_hash}.npz')
+
+
+def get_file_hash(file_name: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_source_stat(data_file: str) -> dict:
+    stat = os.stat(data_file)
+    return dict(source_size=stat.st_size, source_mtime=stat.st_mtime_ns)
+
+
+def get_cache_key(data_file: str, sample_rates_file: str, hash_source: bool = True) -> dict:
+    # Without hash_source, the CSV is only identified by its size and modification time, which is enough to
+    # browse sessions quickly but not to detect every change
+    cache_key = dict(loader_version=LOADER_VERSION,
+                     sample_rates_hash=get_file_hash(sample_rates_file))
+    if hash_source:
+        cache_key['source_hash'] = get_file_hash(data_file)
+    else:
+        cache_key.update(get_source_stat(data_file))
+    return cache_key
+
+
+def get_narrowest_array(array: numpy.ndarray, integer_dtypes: tuple = VALUE_INTEGER_DTYPES) -> numpy.ndarray:
+    # The same values in the narrowest dtype that holds them exactly, integers among integer_dtypes, floats as
+    # float32 when none of them loses precision
+    if array.dtype.kind == 'i':
+        low, high = (array.min(), array.max()) if len(array) else (0, 0)
+        for dtype in integer_dtypes:
+            if numpy.iinfo(dtype).min <= low and high <= numpy.iinfo(dtype).max:
+                return array.astype(dtype)
+    elif array.dtype == numpy.float64:
+        with numpy.errstate(over='ignore'):
+            narrow_array = array.astype(numpy.float32)
+        if numpy.array_equal(narrow_array.astype(numpy.float64), array, equal_nan=True):
+            return narrow_array
+    return array
+
+
+def save_session(cache_file: str, cache_key: dict, header: dict, info: InfoContainer, data: DataContainer):
+    # Raises ValueError when a channel holds objects, which cannot be stored without pickling, and OSError when
+    # the file cannot be written
+    arrays = {}
+    channels = []
+    for name, field in data.get_fields().items():
+        if field.values.dtype.hasobject or field.indices.dtype.hasobject:
+            raise ValueError(f'{field.title} cannot be stored in the session cache without pickling')
+        arrays[name + '.values'] = get_narrowest_array(field.values)
+        arrays[name + '.indices'] = get_narrowest_array(field.indices.astype(numpy.int64), INDEX_DTYPES)
+        channels.append([name, field.title, field.unit, field.sample_rate])
+    metadata = dict(cache_key,
+                    header=header,
+                    info=[[name, field.title, field.unit, field.value] for name, field in info.get_fields().items()],
+                    channels=channels)
+    arrays[METADATA_KEY] = numpy.frombuffer(json.dumps(metadata).encode(), dtype=numpy.uint8)
+    temporary_file = cache_file + '.tmp'
+    with open(temporary_file, 'wb') as file:
+        numpy.savez(file, **arrays)
+    os.replace(temporary_file, cache_file)
+
+
+def get_npz_offsets(cache_file: str) -> dict[str, int]:
+    # numpy.savez stores members uncompressed, so each .npy payload can be mapped in place
+    offsets = {}
+    with zipfile.ZipFile(cache_file) as archive, open(cache_file, 'rb') as file:
+        for member in archive.infolist():
+            if member.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{member.filename} is compressed and cannot be memory-mapped')
+            file.seek(member.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', file.read(4))
+            offsets[member.filename.removesuffix('.npy')] = member.header_offset + 30 + name_length + extra_length
+    return offsets
+
+
+def memory_map_npz_member(cache_file: str, mapped_file: numpy.memmap, offset: int) -> numpy.ndarray:
+    with open(cache_file, 'rb') as file:
+        file.seek(offset)
+        version = numpy.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+    size = int(numpy.prod(shape)) * dtype.itemsize
+    return mapped_file[offset:offset + size].view(dtype).reshape(shape, order='F' if fortran_order else 'C')
+
+
+def load_cached_field(field: DataField, cache_file: str, mapped_file: numpy.memmap, values_offset: int, indices_offset: int):
+    field.values = memory_map_npz_member(cache_file, mapped_file, values_offset)
+    field.indices = memory_map_npz_member(cache_file, mapped_file, indices_offset)
+
+
+def load_cached_session(cache_file: str, cache_key: dict) -> tuple[dict, InfoContainer, DataContainer] | None:
+    try:
+        offsets = get_npz_offsets(cache_file)
+        mapped_file = numpy.memmap(cache_file, dtype=numpy.uint8, mode='r')
+        metadata = json.loads(bytes(memory_map_npz_member(cache_file, mapped_file, offsets[METADATA_KEY])).decode())
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+    if any(metadata.get(key) != value for key, value in cache_key.items()):
+        return None
+    info = InfoContainer([], [], [])
+    for name, title, unit, value in metadata['info']:
+        info.add_field(name, InfoField(title, unit, value))
+    data = DataContainer([], [], [])
+    for name, title, unit, sample_rate in metadata['channels']:
+        # Channels are mapped from the cache file the first time they are read
+        field = DataField(title, unit, [], sample_rate)
+        field.set_loader(partial(load_cached_field,
+                                 field,
+                                 cache_file,
+                                 mapped_file,
+                                 offsets[name + '.values'],
+                                 offsets[name + '.indices']))
+        data.add_field(name, field)
+    return metadata['header'], info, data
+
+
+def load_session(data_file: str,
+                 sample_rates_file: str = 'config/sample_rates.txt',
+                 cache_errors: dict[str, Exception] | None = None) -> tuple[dict, InfoContainer, DataContainer]:
+    # A session cache that cannot be written raises, unless cache_errors is given, in which case the error is
+    # recorded there by data file and the parsed session is still returned
+    cache_file = get_cache_file_name(data_file)
+    cache_key = get_cache_key(data_file, sample_rates_file)
+    if os.path.exists(cache_file):
+        session = load_cached_session(cache_file, cache_key)
+        if session is not None:
+            return session
+    header, info, data = main(data_file)
+    data.set_sample_rates(sample_rates_file)
+    try:
+        save_session(cache_file, dict(cache_key, **get_source_stat(data_file)), header, info, data)
+    except (OSError, ValueError) as error:
+        if cache_errors is None:
+            raise
+        cache_errors[data_file] = error
+    else:
+        if cache_errors is not None:
+            cache_errors.pop(data_file, None)
+    return header, info, data
+
+
+def save_statistics(statistics_file: str, cache_key: dict, statistics: ChannelStatistics):
+    # Raises OSError when the file cannot be written
+    arrays = dict(statistics.get_arrays())
+    metadata = dict(cache_key, statistics_version=STATISTICS_VERSION)
+    arrays[METADATA_KEY] = numpy.frombuffer(json.dumps(metadata).encode(), dtype=numpy.uint8)
+    os.makedirs(os.path.dirname(statistics_file), exist_ok=True)
+    temporary_file = statistics_file + '.tmp'
+    with open(temporary_file, 'wb') as file:
+        numpy.savez(file, **arrays)
+    os.replace(temporary_file, statistics_file)
+
+
+def load_statistics(statistics_file: str, cache_key: dict) -> ChannelStatistics | None:
+    # None when the file is missing or stale
+    try:
+        with numpy.load(statistics_file) as archive:
+            metadata = json.loads(archive[METADATA_KEY].tobytes().decode())
+            if metadata.get('statistics_version') != STATISTICS_VERSION or \
+                    any(metadata.get(key) != value for key, value in cache_key.items()):
+                return None
+            return ChannelStatistics.from_arrays({name: archive[name] for name in archive.files if name != METADATA_KEY})
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
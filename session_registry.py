@@ -0,0 +1,270 @@
+import os
+
+from collections import OrderedDict
+from typing import Callable
+
+from channel_statistics import ChannelStatistics
+from coordinates_handler import Section
+from data_container import DataContainer, InfoContainer, LapIndex, read_preamble
+from distance_resampling import DistanceResampler
+from ingest import ingest_files
+from section_timing import SectionTimes, SectorTimes
+from session_cache import (get_cache_file_name, get_cache_key, get_statistics_directory, get_statistics_file_name,
+                           load_cached_session, load_session, load_statistics, save_statistics)
+from session_tail import SessionTail
+from playback import PlaybackFrames
+from spatial_index import LapSpatialIndex
+
+
+DEFAULT_MEMORY_BUDGET = 2 * 2**30
+
+
+class SessionMetadata:
+    def __init__(self, data_file: str, header: dict, info: InfoContainer, lap_index: LapIndex | None = None):
+        self.data_file: str = data_file
+        self.header: dict = header
+        self.info: InfoContainer = info
+        self.lap_index: LapIndex | None = lap_index  # Only known once the session has been parsed
+
+
+class Session:
+    def __init__(self, name: str, header: dict, info: InfoContainer, data: DataContainer):
+        self.name: str = name
+        self.header: dict = header
+        self.info: InfoContainer = info
+        self.data: DataContainer = data
+        self.time_scales: dict = data.get_time_scales()
+        self.lap_index: LapIndex = data.get_lap_index(self.time_scales)
+        self._resampler: DistanceResampler | None = None
+        self._section_times: dict[tuple, SectionTimes] = {}  # By sections, see get_sections_key
+        self._sector_times: SectorTimes | None = None
+        self._spatial_indices: dict[int, LapSpatialIndex] = {}
+        self._playback_frames: dict[int, PlaybackFrames] = {}
+        self._statistics: dict[tuple, dict[str, ChannelStatistics]] = {}  # By sections then channel
+        self.statistics_directory: str | None = None
+        self.statistics_key: dict = {}
+        self.statistics_errors: dict[str, Exception] = {}  # Channels whose statistics could not be saved
+
+    def set_statistics_directory(self, statistics_directory: str, statistics_key: dict):
+        # Statistics computed for this session are kept in statistics_directory, valid as long as statistics_key
+        self.statistics_directory = statistics_directory
+        self.statistics_key = statistics_key
+        self._statistics = {}
+
+    def refresh(self):
+        # Rebuilds what depends on the session length, after new samples have been appended to data
+        self.time_scales = self.data.get_time_scales()
+        self.lap_index = self.data.get_lap_index(self.time_scales)
+        self._resampler = None
+        self._section_times = {}
+        self._sector_times = None
+        self._spatial_indices = {}
+        self._playback_frames = {}
+        self._statistics = {}
+
+    def get_info(self, name: str, default: str) -> str:
+        # Value of a field of the info block such as track or driver, default when the logger did not write it
+        field = self.info.get_fields().get(name)
+        return default if field is None else str(field.value)
+
+    def get_resampler(self) -> DistanceResampler:
+        if self._resampler is None:
+            self._resampler = DistanceResampler(self.data, self.time_scales, 'lap_distance')
+        return self._resampler
+
+    @staticmethod
+    def get_sections_key(sections: list[Section]) -> tuple:
+        return tuple((section.title, section.start, section.stop) for section in sections)
+
+    def get_section_times(self, sections: list[Section]) -> SectionTimes:
+        sections_key = self.get_sections_key(sections)
+        if sections_key not in self._section_times:
+            self._section_times[sections_key] = SectionTimes(self.data, self.time_scales, sections)
+        return self._section_times[sections_key]
+
+    def get_sector_times(self) -> SectorTimes:
+        if self._sector_times is None:
+            self._sector_times = SectorTimes(self.data, self.time_scales)
+        return self._sector_times
+
+    def get_spatial_index(self, lap_number: int) -> LapSpatialIndex:
+        if lap_number not in self._spatial_indices:
+            self._spatial_indices[lap_number] = LapSpatialIndex(self.data, self.time_scales, lap_number)
+        return self._spatial_indices[lap_number]
+
+    def get_playback_frames(self, lap_number: int) -> PlaybackFrames:
+        if lap_number not in self._playback_frames:
+            self._playback_frames[lap_number] = PlaybackFrames(self.data, self.time_scales, lap_number)
+        return self._playback_frames[lap_number]
+
+    def get_channel_statistics(self, channel_name: str, sections: list[Section]) -> ChannelStatistics:
+        # Computed once per channel and sections from the runs of the channel, then read back from its own file in
+        # the statistics directory of the session. A file that cannot be written is recorded in statistics_errors.
+        sections_key = self.get_sections_key(sections)
+        statistics = self._statistics.setdefault(sections_key, {})
+        if channel_name in statistics:
+            return statistics[channel_name]
+        statistics_file = None
+        channel_statistics = None
+        if self.statistics_directory is not None:
+            sections_list = [list(section_key) for section_key in sections_key]
+            statistics_file = get_statistics_file_name(self.statistics_directory, channel_name, sections_list)
+            statistics_key = dict(self.statistics_key, channel=channel_name, sections=sections_list)
+            channel_statistics = load_statistics(statistics_file, statistics_key)
+        if channel_statistics is None:
+            channel_statistics = ChannelStatistics.from_field(getattr(self.data, channel_name),
+                                                              self.time_scales,
+                                                              self.lap_index,
+                                                              self.get_section_times(sections))
+            if statistics_file is not None:
+                try:
+                    save_statistics(statistics_file, statistics_key, channel_statistics)
+                except OSError as error:
+                    self.statistics_errors[channel_name] = error
+                else:
+                    self.statistics_errors.pop(channel_name, None)
+        statistics[channel_name] = channel_statistics
+        return channel_statistics
+
+    def get_memory_size(self) -> int:
+        # Channels mapped from the session cache are counted once read, as their pages are then resident, and so are
+        # the arrays derived from the session
+        size = 0
+        for field in self.data.get_fields().values():
+            if field.is_loaded:
+                size += field.values.nbytes + field.indices.nbytes
+        if self._resampler is not None:
+            size += self._resampler.get_memory_size()
+        size += sum(section_times.table.nbytes for section_times in self._section_times.values())
+        if self._sector_times is not None:
+            size += self._sector_times.table.nbytes
+        size += sum(spatial_index.get_memory_size() for spatial_index in self._spatial_indices.values())
+        size += sum(frames.get_memory_size() for frames in self._playback_frames.values())
+        size += sum(channel_statistics.get_memory_size()
+                    for statistics in self._statistics.values() for channel_statistics in statistics.values())
+        return size
+
+
+class SessionRegistry:
+    def __init__(self,
+                 directory: str = 'data',
+                 memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 sample_rates_file: str = 'config/sample_rates.txt',
+                 on_evict: Callable[[str], None] | None = None):
+        self.directory: str = directory
+        self.memory_budget: int = memory_budget
+        self.sample_rates_file: str = sample_rates_file
+        self.on_evict: Callable[[str], None] | None = on_evict  # Drops what was derived from an unloaded session
+        self.sessions: dict[str, SessionMetadata] = {}
+        self._loaded_sessions: OrderedDict[str, Session] = OrderedDict()
+        self._live_sessions: dict[str, tuple[SessionTail, Session]] = {}  # Followed while their file is written
+        self.errors: dict[str, Exception] = {}  # Files of the directory that could not be indexed
+        self.cache_errors: dict[str, Exception] = {}  # Data files loaded without writing their session cache
+        self.index()
+
+    def index(self):
+        # Only reads the header and info blocks, or the metadata of an up to date session cache
+        file_names = sorted(file_name for file_name in os.listdir(self.directory) if file_name.endswith('.csv'))
+        for name in [name for name in self.sessions if name not in file_names]:
+            del self.sessions[name]
+            if self._loaded_sessions.pop(name, None) is not None and self.on_evict is not None:
+                self.on_evict(name)
+        self.errors = {name: error for name, error in self.errors.items() if name in file_names}
+        for file_name in file_names:
+            if file_name not in self.sessions:
+                # A truncated or malformed file is left out until a later index, e.g. while a logger writes it
+                try:
+                    self.sessions[file_name] = self._get_metadata(os.path.join(self.directory, file_name))
+                except (OSError, ValueError, StopIteration) as error:
+                    self.errors[file_name] = error
+                else:
+                    self.errors.pop(file_name, None)
+
+    def _get_metadata(self, data_file: str) -> SessionMetadata:
+        cache_file = get_cache_file_name(data_file)
+        if os.path.exists(cache_file):
+            cache_key = get_cache_key(data_file, self.sample_rates_file, hash_source=False)
+            cached_session = load_cached_session(cache_file, cache_key)
+            if cached_session is not None:
+                header, info, data = cached_session
+                return SessionMetadata(data_file, header, info, data.get_lap_index())
+        with open(data_file, 'r') as csv_file:
+            header, info, _, _ = read_preamble(csv_file)
+        return SessionMetadata(data_file, header, info)
+
+    def ingest(self, max_workers: int | None = None) -> dict[str, Exception]:
+        # Parses in parallel the sessions without an up to date cache, so that they are indexed with their laps
+        data_files = [metadata.data_file for metadata in self.sessions.values() if metadata.lap_index is None]
+        errors = ingest_files(data_files, self.sample_rates_file, max_workers)
+        for name, metadata in self.sessions.items():
+            if metadata.data_file in data_files and metadata.data_file not in errors:
+                self.sessions[name] = self._get_metadata(metadata.data_file)
+        return errors
+
+    def get_options(self) -> list[dict]:
+        return [dict(label=name, value=name) for name in self.sessions]
+
+    def get(self, name: str) -> Session:
+        if name in self._live_sessions:
+            return self._live_sessions[name][1]
+        if name in self._loaded_sessions:
+            self._loaded_sessions.move_to_end(name)
+            self.evict()
+            return self._loaded_sessions[name]
+        if name not in self.sessions:
+            raise ValueError(f'Session {name} is not in {self.directory}')
+        metadata = self.sessions[name]
+        header, info, data = load_session(metadata.data_file, self.sample_rates_file, self.cache_errors)
+        session = Session(name, header, info, data)
+        session.set_statistics_directory(get_statistics_directory(metadata.data_file),
+                                         get_cache_key(metadata.data_file, self.sample_rates_file, hash_source=False))
+        metadata.lap_index = session.lap_index
+        self._loaded_sessions[name] = session
+        self.evict()
+        return session
+
+    def follow(self, name: str) -> Session:
+        # Tails the file of the session instead of loading it once, see poll
+        if name in self._live_sessions:
+            return self._live_sessions[name][1]
+        if name not in self.sessions:
+            raise ValueError(f'Session {name} is not in {self.directory}')
+        tail = SessionTail(self.sessions[name].data_file, self.sample_rates_file)
+        tail.poll()
+        if tail.data is None:
+            raise ValueError(f'Session {name} has no complete preamble yet')
+        session = Session(name, tail.header, tail.info, tail.data)
+        self._live_sessions[name] = (tail, session)
+        self._loaded_sessions.pop(name, None)
+        return session
+
+    def unfollow(self, name: str):
+        self._live_sessions.pop(name, None)
+
+    def poll(self, name: str) -> dict[str, int]:
+        # Appends the rows written since the last poll, see SessionTail.poll for the returned run counts
+        tail, session = self._live_sessions[name]
+        new_runs = tail.poll()
+        if new_runs:
+            session.refresh()
+            self.sessions[name].lap_index = session.lap_index
+        return new_runs
+
+    def is_followed(self, name: str) -> bool:
+        return name in self._live_sessions
+
+    def evict(self):
+        # Unloads the least recently used sessions until the loaded ones fit in the memory budget
+        sizes = {name: session.get_memory_size() for name, session in self._loaded_sessions.items()}
+        total_size = sum(sizes.values())
+        while total_size > self.memory_budget and len(self._loaded_sessions) > 1:
+            name, _ = self._loaded_sessions.popitem(last=False)
+            total_size -= sizes[name]
+            if self.on_evict is not None:
+                self.on_evict(name)
+
+    def get_loaded_session_names(self) -> list[str]:
+        return list(self._loaded_sessions)
+
+    def get_loaded_sessions(self) -> list[Session]:
+        return list(self._loaded_sessions.values()) + [session for _, session in self._live_sessions.values()]
@@ -0,0 +1,134 @@
+import io
+import numpy
+import os
+import sys
+import time
+
+from data_container import DEFAULT_SAMPLE_RATE, DataContainer, DataField, read_columns, read_preamble
+
+
+# Channels inverted by data_container.main so that x+ points towards east and y+ points towards north
+INVERTED_CHANNELS = ('car_coord_x', 'car_coord_y')
+
+
+class SessionTail:
+    def __init__(self, data_file: str, sample_rates_file: str = 'config/sample_rates.txt'):
+        # Follows a CSV file while the logger appends rows to it, only the rows written since the last poll are decoded
+        self.data_file: str = data_file
+        self.sample_rates_file: str = sample_rates_file
+        self.header: dict | None = None
+        self.info = None
+        self.data: DataContainer | None = None
+        self.sample_counts: dict[str, int] = {}
+        self.row_count: int = 0
+        self._column_names: list[str | None] = []
+        self._position: int = 0
+
+    def _read_preamble(self) -> bool:
+        # The preamble is only read once it is complete, up to the units line of the data block
+        with open(self.data_file, 'r', newline='') as csv_file:
+            lines = csv_file.read().split('\n')
+        lines_iterator = iter(lines[:-1])
+        try:
+            header, info, titles, units = read_preamble(lines_iterator)
+        except StopIteration:
+            return False
+        preamble_line_count = len(lines) - 1 - len(list(lines_iterator))
+        self._position = sum(len(line.encode()) + 1 for line in lines[:preamble_line_count])
+        attributes_names, indices_to_delete = DataContainer._get_attributes_names(list(titles))
+        self._column_names = self._get_column_names(titles, attributes_names, indices_to_delete)
+        self.header, self.info = header, info
+        self.data = DataContainer(titles, units, [[] for _ in titles])
+        self.data.set_sample_rates(self.sample_rates_file)
+        return True
+
+    @staticmethod
+    def _get_column_names(titles: list[str], attributes_names: list[str], indices_to_delete: list[int]) -> list[str | None]:
+        # Attribute name of each CSV column, None for the columns DataContainer drops
+        names = iter(attributes_names)
+        return [None if i in indices_to_delete else next(names) for i in range(len(titles))]
+
+    def poll(self) -> dict[str, int]:
+        # Decodes the complete rows appended since the last poll. Returns, for each channel that received samples,
+        # the number of runs it had before, so that only the runs from there on have to be sent to a plot.
+        if self.data is None and not self._read_preamble():
+            return {}
+        with open(self.data_file, 'rb') as binary_file:
+            binary_file.seek(self._position)
+            chunk = binary_file.read()
+        # A partially written last row is left for the next poll
+        chunk = chunk[:chunk.rfind(b'\n') + 1]
+        if not chunk:
+            return {}
+        self._position += len(chunk)
+        text = chunk.decode()
+        columns = read_columns(io.StringIO(text))
+        self.row_count += len([row for row in text.splitlines() if row])
+        named_columns = {name: column for name, column in zip(self._column_names, columns) if name is not None}
+        run_counts = {name: len(getattr(self.data, name).values) for name in named_columns}
+        self.sample_counts = self.data.extend(named_columns,
+                                              self.sample_counts,
+                                              {name: numpy.negative for name in INVERTED_CHANNELS})
+        return {name: run_count for name, run_count in run_counts.items()
+                if self.sample_counts[name] > 0 and len(getattr(self.data, name).values) > run_count}
+
+
+def get_time_delta(data: DataContainer,
+                   time_scales: dict,
+                   channel_name: str,
+                   first_run: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+    # Times and values of the runs appended from first_run on, to extend a time trace in place
+    field = getattr(data, channel_name)
+    indices = field.indices[first_run:]
+    return time_scales[field.sample_rate['current']][indices], field.values[first_run:]
+
+
+def get_logged_rows(source_file: str, sample_rates_file: str = 'config/sample_rates.txt') -> tuple[list[str], list[str]]:
+    # Preamble lines and data rows of source_file, rearranged as a logger writes them: an exported file stacks the
+    # samples of each channel at the top of its column, whereas row i of a live file holds the samples taken at
+    # i / DEFAULT_SAMPLE_RATE seconds
+    with open(source_file, 'r', newline='') as csv_file:
+        lines = csv_file.read().split('\n')
+    lines_iterator = iter(lines)
+    _, _, titles, units = read_preamble(lines_iterator)
+    preamble_lines = lines[:len(lines) - len(list(lines_iterator))]
+    with open(source_file, 'r') as csv_file:
+        read_preamble(csv_file)
+        columns = read_columns(csv_file)
+    sample_rates = DataContainer(list(titles), list(units), [[] for _ in titles])
+    sample_rates.set_sample_rates(sample_rates_file)
+    attributes_names, indices_to_delete = DataContainer._get_attributes_names(list(titles))
+    column_names = SessionTail._get_column_names(titles, attributes_names, indices_to_delete)
+    row_count = max((numpy.count_nonzero(column != '') for column in columns), default=0)
+    cells = numpy.full((row_count, len(titles)), '', dtype=object)
+    for j, (name, column) in enumerate(zip(column_names, columns)):
+        column = column[column != '']
+        sample_rate = DEFAULT_SAMPLE_RATE if name is None else getattr(sample_rates, name).sample_rate['current']
+        row_indices = DataField.convert_indices(numpy.arange(len(column)), sample_rate, DEFAULT_SAMPLE_RATE)
+        column = column[row_indices < row_count]
+        cells[row_indices[row_indices < row_count], j] = column
+    return preamble_lines, [','.join(row) for row in cells]
+
+
+def simulate_logger(source_file: str,
+                    target_file: str,
+                    speed: float = 1.,
+                    write_period: float = 0.5,
+                    sample_rates_file: str = 'config/sample_rates.txt'):
+    # Stands in for the logger: writes the preamble of source_file to target_file, then appends its data rows at
+    # the default sample rate (times speed) in one write every write_period seconds
+    preamble_lines, rows = get_logged_rows(source_file, sample_rates_file)
+    rows_per_write = max(int(DEFAULT_SAMPLE_RATE * speed * write_period), 1)
+    with open(target_file, 'w', newline='') as target:
+        target.write('\n'.join(preamble_lines) + '\n')
+        target.flush()
+        for start in range(0, len(rows), rows_per_write):
+            time.sleep(write_period)
+            target.write('\n'.join(rows[start:start + rows_per_write]) + '\n')
+            target.flush()
+
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else 'data/corvette_c7_laguna_seca_example.csv'
+    target = sys.argv[2] if len(sys.argv) > 2 else os.path.join('data', 'live_session.csv')
+    simulate_logger(source, target)
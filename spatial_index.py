@@ -0,0 +1,118 @@
+import numpy
+
+from data_container import DataContainer
+
+
+# Side of the grid cells in metres, of the order of the track width so that a query only looks at a few cells
+DEFAULT_CELL_SIZE = 10.
+
+# Number of points per ring cell above which scanning every point at once is cheaper than walking the rings one by
+# one, for queries far from the trajectory
+BRUTE_FORCE_POINTS_PER_CELL = 100
+
+
+class TrajectoryIndex:
+    def __init__(self, x: numpy.ndarray, y: numpy.ndarray, cell_size: float = DEFAULT_CELL_SIZE):
+        # Uniform grid over the points of a trajectory: the points are sorted by cell, and cell_starts gives the
+        # range of each cell in that order, cells being numbered row by row
+        self.x: numpy.ndarray = numpy.asarray(x, dtype=float)
+        self.y: numpy.ndarray = numpy.asarray(y, dtype=float)
+        self.cell_size: float = cell_size
+        valid = numpy.isfinite(self.x) & numpy.isfinite(self.y)
+        positions = numpy.flatnonzero(valid)
+        if len(positions):
+            self.x_min, self.y_min = self.x[valid].min(), self.y[valid].min()
+            self.column_count = int((self.x[valid].max() - self.x_min) // cell_size) + 1
+            self.row_count = int((self.y[valid].max() - self.y_min) // cell_size) + 1
+        else:
+            self.x_min, self.y_min, self.column_count, self.row_count = 0., 0., 0, 0
+        columns, rows = self._get_cells(self.x[positions], self.y[positions])
+        cells = rows * self.column_count + columns
+        order = numpy.argsort(cells, kind='stable')
+        self.positions: numpy.ndarray = positions[order]
+        self.cell_starts: numpy.ndarray = numpy.zeros(self.column_count * self.row_count + 1, dtype=int)
+        numpy.cumsum(numpy.bincount(cells, minlength=self.column_count * self.row_count), out=self.cell_starts[1:])
+
+    def _get_cells(self, x: float | numpy.ndarray, y: float | numpy.ndarray):
+        columns = numpy.floor((x - self.x_min) / self.cell_size).astype(int)
+        rows = numpy.floor((y - self.y_min) / self.cell_size).astype(int)
+        return columns, rows
+
+    def _get_ring_positions(self, column: int, row: int, radius: int) -> numpy.ndarray:
+        # Points of the cells at Chebyshev distance radius from (column, row), clipped to the grid
+        ranges = []
+        for ring_row in range(max(row - radius, 0), min(row + radius, self.row_count - 1) + 1):
+            if abs(ring_row - row) == radius:
+                ring_columns = range(max(column - radius, 0), min(column + radius, self.column_count - 1) + 1)
+            else:
+                ring_columns = [c for c in (column - radius, column + radius) if 0 <= c < self.column_count]
+            for ring_column in ring_columns:
+                cell = ring_row * self.column_count + ring_column
+                ranges.append(self.positions[self.cell_starts[cell]:self.cell_starts[cell + 1]])
+        return numpy.concatenate(ranges) if ranges else numpy.zeros(0, dtype=int)
+
+    def query(self, x: float, y: float) -> tuple[int, float]:
+        # Position of the nearest point of the trajectory and its distance, -1 and inf for an empty trajectory.
+        # Rings of cells are searched outwards until no unvisited cell can hold a nearer point.
+        if not len(self.positions):
+            return -1, numpy.inf
+        column, row = self._get_cells(x, y)
+        # Start from the nearest cell of the grid when the query point lies outside of it
+        column = int(min(max(column, 0), self.column_count - 1))
+        row = int(min(max(row, 0), self.row_count - 1))
+        cell_x = self.x_min + column * self.cell_size
+        cell_y = self.y_min + row * self.cell_size
+        # Distance from the query point to the start cell, 0 when the point is inside it
+        outside_distance = max(cell_x - x, x - cell_x - self.cell_size, cell_y - y, y - cell_y - self.cell_size, 0.)
+        best_position, best_distance = -1, numpy.inf
+        max_radius = max(self.column_count, self.row_count)
+        for radius in range(max_radius + 1):
+            # Points in this ring and beyond are at least this far from the query point
+            if best_distance <= max(outside_distance, (radius - 1) * self.cell_size):
+                break
+            if 8 * radius * BRUTE_FORCE_POINTS_PER_CELL > len(self.positions):
+                distances = numpy.hypot(self.x[self.positions] - x, self.y[self.positions] - y)
+                nearest = numpy.argmin(distances)
+                return int(self.positions[nearest]), float(distances[nearest])
+            candidates = self._get_ring_positions(column, row, radius)
+            if not len(candidates):
+                continue
+            distances = numpy.hypot(self.x[candidates] - x, self.y[candidates] - y)
+            nearest = numpy.argmin(distances)
+            if distances[nearest] < best_distance:
+                best_position, best_distance = int(candidates[nearest]), float(distances[nearest])
+        return best_position, best_distance
+
+
+class LapSpatialIndex:
+    def __init__(self, data: DataContainer, time_scales: dict, lap_number: int, cell_size: float = DEFAULT_CELL_SIZE):
+        # Nearest-sample lookups over the trajectory of one lap, in the cartesian frame of coordinates_handler.Origin
+        self.lap_number: int = lap_number
+        lap_data = data.lap(lap_number)
+        samples = lap_data.sample(['car_coord_x', 'car_coord_y'])
+        self.sample_rate: int = data.car_coord_x.sample_rate['default']
+        self.indices: numpy.ndarray = samples['index']
+        self.times: numpy.ndarray = time_scales[self.sample_rate][self.indices]
+        self.index: TrajectoryIndex = TrajectoryIndex(samples['car_coord_x'], samples['car_coord_y'], cell_size)
+
+    def query(self, x: float, y: float) -> tuple[int, float, float]:
+        # Time index (at sample_rate) and time of the sample nearest to (x, y), and its distance to it
+        position, distance = self.index.query(x, y)
+        if position < 0:
+            raise ValueError(f'Lap {self.lap_number} has no trajectory')
+        return int(self.indices[position]), float(self.times[position]), distance
+
+    def get_memory_size(self) -> int:
+        return sum(array.nbytes for array in (self.indices, self.times, self.index.x, self.index.y,
+                                              self.index.positions, self.index.cell_starts))
+
+
+def query_laps(lap_indices: list[LapSpatialIndex], x: float, y: float) -> numpy.ndarray:
+    # Nearest sample of each lap, as a structured array with one row per lap
+    results = numpy.empty(len(lap_indices), dtype=[('lap_number', int),
+                                                   ('index', int),
+                                                   ('time', float),
+                                                   ('distance', float)])
+    for row, lap_index in enumerate(lap_indices):
+        results[row] = (lap_index.lap_number,) + lap_index.query(x, y)
+    return results
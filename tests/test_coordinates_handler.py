@@ -0,0 +1,102 @@
+import json
+import numpy
+import os
+import pytest
+import xml.etree.ElementTree
+
+import coordinates_handler
+from coordinates_handler import Origin, prepare_track_images, xy_from_lat_lon
+from data_container import DataContainer, export_trajectory, get_gps_trajectory
+
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 10
+GPX_NAMESPACE = {'gpx': 'http://www.topografix.com/GPX/1/1'}
+
+
+@pytest.fixture
+def origin(monkeypatch):
+    monkeypatch.setattr(Origin, 'latitude', 36.584)
+    monkeypatch.setattr(Origin, 'longitude', -121.753)
+
+
+def get_session(tmp_path) -> DataContainer:
+    # A circle of 100 m radius driven in 60 s
+    times = numpy.arange(60 * SAMPLE_RATE) / SAMPLE_RATE
+    angles = 2 * numpy.pi * times / 60
+    columns = [numpy.char.mod('%.2f', times),
+               numpy.char.mod('%.3f', 100 * numpy.cos(angles)),
+               numpy.char.mod('%.3f', 100 * numpy.sin(angles))]
+    data = DataContainer(['time', 'Car Coord X', 'Car Coord Y'], ['s', 'm', 'm'], columns)
+    sample_rates_file = tmp_path / 'sample_rates.txt'
+    sample_rates_file.write_text(f'Channel |   Sample rate (Hz), Default: {SAMPLE_RATE}\n'
+                                 f'time | {SAMPLE_RATE}\nCar Coord X | {SAMPLE_RATE}\nCar Coord Y | {SAMPLE_RATE}\n')
+    data.set_sample_rates(str(sample_rates_file))
+    return data
+
+
+def assert_same_ends(latitudes, longitudes, trajectory):
+    assert len(latitudes) == len(trajectory)
+    for position in (0, -1):
+        assert latitudes[position] == pytest.approx(trajectory['latitude'][position], abs=1e-7)
+        assert longitudes[position] == pytest.approx(trajectory['longitude'][position], abs=1e-7)
+
+
+def test_trajectory_is_converted_back_to_its_coordinates(tmp_path, origin):
+    data = get_session(tmp_path)
+    trajectory = get_gps_trajectory(data, data.get_time_scales())
+    x, y = xy_from_lat_lon(trajectory['latitude'], trajectory['longitude'])
+    numpy.testing.assert_allclose(x, data.car_coord_x.values[:len(x)], atol=1e-6)
+    numpy.testing.assert_allclose(y, data.car_coord_y.values[:len(y)], atol=1e-6)
+    # Length of the open polygon inscribed in the circle, the last sample being one step before the first one
+    assert trajectory['distance'][-1] == pytest.approx(2 * numpy.pi * 100 * (len(x) - 1) / len(x), rel=1e-4)
+
+
+def test_gpx_export_round_trip(tmp_path, origin):
+    data = get_session(tmp_path)
+    trajectory = get_gps_trajectory(data, data.get_time_scales())
+    file_name = str(tmp_path / 'trajectory.gpx')
+    export_trajectory(data, data.get_time_scales(), file_name, name='circle')
+    root = xml.etree.ElementTree.parse(file_name).getroot()
+    assert root.find('gpx:trk/gpx:name', GPX_NAMESPACE).text == 'circle'
+    points = root.findall('gpx:trk/gpx:trkseg/gpx:trkpt', GPX_NAMESPACE)
+    assert_same_ends([float(point.get('lat')) for point in points],
+                     [float(point.get('lon')) for point in points],
+                     trajectory)
+
+
+def test_geojson_export_round_trip(tmp_path, origin):
+    data = get_session(tmp_path)
+    trajectory = get_gps_trajectory(data, data.get_time_scales())
+    file_name = str(tmp_path / 'trajectory.geojson')
+    export_trajectory(data, data.get_time_scales(), file_name, name='circle')
+    with open(file_name, 'r') as file:
+        feature = json.load(file)['features'][0]
+    assert feature['properties']['name'] == 'circle'
+    assert feature['properties']['length'] == pytest.approx(trajectory['distance'][-1])
+    longitudes, latitudes = numpy.array(feature['geometry']['coordinates']).T
+    assert_same_ends(latitudes, longitudes, trajectory)
+
+
+def test_unknown_trajectory_format_is_rejected(tmp_path, origin):
+    data = get_session(tmp_path)
+    with pytest.raises(ValueError):
+        export_trajectory(data, data.get_time_scales(), str(tmp_path / 'trajectory.kml'))
+
+
+def test_track_images_are_reused_from_the_manifest(tmp_path, origin, monkeypatch):
+    index_file_name = os.path.join(ROOT_DIRECTORY, 'config', 'sections', 'index.txt')
+    source_directory = os.path.join(ROOT_DIRECTORY, 'config', 'sections')
+    track_images = prepare_track_images(index_file_name, source_directory, str(tmp_path))
+    modification_times = {name: os.stat(tmp_path / name).st_mtime_ns for name in os.listdir(tmp_path)}
+
+    def get_image_extent(*position):
+        raise AssertionError('extents computed again')
+
+    monkeypatch.setattr(coordinates_handler, 'get_image_extent', get_image_extent)
+    reused_track_images = prepare_track_images(index_file_name, source_directory, str(tmp_path))
+    assert {name: os.stat(tmp_path / name).st_mtime_ns for name in os.listdir(tmp_path)} == modification_times
+    for title, track_image in track_images.items():
+        assert reused_track_images[title].url == track_image.url
+        assert reused_track_images[title].top_left.x == track_image.top_left.x
+        assert reused_track_images[title].bottom_right.y == track_image.bottom_right.y
@@ -0,0 +1,135 @@
+import numpy
+import os
+import pytest
+import tracemalloc
+
+from benchmark import REQUIRED_CHANNELS, generate_session, get_channels, get_groupby_indices
+from data_container import DataField, main, read_columns, read_preamble
+
+
+EXAMPLE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'data', 'corvette_c7_laguna_seca_example.csv')
+
+
+def assert_same_encoding(column):
+    expected_values, expected_indices = get_groupby_indices(column)
+    field = DataField('', '', column)
+    assert field.values.dtype.kind == expected_values.dtype.kind
+    numpy.testing.assert_array_equal(field.values, expected_values)
+    numpy.testing.assert_array_equal(field.indices, expected_indices)
+
+
+@pytest.mark.parametrize('column', [
+    ['', '', ''],
+    [],
+    ['1', '1', '2', '', '2', '3'],
+    ['1', '1.5', '1.5', '2'],
+    ['NaN', 'NaN', '1.0', 'nan', 'inf', 'Infinity', 'Infinity', '-Infinity'],
+    ['"pit"', '"pit"', '"track"', '', '"pit"'],
+    ['Bob', 'Bob', 'Alice'],
+    ['true', 'true', 'false'],
+    ['1', '+1', '2', '.5', '007', '1_000', '-0', '3'],
+    ['1', '1.', '2', '1_000.5', '+2.5', '2', '1e3', '1E+3', '.5e1'],
+    ['1', '1.0', '1.0', '2', '2'],
+    [' 1', '2 ', '2'],
+], ids=['empty', 'no cells', 'integers', 'mixed', 'non-finite', 'strings', 'not json', 'booleans',
+        'numpy only integers', 'numpy only floats', 'integer runs', 'whitespace'])
+def test_run_length_encoding_matches_json_groupby(column):
+    assert_same_encoding(numpy.array(column, dtype=str))
+
+
+@pytest.mark.skipif(not os.path.exists(EXAMPLE_FILE), reason='example session not available')
+def test_run_length_encoding_matches_json_groupby_on_example_session():
+    with open(EXAMPLE_FILE, 'r') as csv_file:
+        read_preamble(csv_file)
+        columns = read_columns(csv_file)
+    for column in columns:
+        assert_same_encoding(column)
+
+
+def get_retained_memory(data_file: str, lazy: bool) -> tuple[int, object]:
+    tracemalloc.start()
+    try:
+        _, _, data = main(data_file, lazy=lazy)
+        return tracemalloc.get_traced_memory()[0], data
+    finally:
+        tracemalloc.stop()
+
+
+def test_lazy_session_keeps_packed_cells_until_channels_are_read(tmp_path):
+    data_file = str(tmp_path / 'session.csv')
+    generate_session(data_file, str(tmp_path / 'sample_rates.txt'), get_channels(len(REQUIRED_CHANNELS) + 40),
+                     duration=600.)
+    eager_size, eager_data = get_retained_memory(data_file, lazy=False)
+    lazy_size, lazy_data = get_retained_memory(data_file, lazy=True)
+    # Packed cells take about the size of the file, less than the decoded runs of random channels
+    assert lazy_size < 1.2 * os.path.getsize(data_file)
+    assert lazy_size < eager_size
+    # Only the coordinates are decoded on loading, to be mirrored, then the channels that are read
+    loaded_names = {name for name, field in lazy_data.get_fields().items() if field.is_loaded}
+    assert loaded_names == {'car_coord_x', 'car_coord_y'}
+    for name, lazy_field in lazy_data.get_fields().items():
+        eager_field = getattr(eager_data, name)
+        numpy.testing.assert_array_equal(lazy_field.values, eager_field.values)
+        numpy.testing.assert_array_equal(lazy_field.indices, eager_field.indices)
+
+
+DURATION = 10.
+
+
+def get_field(title: str, values: numpy.ndarray, sample_rate: int) -> DataField:
+    return DataField(title, 'u', numpy.char.mod('%g', values), dict(default=sample_rate, current=sample_rate))
+
+
+def get_time_scales(*sample_rates: int) -> dict:
+    return {sample_rate: numpy.arange(int(DURATION * sample_rate)) / sample_rate for sample_rate in sample_rates}
+
+
+def get_samples(field: DataField, sample_rate: int) -> numpy.ndarray:
+    # Value held at every time index at sample_rate
+    return field[(numpy.arange(int(DURATION * sample_rate)), sample_rate)].astype(float)
+
+
+@pytest.fixture
+def fields() -> tuple[DataField, DataField]:
+    # Runs of random lengths, the last one lasting until the end of the session, at two sample rates
+    rng = numpy.random.default_rng(0)
+    slow = get_field('Slow', numpy.repeat(rng.integers(0, 10, 8), rng.integers(1, 12, 8))[:40], 4)
+    fast = get_field('Fast', numpy.repeat(rng.normal(size=30).round(2), rng.integers(1, 30, 30))[:200], 20)
+    return slow, fast
+
+
+def test_run_statistics_match_the_samples(fields):
+    start_times, end_times = numpy.array([0., 1.3, 4.05, 9.]), numpy.array([10., 4.05, 9.9, 9.])
+    for field in fields:
+        sample_rate = field.sample_rate['current']
+        time_scales = get_time_scales(sample_rate)
+        samples = get_samples(field, sample_rate)
+        starts = numpy.searchsorted(time_scales[sample_rate], start_times)
+        ends = numpy.searchsorted(time_scales[sample_rate], end_times)
+        integrals = [samples[start:end].sum() / sample_rate for start, end in zip(starts, ends)]
+        means = [samples[start:end].mean() if end > start else numpy.nan for start, end in zip(starts, ends)]
+        times_above = [(samples[start:end] >= 5).sum() / sample_rate for start, end in zip(starts, ends)]
+        numpy.testing.assert_allclose(field.integrate(time_scales, start_times, end_times), integrals)
+        numpy.testing.assert_allclose(field.get_mean(time_scales, start_times, end_times), means)
+        numpy.testing.assert_allclose(field.get_time_above(5, time_scales, start_times, end_times), times_above)
+        assert field.integrate(time_scales) == pytest.approx(samples.sum() / sample_rate)
+        assert field.get_time_above(5, time_scales, inclusive=False) == pytest.approx((samples > 5).sum() / sample_rate)
+
+
+def test_combined_fields_match_the_samples(fields):
+    slow, fast = fields
+    # Samples of the slower field are held over the samples of the faster one
+    slow_samples, fast_samples = get_samples(slow, 20), get_samples(fast, 20)
+    for combined, expected_samples in [(slow + fast, slow_samples + fast_samples),
+                                       (fast - slow, fast_samples - slow_samples),
+                                       (slow * fast, slow_samples * fast_samples),
+                                       (fast / (slow + 1), fast_samples / (slow_samples + 1)),
+                                       (fast * 2.5, fast_samples * 2.5)]:
+        assert combined.sample_rate['current'] == 20
+        numpy.testing.assert_allclose(get_samples(combined, 20), expected_samples)
+        # Runs are encoded again, without two consecutive equal values
+        assert (combined.values[1:] != combined.values[:-1]).all()
+    assert (slow + slow).unit == 'u'
+    assert (slow * fast).unit == ''
+    assert (fast * 2.5).unit == 'u'
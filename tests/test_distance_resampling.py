@@ -0,0 +1,72 @@
+import numpy
+
+from data_container import DataContainer
+from distance_resampling import DistanceResampler
+
+
+SAMPLE_RATE = 30
+LAP_DURATION = 60.
+SPEED = 50.
+
+
+def get_session(tmp_path, lap_count: int = 3, distance_lead: int = 1) -> DataContainer:
+    # Laps driven at constant speed, lap_distance resetting distance_lead samples before lap_number, so that the
+    # first distance logged in each lap is above 0
+    sample_count = int(lap_count * LAP_DURATION * SAMPLE_RATE)
+    times = numpy.arange(sample_count) / SAMPLE_RATE
+    lap_numbers = (times // LAP_DURATION).astype(int)
+    distances = ((times + distance_lead / SAMPLE_RATE) % LAP_DURATION) * SPEED
+    columns = [numpy.char.mod('%.4f', times), numpy.char.mod('%d', lap_numbers), numpy.char.mod('%.3f', distances)]
+    data = DataContainer(['time', 'Lap Number', 'Lap Distance'], ['s', '', 'm'], columns)
+    sample_rates_file = tmp_path / 'sample_rates.txt'
+    sample_rates_file.write_text(f'Channel |   Sample rate (Hz), Default: {SAMPLE_RATE}\n'
+                                 f'time | {SAMPLE_RATE}\nLap Number | {SAMPLE_RATE}\nLap Distance | {SAMPLE_RATE}\n')
+    data.set_sample_rates(str(sample_rates_file))
+    return data
+
+
+def test_lap_start_is_covered_when_first_distance_is_above_zero(tmp_path):
+    data = get_session(tmp_path)
+    resampler = DistanceResampler(data, data.get_time_scales(), 'lap_distance')
+    distances, _ = resampler.get_mapping(1)
+    assert distances[0] == 0.
+    times = resampler.get_times(1, 100)
+    assert not numpy.isnan(times[0])
+    assert times[0] == resampler.lap_index.start_times[1]
+
+
+def test_delta_time_between_identical_laps_is_zero(tmp_path):
+    data = get_session(tmp_path)
+    resampler = DistanceResampler(data, data.get_time_scales(), 'lap_distance')
+    delta_time = resampler.delta_time(1, 0, resolution=100)
+    assert not numpy.isnan(delta_time).any()
+    numpy.testing.assert_allclose(delta_time, 0., atol=1 / SAMPLE_RATE)
+
+
+def test_elapsed_times_start_from_the_lap_start(tmp_path):
+    data = get_session(tmp_path)
+    resampler = DistanceResampler(data, data.get_time_scales(), 'lap_distance')
+    elapsed_times = resampler.get_elapsed_times(1, 100)
+    assert elapsed_times[0] == 0.
+    # Each grid point is reached one sample earlier than the distance alone tells, as it resets ahead of the lap
+    expected_times = resampler.get_grid(100) / SPEED - 1 / SAMPLE_RATE
+    numpy.testing.assert_allclose(elapsed_times[1:], expected_times[1:], atol=1e-6)
+
+
+def test_delta_times_match_the_laps_taken_one_by_one(tmp_path):
+    data = get_session(tmp_path, lap_count=4)
+    resampler = DistanceResampler(data, data.get_time_scales(), 'lap_distance')
+    lap_numbers = [int(lap_number) for lap_number in resampler.lap_index.numbers]
+    delta_times = resampler.delta_times(1, resolution=100)
+    expected_delta_times = [resampler.get_elapsed_times(lap_number, 100) - resampler.get_elapsed_times(1, 100)
+                            for lap_number in lap_numbers]
+    assert delta_times.shape == (len(lap_numbers), 100)
+    numpy.testing.assert_allclose(delta_times, expected_delta_times, atol=1e-9)
+
+
+def test_float_channels_are_interpolated_along_the_distance(tmp_path):
+    data = get_session(tmp_path)
+    resampler = DistanceResampler(data, data.get_time_scales(), 'lap_distance')
+    # The distance logged at the time each grid distance is reached is that distance, between two samples
+    distances = resampler.resample(1, 'lap_distance', 100)
+    numpy.testing.assert_allclose(distances[1:], resampler.get_grid(100)[1:], atol=1e-2)
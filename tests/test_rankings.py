@@ -0,0 +1,47 @@
+import numpy
+
+from data_container import DataContainer, InfoContainer
+from rankings import Rankings
+from session_registry import Session
+
+
+SAMPLE_RATE = 10
+LAP_DURATION = 60.
+SECTOR_COUNT = 3
+
+
+def get_session(tmp_path, name: str, driver: str, start_time: float, end_time: float) -> Session:
+    # Laps of equal sectors driven at constant speed, recorded between start_time and end_time
+    times = numpy.arange(start_time * SAMPLE_RATE, end_time * SAMPLE_RATE) / SAMPLE_RATE
+    lap_numbers = (times // LAP_DURATION).astype(int)
+    car_pos_norm = (times % LAP_DURATION) / LAP_DURATION
+    # Duration of the last sector completed, held from the end of each sector
+    sector_duration = LAP_DURATION / SECTOR_COUNT
+    sector_numbers = times // sector_duration
+    last_sector_times = sector_duration + (sector_numbers - 1) % SECTOR_COUNT
+    columns = [numpy.char.mod('%.2f', times), numpy.char.mod('%d', lap_numbers),
+               numpy.char.mod('%.5f', car_pos_norm), numpy.char.mod('%.1f', last_sector_times)]
+    data = DataContainer(['time', 'Lap Number', 'Car Pos Norm', 'Last Sector Time'], ['s', '', '', 's'], columns)
+    sample_rates_file = tmp_path / 'sample_rates.txt'
+    sample_rates_file.write_text(f'Channel |   Sample rate (Hz), Default: {SAMPLE_RATE}\n'
+                                 f'time | {SAMPLE_RATE}\nLap Number | {SAMPLE_RATE}\nCar Pos Norm | {SAMPLE_RATE}\n'
+                                 f'Last Sector Time | {SAMPLE_RATE}\n')
+    data.set_sample_rates(str(sample_rates_file))
+    info = InfoContainer(['Track', 'Driver'], ['', ''], ['track', driver])
+    return Session(name, {}, info, data)
+
+
+def test_sectors_are_matched_across_sessions_by_their_end(tmp_path):
+    rankings = Rankings([])
+    rankings.add_session(get_session(tmp_path, 'full.csv', 'A', 0., 2 * LAP_DURATION + 1))
+    # Recorded from the middle of the first sector, so that its sector times start with the second sector
+    rankings.add_session(get_session(tmp_path, 'partial.csv', 'B', 25., LAP_DURATION + 5))
+    assert len(rankings.sector_ends[0]) == SECTOR_COUNT
+    laps = rankings.laps
+    for session in range(2):
+        lap_ids = laps['lap_id'][laps['session'] == session]
+        sectors = rankings.sectors[numpy.isin(rankings.sectors['lap_id'], lap_ids)]
+        # Each sector has its own duration, the same in both sessions
+        numpy.testing.assert_allclose(sectors['time'], 20. + sectors['split'])
+    partial_lap_ids = laps['lap_id'][laps['session'] == 1]
+    assert set(rankings.sectors['split'][numpy.isin(rankings.sectors['lap_id'], partial_lap_ids)]) == {1, 2}
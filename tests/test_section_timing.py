@@ -0,0 +1,48 @@
+import numpy
+
+from data_container import DataContainer
+from section_timing import SectorTimes
+
+
+SAMPLE_RATE = 10
+
+
+def get_data(tmp_path,
+             sector_durations: list[float],
+             recording_duration: float,
+             sector_count: int = 3) -> DataContainer:
+    # Sectors of a third of a lap each, driven at constant speed in the given durations, the last sector time channel
+    # holding the duration of the last sector completed
+    end_times = numpy.cumsum(sector_durations)
+    times = numpy.arange(recording_duration * SAMPLE_RATE) / SAMPLE_RATE
+    progress = numpy.interp(times, numpy.append(0., end_times), numpy.arange(len(end_times) + 1) / sector_count)
+    completed = numpy.searchsorted(end_times, times, side='right')
+    last_sector_times = numpy.append(0., sector_durations)[completed]
+    columns = [numpy.char.mod('%.2f', times), numpy.char.mod('%d', progress.astype(int)),
+               numpy.char.mod('%.5f', progress % 1), numpy.char.mod('%.1f', last_sector_times)]
+    data = DataContainer(['time', 'Lap Number', 'Car Pos Norm', 'Last Sector Time'], ['s', '', '', 's'], columns)
+    sample_rates_file = tmp_path / 'sample_rates.txt'
+    sample_rates_file.write_text(f'Channel |   Sample rate (Hz), Default: {SAMPLE_RATE}\n'
+                                 f'time | {SAMPLE_RATE}\nLap Number | {SAMPLE_RATE}\nCar Pos Norm | {SAMPLE_RATE}\n'
+                                 f'Last Sector Time | {SAMPLE_RATE}\n')
+    data.set_sample_rates(str(sample_rates_file))
+    return data
+
+
+def test_sectors_of_repeated_durations_are_kept_in_place(tmp_path):
+    sector_durations = [20., 20., 20., 21., 21., 18., 20., 20., 19.]
+    data = get_data(tmp_path, sector_durations + [5.], sum(sector_durations) + 5.)
+    sector_times = SectorTimes(data, data.get_time_scales())
+    assert sector_times.get_sector_count() == 3
+    numpy.testing.assert_allclose(sector_times.sector_ends, [1 / 3, 2 / 3, 1.], atol=0.01)
+    numpy.testing.assert_allclose(sector_times.table['duration'][:3], numpy.reshape(sector_durations, (3, 3)))
+    numpy.testing.assert_allclose(sector_times.table['end_time'][:3], numpy.reshape(numpy.cumsum(sector_durations),
+                                                                                    (3, 3)), atol=0.2)
+
+
+def test_repeated_sectors_after_the_last_change_are_missing(tmp_path):
+    # Recorded until just before the end of the last sector, so that no change follows the repeated sectors
+    sector_durations = [20., 21., 19., 20., 20., 20.]
+    data = get_data(tmp_path, sector_durations, sum(sector_durations) - 1.)
+    sector_times = SectorTimes(data, data.get_time_scales())
+    numpy.testing.assert_allclose(sector_times.table['duration'][:2], [[20., 21., 19.], [20., numpy.nan, numpy.nan]])
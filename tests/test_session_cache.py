@@ -0,0 +1,52 @@
+import numpy
+import pytest
+
+from benchmark import REQUIRED_CHANNELS, generate_session, get_channels
+from data_container import DataField
+from session_cache import get_cache_file_name, get_narrowest_array, load_session, save_session
+
+
+def test_narrowest_array_holds_the_same_values():
+    assert get_narrowest_array(numpy.array([0, 5, -3])).dtype == numpy.int8
+    assert get_narrowest_array(numpy.array([0, 40000])).dtype == numpy.int32
+    assert get_narrowest_array(numpy.array([0.5, numpy.nan, 2.])).dtype == numpy.float32
+    assert get_narrowest_array(numpy.array([0.1, 2.])).dtype == numpy.float64
+    assert get_narrowest_array(numpy.array([1e300])).dtype == numpy.float64
+
+
+def test_cached_session_matches_parsed_session(tmp_path):
+    data_file = str(tmp_path / 'session.csv')
+    sample_rates_file = str(tmp_path / 'sample_rates.txt')
+    generate_session(data_file, sample_rates_file, get_channels(len(REQUIRED_CHANNELS)), duration=10.)
+    _, _, parsed_data = load_session(data_file, sample_rates_file)
+    _, _, cached_data = load_session(data_file, sample_rates_file)
+    for name, parsed_field in parsed_data.get_fields().items():
+        cached_field = getattr(cached_data, name)
+        assert isinstance(cached_field.values, numpy.memmap)
+        assert cached_field.indices.dtype == numpy.int32
+        numpy.testing.assert_array_equal(cached_field.indices, parsed_field.indices)
+        numpy.testing.assert_array_equal(cached_field.values, parsed_field.values)
+
+
+def test_cache_errors_are_raised_or_recorded(tmp_path):
+    data_file = str(tmp_path / 'session.csv')
+    sample_rates_file = str(tmp_path / 'sample_rates.txt')
+    generate_session(data_file, sample_rates_file, get_channels(len(REQUIRED_CHANNELS)), duration=10.)
+    # A directory in place of the cache file cannot be replaced
+    (tmp_path / 'session.session.npz').mkdir()
+    with pytest.raises(OSError):
+        load_session(data_file, sample_rates_file)
+    cache_errors = {}
+    _, _, data = load_session(data_file, sample_rates_file, cache_errors)
+    assert len(data.get_fields()) == len(REQUIRED_CHANNELS)
+    assert isinstance(cache_errors[data_file], OSError)
+
+
+def test_channels_of_objects_are_not_cached(tmp_path):
+    data_file = str(tmp_path / 'session.csv')
+    sample_rates_file = str(tmp_path / 'sample_rates.txt')
+    generate_session(data_file, sample_rates_file, get_channels(len(REQUIRED_CHANNELS)), duration=10.)
+    header, info, data = load_session(data_file, sample_rates_file)
+    data.add_field('objects', DataField('Objects', '', ['1', 'null']))
+    with pytest.raises(ValueError):
+        save_session(get_cache_file_name(data_file), {}, header, info, data)
@@ -0,0 +1,120 @@
+import numpy
+import pytest
+
+from benchmark import REQUIRED_CHANNELS, generate_session, get_channels
+from channel_statistics import PERCENTILES, ChannelStatistics
+from coordinates_handler import Section
+from session_registry import SessionRegistry
+
+
+def test_malformed_files_are_left_out_of_the_index(tmp_path):
+    generate_session(str(tmp_path / 'session.csv'), str(tmp_path / 'sample_rates.txt'),
+                     get_channels(len(REQUIRED_CHANNELS)), duration=10.)
+    (tmp_path / 'truncated.csv').write_text('Format,AC telemetry\nVersion,1\n')
+    (tmp_path / 'malformed.csv').write_text('Format,AC telemetry\nVersion\n\n')
+    registry = SessionRegistry(str(tmp_path), sample_rates_file=str(tmp_path / 'sample_rates.txt'))
+    assert list(registry.sessions) == ['session.csv']
+    assert set(registry.errors) == {'truncated.csv', 'malformed.csv'}
+
+    # Indexed once the file has been completed
+    (tmp_path / 'truncated.csv').write_text((tmp_path / 'session.csv').read_text())
+    registry.index()
+    assert sorted(registry.sessions) == ['session.csv', 'truncated.csv']
+    assert set(registry.errors) == {'malformed.csv'}
+
+
+def test_derived_arrays_count_towards_the_memory_budget(tmp_path):
+    for file_name in ('first.csv', 'second.csv'):
+        generate_session(str(tmp_path / file_name), str(tmp_path / 'sample_rates.txt'),
+                         get_channels(len(REQUIRED_CHANNELS)), duration=10.)
+    evicted = []
+    registry = SessionRegistry(str(tmp_path), sample_rates_file=str(tmp_path / 'sample_rates.txt'),
+                               on_evict=evicted.append)
+    session = registry.get('first.csv')
+    size = session.get_memory_size()
+    assert size > 0
+    lap_number = int(session.lap_index.numbers[0])
+    session.get_resampler().get_times(lap_number, 1000)
+    session.get_spatial_index(lap_number)
+    assert session.get_memory_size() > size
+
+    # Both sessions fit by their channels only, not with the arrays derived from the first one
+    registry.memory_budget = session.get_memory_size() + size - 1
+    registry.get('second.csv')
+    assert registry.get_loaded_session_names() == ['second.csv']
+    assert evicted == ['first.csv']
+
+
+def get_dense_statistics(samples: numpy.ndarray, sample_rate: int) -> dict[str, float]:
+    # Statistics of a channel computed from every sample, each lasting one sample period
+    statistics = dict(duration=len(samples) / sample_rate, min=samples.min(), max=samples.max(), mean=samples.mean(),
+                      std=samples.std())
+    for name, fraction in PERCENTILES.items():
+        statistics[name] = numpy.percentile(samples, 100 * fraction, method='inverted_cdf')
+    return statistics
+
+
+def test_channel_statistics_match_the_samples(tmp_path):
+    generate_session(str(tmp_path / 'session.csv'), str(tmp_path / 'sample_rates.txt'),
+                     get_channels(len(REQUIRED_CHANNELS)), duration=200.)
+    registry = SessionRegistry(str(tmp_path), sample_rates_file=str(tmp_path / 'sample_rates.txt'))
+    session = registry.get('session.csv')
+    sections = [Section('A', 0.1, 0.4), Section('B', 0.9, 0.2)]
+    statistics = session.get_channel_statistics('ground_speed', sections)
+    section_times = session.get_section_times(sections)
+
+    field = session.data.ground_speed
+    sample_rate = field.sample_rate['current']
+    time_scale = session.time_scales[sample_rate]
+    samples = field[(numpy.arange(len(time_scale)), sample_rate)].astype(float)
+    lap_index = session.lap_index
+    for lap_position in range(len(lap_index)):
+        lap_samples = samples[lap_index.start_indices[sample_rate][lap_position]:
+                              lap_index.end_indices[sample_rate][lap_position]]
+        for name, value in get_dense_statistics(lap_samples, sample_rate).items():
+            assert statistics.laps[name][lap_position] == pytest.approx(value), name
+        for section_position in range(len(sections)):
+            section_time = section_times.table[lap_position, section_position]
+            if numpy.isnan(section_time['duration']):
+                continue
+            in_section = (time_scale >= section_time['entry_time']) & (time_scale < section_time['exit_time'])
+            for name, value in get_dense_statistics(samples[in_section], sample_rate).items():
+                assert statistics.sections[name][lap_position, section_position] == pytest.approx(value), name
+
+
+def test_channel_statistics_are_saved_per_channel_and_sections(tmp_path, monkeypatch):
+    generate_session(str(tmp_path / 'session.csv'), str(tmp_path / 'sample_rates.txt'),
+                     get_channels(len(REQUIRED_CHANNELS)), duration=200.)
+    registry = SessionRegistry(str(tmp_path), sample_rates_file=str(tmp_path / 'sample_rates.txt'))
+    session = registry.get('session.csv')
+    first_sections = [Section('A', 0.1, 0.4)]
+    second_sections = [Section('A', 0.5, 0.9)]
+    first_statistics = session.get_channel_statistics('ground_speed', first_sections)
+    second_statistics = session.get_channel_statistics('ground_speed', second_sections)
+    assert session.get_section_times(first_sections) is not session.get_section_times(second_sections)
+    # Sections not driven through last no time
+    numpy.testing.assert_allclose(second_statistics.sections['duration'],
+                                  numpy.nan_to_num(session.get_section_times(second_sections).table['duration']))
+    assert not numpy.allclose(first_statistics.sections['mean'], second_statistics.sections['mean'])
+    assert session.get_channel_statistics('ground_speed', first_sections) is first_statistics
+
+    # The statistics of another channel are written without rewriting the files already saved
+    statistics_directory = tmp_path / 'session.statistics'
+    mtimes = {file.name: file.stat().st_mtime_ns for file in statistics_directory.iterdir()}
+    assert len(mtimes) == 2
+    session.get_channel_statistics('throttle_pos', first_sections)
+    assert {file.name: file.stat().st_mtime_ns for file in statistics_directory.iterdir()
+            if file.name in mtimes} == mtimes
+    assert len(list(statistics_directory.iterdir())) == 3
+    assert not session.statistics_errors
+
+    # Read back by a new registry without being computed again
+    def from_field(*arguments, **keywords):
+        raise AssertionError('Statistics computed again')
+    monkeypatch.setattr(ChannelStatistics, 'from_field', from_field)
+    session = SessionRegistry(str(tmp_path), sample_rates_file=str(tmp_path / 'sample_rates.txt')).get('session.csv')
+    for sections, statistics in ((first_sections, first_statistics), (second_sections, second_statistics)):
+        loaded_statistics = session.get_channel_statistics('ground_speed', sections)
+        for name, array in statistics.get_arrays().items():
+            loaded_array = loaded_statistics.get_arrays()[name]
+            assert loaded_array.dtype == array.dtype and loaded_array.tobytes() == array.tobytes(), name
@@ -0,0 +1,35 @@
+import os
+
+from benchmark import LAP_DURATION, REQUIRED_CHANNELS, generate_session, get_channels
+from session_registry import SessionRegistry
+from track_outline import get_outline_file_name, get_track_outline
+
+
+def get_registry(tmp_path) -> SessionRegistry:
+    for seed, file_name in enumerate(('first.csv', 'second.csv')):
+        generate_session(str(tmp_path / file_name), str(tmp_path / 'sample_rates.txt'),
+                         get_channels(len(REQUIRED_CHANNELS)), duration=2 * LAP_DURATION, seed=seed)
+    return SessionRegistry(str(tmp_path), sample_rates_file=str(tmp_path / 'sample_rates.txt'))
+
+
+def test_outline_is_kept_whichever_sessions_are_loaded(tmp_path):
+    registry = get_registry(tmp_path)
+    outline = get_track_outline(str(tmp_path), 'benchmark', [registry.get('first.csv')])
+    assert list(outline.reference_files) == ['first.csv']
+    outline_file = get_outline_file_name(str(tmp_path), 'benchmark')
+    modification_time = os.stat(outline_file).st_mtime_ns
+    # Loading another session of the track neither builds nor writes the outline again
+    sessions = [registry.get('first.csv'), registry.get('second.csv')]
+    assert get_track_outline(str(tmp_path), 'benchmark', sessions) is outline
+    assert os.stat(outline_file).st_mtime_ns == modification_time
+
+
+def test_outline_is_rebuilt_when_a_reference_file_changes(tmp_path):
+    registry = get_registry(tmp_path)
+    outline = get_track_outline(str(tmp_path), 'benchmark', [registry.get('first.csv')])
+    with open(tmp_path / 'first.csv', 'a') as file:
+        file.write('\n')
+    sessions = [registry.get('first.csv'), registry.get('second.csv')]
+    rebuilt_outline = get_track_outline(str(tmp_path), 'benchmark', sessions)
+    assert rebuilt_outline is not outline
+    assert sorted(rebuilt_outline.reference_files) == ['first.csv', 'second.csv']
@@ -0,0 +1,76 @@
+import numpy
+
+from collections import OrderedDict
+
+from data_container import DataContainer, get_time_trace, get_xy_trace
+from downsampling import DEFAULT_MAX_POINTS, downsample_trace
+
+
+DEFAULT_MAX_BYTES = 256 * 2**20
+
+
+class TraceCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        # Plotly trace dicts keyed by (session, channel, x-axis mode, lap[, max points]), least recently used first
+        self.max_bytes: int = max_bytes
+        self.size: int = 0
+        self._traces: OrderedDict[tuple, dict] = OrderedDict()
+        self._sizes: dict[tuple, int] = {}
+
+    def get_trace(self,
+                  session: str,
+                  data: DataContainer,
+                  time_scales: dict,
+                  channel_name: str,
+                  x_axis: str = 'time',
+                  lap_number: int | None = None) -> dict:
+        # x_axis is either 'time' or the name of the channel to plot channel_name against
+        key = (session, channel_name, x_axis, lap_number)
+        if key in self._traces:
+            self._traces.move_to_end(key)
+            return self._traces[key]
+        if lap_number is not None:
+            data = data.lap(lap_number)
+        if x_axis == 'time':
+            trace = get_time_trace(data, time_scales, channel_name).to_plotly_json()
+        else:
+            trace = get_xy_trace(data, x_axis, channel_name).to_plotly_json()
+        self._add(key, trace)
+        return trace
+
+    def get_downsampled_trace(self,
+                              session: str,
+                              data: DataContainer,
+                              time_scales: dict,
+                              channel_name: str,
+                              lap_number: int | None = None,
+                              x_range: tuple[float, float] | None = None,
+                              max_points: int = DEFAULT_MAX_POINTS) -> dict:
+        # Time trace reduced to about max_points points over x_range, only the full range view is cached
+        trace = self.get_trace(session, data, time_scales, channel_name, 'time', lap_number)
+        if x_range is not None:
+            return downsample_trace(trace, max_points, x_range)
+        key = (session, channel_name, 'time', lap_number, max_points)
+        if key in self._traces:
+            self._traces.move_to_end(key)
+            return self._traces[key]
+        downsampled_trace = downsample_trace(trace, max_points)
+        self._add(key, downsampled_trace)
+        return downsampled_trace
+
+    def _add(self, key: tuple, trace: dict):
+        size = sum(value.nbytes for value in trace.values() if isinstance(value, numpy.ndarray))
+        self._traces[key] = trace
+        self._sizes[key] = size
+        self.size += size
+        while self.size > self.max_bytes and len(self._traces) > 1:
+            evicted_key, _ = self._traces.popitem(last=False)
+            self.size -= self._sizes.pop(evicted_key)
+
+    def clear(self, session: str | None = None):
+        for key in [key for key in self._traces if session is None or key[0] == session]:
+            del self._traces[key]
+            self.size -= self._sizes.pop(key)
+
+    def __len__(self):
+        return len(self._traces)
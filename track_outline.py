@@ -0,0 +1,205 @@
+import json
+import numpy
+import os
+import plotly
+import plotly.graph_objects
+
+from coordinates_handler import Section
+from distance_resampling import DistanceResampler
+from session_cache import get_source_stat
+from session_registry import Session
+
+
+# Increment when the construction of the outline changes, so that stale cache files are rebuilt
+OUTLINE_VERSION = 2
+
+DEFAULT_RESOLUTION = 1000
+# Maximum distance in metres between a simplified polyline and the points it replaces
+DEFAULT_TOLERANCE = 0.5
+# Lateral spread of the laps kept in the width envelope, outliers such as spins being left out
+ENVELOPE_PERCENTILES = (5, 95)
+
+
+def simplify_polyline(points: numpy.ndarray, tolerance: float = DEFAULT_TOLERANCE) -> numpy.ndarray:
+    # Douglas-Peucker simplification of an (n, 2) polyline, with an explicit stack instead of recursion
+    if len(points) < 3:
+        return points
+    keep = numpy.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        segment_length = numpy.hypot(*segment)
+        if segment_length == 0:
+            distances = numpy.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = numpy.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / segment_length
+        farthest = numpy.argmax(distances)
+        if distances[farthest] > tolerance:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            stack += [(start, middle), (middle, end)]
+    return points[keep]
+
+
+class TrackOutline:
+    def __init__(self,
+                 track: str,
+                 centre: numpy.ndarray,
+                 left_offsets: numpy.ndarray,
+                 right_offsets: numpy.ndarray,
+                 tolerance: float = DEFAULT_TOLERANCE,
+                 reference_files: dict[str, dict] | None = None):
+        # centre holds the (x, y) median position of the laps at each point of a regular car_pos_norm grid, and
+        # the offsets the extent of the laps on each side of it along the normal, positive to the left.
+        # reference_files holds the size and modification time of the session files it was built from, by name.
+        self.track: str = track
+        self.reference_files: dict[str, dict] = reference_files or {}
+        self.centre: numpy.ndarray = centre
+        self.left_offsets: numpy.ndarray = left_offsets
+        self.right_offsets: numpy.ndarray = right_offsets
+        self.tolerance: float = tolerance
+        self.grid: numpy.ndarray = numpy.linspace(0, 1, len(centre), endpoint=False)
+        self.normals: numpy.ndarray = self._get_normals(centre)
+        left_edge = self.get_edge(left_offsets)
+        right_edge = self.get_edge(right_offsets)
+        covered = numpy.flatnonzero(numpy.isfinite(numpy.hstack([centre, left_edge, right_edge])).all(axis=1))
+        # Closed polylines, from the start/finish line back to it
+        closed = numpy.append(covered, covered[:1])
+        self.centreline: numpy.ndarray = simplify_polyline(centre[closed], tolerance)
+        self.left_edge: numpy.ndarray = simplify_polyline(left_edge[closed], tolerance)
+        self.right_edge: numpy.ndarray = simplify_polyline(right_edge[closed], tolerance)
+
+    @classmethod
+    def from_sessions(cls,
+                      directory: str,
+                      track: str,
+                      sessions: list[Session],
+                      resolution: int = DEFAULT_RESOLUTION,
+                      tolerance: float = DEFAULT_TOLERANCE) -> 'TrackOutline':
+        # Aggregates the trajectories of every lap of the sessions, read from directory, on a shared car_pos_norm
+        # grid
+        x_laps, y_laps = [], []
+        for session in sessions:
+            resampler = DistanceResampler(session.data, session.time_scales, 'car_pos_norm')
+            for lap_number in session.lap_index.numbers:
+                x_laps.append(resampler.resample(int(lap_number), 'car_coord_x', resolution))
+                y_laps.append(resampler.resample(int(lap_number), 'car_coord_y', resolution))
+        if not x_laps:
+            raise ValueError(f'No lap to build the outline of {track} from')
+        x_laps, y_laps = numpy.array(x_laps), numpy.array(y_laps)
+        # Grid points no lap goes through are left out of the aggregation, and are NaN in the outline
+        covered = ~numpy.isnan(x_laps).all(axis=0)
+        centre = numpy.full((resolution, 2), numpy.nan)
+        centre[covered, 0] = numpy.nanmedian(x_laps[:, covered], axis=0)
+        centre[covered, 1] = numpy.nanmedian(y_laps[:, covered], axis=0)
+        normals = cls._get_normals(centre)
+        offsets = (x_laps - centre[:, 0]) * normals[:, 0] + (y_laps - centre[:, 1]) * normals[:, 1]
+        measured = ~numpy.isnan(offsets).all(axis=0)
+        left_offsets = numpy.full(resolution, numpy.nan)
+        right_offsets = numpy.full(resolution, numpy.nan)
+        right_offsets[measured], left_offsets[measured] = numpy.nanpercentile(offsets[:, measured],
+                                                                              ENVELOPE_PERCENTILES, axis=0)
+        reference_files = {session.name: get_source_stat(os.path.join(directory, session.name)) for session in sessions}
+        return cls(track, centre, left_offsets, right_offsets, tolerance, reference_files)
+
+    @staticmethod
+    def _get_normals(centre: numpy.ndarray) -> numpy.ndarray:
+        # Unit vectors pointing to the left of the direction of travel, the grid wrapping around at the line
+        tangents = numpy.roll(centre, -1, axis=0) - numpy.roll(centre, 1, axis=0)
+        lengths = numpy.hypot(tangents[:, 0], tangents[:, 1])
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return numpy.stack([-tangents[:, 1], tangents[:, 0]], axis=1) / lengths[:, None]
+
+    def is_up_to_date(self, directory: str) -> bool:
+        # Whether the session files the outline was built from are still in directory, unchanged
+        for name, source_stat in self.reference_files.items():
+            data_file = os.path.join(directory, name)
+            if not os.path.exists(data_file) or get_source_stat(data_file) != source_stat:
+                return False
+        return True
+
+    def get_edge(self, offsets: numpy.ndarray) -> numpy.ndarray:
+        return self.centre + self.normals * offsets[:, None]
+
+    def get_position(self, car_pos_norm: float | numpy.ndarray) -> numpy.ndarray:
+        # Point of the centreline at the given fraction of the lap, interpolated between grid points
+        car_pos_norm = numpy.mod(car_pos_norm, 1.)
+        grid = numpy.append(self.grid, 1.)
+        centre = numpy.append(self.centre, self.centre[:1], axis=0)
+        return numpy.stack([numpy.interp(car_pos_norm, grid, centre[:, 0]),
+                            numpy.interp(car_pos_norm, grid, centre[:, 1])], axis=-1)
+
+    def get_boundary(self, car_pos_norm: float) -> numpy.ndarray:
+        # Segment across the track from the right edge to the left edge at the given fraction of the lap
+        position = int(round(numpy.mod(car_pos_norm, 1.) * len(self.grid))) % len(self.grid)
+        return numpy.array([self.get_edge(self.right_offsets)[position], self.get_edge(self.left_offsets)[position]])
+
+    def plot(self, figure: plotly.graph_objects.Figure, sections: list[Section] | None = None):
+        for name, edge in (('Bord gauche', self.left_edge), ('Bord droit', self.right_edge)):
+            figure.add_trace(plotly.graph_objects.Scatter(x=edge[:, 0], y=edge[:, 1], mode='lines', name=name,
+                                                          line=dict(color='grey', width=1), hoverinfo='skip'))
+        for section in sections or []:
+            for car_pos_norm in (section.start, section.stop):
+                boundary = self.get_boundary(car_pos_norm)
+                figure.add_trace(plotly.graph_objects.Scatter(x=boundary[:, 0], y=boundary[:, 1], mode='lines',
+                                                              name=section.title, showlegend=False,
+                                                              line=dict(color='orange', width=2), hoverinfo='name'))
+        figure.update_yaxes(scaleanchor="x", scaleratio=1)
+
+    def save(self, file_name: str, cache_key: dict):
+        with open(file_name, 'w') as file:
+            json.dump(dict(cache_key,
+                           track=self.track,
+                           tolerance=self.tolerance,
+                           reference_files=self.reference_files,
+                           centre=self.centre.tolist(),
+                           left_offsets=self.left_offsets.tolist(),
+                           right_offsets=self.right_offsets.tolist()), file)
+
+    @classmethod
+    def load(cls, file_name: str, cache_key: dict) -> 'TrackOutline | None':
+        try:
+            with open(file_name, 'r') as file:
+                outline = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if any(outline.get(key) != value for key, value in cache_key.items()):
+            return None
+        return cls(outline['track'],
+                   numpy.array(outline['centre'], dtype=float),
+                   numpy.array(outline['left_offsets'], dtype=float),
+                   numpy.array(outline['right_offsets'], dtype=float),
+                   outline['tolerance'],
+                   outline['reference_files'])
+
+
+def get_outline_file_name(directory: str, track: str) -> str:
+    return os.path.join(directory, track + '.track.json')
+
+
+_outlines: dict[tuple, TrackOutline] = {}
+
+
+def get_track_outline(directory: str,
+                      track: str,
+                      sessions: list[Session],
+                      resolution: int = DEFAULT_RESOLUTION,
+                      tolerance: float = DEFAULT_TOLERANCE) -> TrackOutline:
+    # Kept in memory and in directory per track and settings, whichever sessions are loaded, as long as the
+    # session files it was built from are unchanged. Built from sessions otherwise.
+    cache_key = dict(outline_version=OUTLINE_VERSION, resolution=resolution, tolerance=tolerance)
+    file_name = get_outline_file_name(directory, track)
+    key = (file_name, resolution, tolerance)
+    outline = _outlines.get(key)
+    if outline is None:
+        outline = TrackOutline.load(file_name, cache_key)
+    if outline is None or not outline.is_up_to_date(directory):
+        outline = TrackOutline.from_sessions(directory, track, sessions, resolution, tolerance)
+        outline.save(file_name, cache_key)
+    _outlines[key] = outline
+    return outline